@@ -0,0 +1,163 @@
+"""
+Memoized resell analyses keyed on normalized item and comparables fingerprints
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+ANALYSIS_CACHE_TTL = float(os.getenv('ANALYSIS_CACHE_TTL', '900'))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', '1024'))
+
+# Near-match mode reuses an analysis for items of the same brand, category and
+# condition whose prices fall in the same bucket
+ANALYSIS_CACHE_NEAR_MATCH = os.getenv('ANALYSIS_CACHE_NEAR_MATCH', 'false').lower() in ('1', 'true', 'yes')
+ANALYSIS_CACHE_PRICE_BUCKET = float(os.getenv('ANALYSIS_CACHE_PRICE_BUCKET', '5'))
+
+# Item fields that influence the analysis
+FINGERPRINT_FIELDS = ('title', 'price', 'brand', 'size', 'category', 'condition')
+
+
+def normalize_text(value):
+    """Lowercase and collapse whitespace so cosmetic differences share a key"""
+    return ' '.join(str(value or '').lower().split())
+
+
+def parse_price(value):
+    """Return a price as a float, or None when it cannot be parsed"""
+    try:
+        return float(str(value).replace('€', '').replace(',', '.').strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def item_fingerprint(item_data):
+    """Normalized tuple of the item fields sent to the model"""
+    fingerprint = []
+    for field in FINGERPRINT_FIELDS:
+        if field == 'price':
+            price = parse_price(item_data.get('price'))
+            fingerprint.append(f"{price:.2f}" if price is not None else '')
+        else:
+            fingerprint.append(normalize_text(item_data.get(field)))
+    return tuple(fingerprint)
+
+
+def comparison_hash(comparison_data):
+    """Order-independent hash of the comparable items"""
+    encoded = sorted(json.dumps(item, sort_keys=True, default=str) for item in comparison_data or [])
+    return hashlib.sha256('\n'.join(encoded).encode('utf-8')).hexdigest()
+
+
+def analysis_key(item_data, comparison_data):
+    """Exact cache key for an item and its comparables"""
+    payload = json.dumps([item_fingerprint(item_data), comparison_hash(comparison_data)])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def near_match_key(item_data, bucket_size=ANALYSIS_CACHE_PRICE_BUCKET):
+    """Brand/category/condition/price-bucket key, or None if the item is too vague"""
+    brand = normalize_text(item_data.get('brand'))
+    category = normalize_text(item_data.get('category'))
+    price = parse_price(item_data.get('price'))
+    if not brand or not category or price is None:
+        return None
+    bucket = int(price // bucket_size) if bucket_size > 0 else price
+    return (brand, category, normalize_text(item_data.get('condition')), bucket)
+
+
+class AnalysisCache:
+    """LRU cache of analysis dicts with TTL and optional near-match lookups"""
+
+    def __init__(self, ttl=ANALYSIS_CACHE_TTL, max_entries=ANALYSIS_CACHE_MAX_ENTRIES,
+                 near_match=ANALYSIS_CACHE_NEAR_MATCH):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.near_match = near_match
+
+        self._entries = OrderedDict()
+        self._near_index = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            'exact_hits': 0,
+            'near_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+        }
+
+    def _lookup(self, key, now):
+        """Return a live entry's analysis, dropping it if expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def get(self, item_data, comparison_data):
+        """Return (analysis, match) where match is 'exact', 'near' or None"""
+        key = analysis_key(item_data, comparison_data)
+        near_key = near_match_key(item_data) if self.near_match else None
+        now = time.time()
+
+        with self._lock:
+            analysis = self._lookup(key, now)
+            if analysis is not None:
+                self._counters['exact_hits'] += 1
+                return dict(analysis), 'exact'
+
+            if near_key is not None and near_key in self._near_index:
+                analysis = self._lookup(self._near_index[near_key], now)
+                if analysis is not None:
+                    self._counters['near_hits'] += 1
+                    return dict(analysis), 'near'
+                del self._near_index[near_key]
+
+            self._counters['misses'] += 1
+            return None, None
+
+    def set(self, item_data, comparison_data, analysis):
+        """Remember a model analysis for this item and comparables"""
+        key = analysis_key(item_data, comparison_data)
+        near_key = near_match_key(item_data)
+
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, dict(analysis))
+            self._entries.move_to_end(key)
+            if near_key is not None:
+                self._near_index[near_key] = key
+            self._counters['stores'] += 1
+
+            # Stale near-index pointers are dropped lazily on lookup
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+            if len(self._near_index) > 2 * self.max_entries:
+                self._near_index = {
+                    near: exact for near, exact in self._near_index.items() if exact in self._entries
+                }
+
+    def clear(self):
+        """Drop every cached analysis"""
+        with self._lock:
+            self._entries.clear()
+            self._near_index.clear()
+
+    def stats(self):
+        """Hit/miss counters and cache size"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            stats['near_match'] = self.near_match
+        lookups = stats['exact_hits'] + stats['near_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['exact_hits'] + stats['near_hits']) / lookups, 3) if lookups else None
+        return stats
+
+
+analysis_cache = AnalysisCache()
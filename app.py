@@ -1,21 +1,81 @@
-from flask import Flask, render_template, request, jsonify
-import requests
-from bs4 import BeautifulSoup
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
 import openai
 import os
 import json
+import hmac
 from datetime import datetime
 import re
+import math
+import queue
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
-# Load environment variables
+# Load environment variables before the local modules read their settings
 load_dotenv()
 
+from fetcher import shared_fetcher
+from history import HISTORY_COMPARABLES, QUERY_MAX_ROWS, analysis_history
+from item_cache import item_cache
+from analysis_cache import analysis_cache, analysis_key, parse_price
+from comparables import ComparablesStore
+from sold_items import SoldItemsDataset
+from extractor import extract_item_fields, parse_stats
+from singleflight import single_flight
+from json_stream import JSONObjectStream, extract_json_array, extract_json_object
+from jobs import FINISHED, JobQueue, WorkerPool
+from metrics import CONTENT_TYPE, metrics, record_analysis, record_llm_call, stage_timer
+from pricing_model import PRICING_ROUTER, router_stats, timed_route
+from profiler import PROFILE_SAMPLE_RATE, request_profiler
+from prompts import build_analysis_messages, build_packed_messages, prompt_stats
+from resilience import CircuitBreaker, Deadline, DeadlineExceeded, hedge_delay, hedged_call
+from watcher import AlertStore, listing_score
+
 app = Flask(__name__)
 
 # Configure OpenAI
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+# Batch analysis settings
+BATCH_MAX_URLS = int(os.getenv('BATCH_MAX_URLS', '50'))
+SCRAPE_WORKERS = int(os.getenv('SCRAPE_WORKERS', '50'))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+
+# Shared worker pools: scraping is I/O bound and can fan out widely, while
+# the analysis pool caps how many OpenAI calls run at once
+scrape_executor = ThreadPoolExecutor(max_workers=SCRAPE_WORKERS, thread_name_prefix='scrape')
+analysis_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix='analysis')
+
+# Seconds an analysis request may take before the model is given up on in
+# favour of the heuristic fallback
+ANALYSIS_LATENCY_BUDGET = float(os.getenv('ANALYSIS_LATENCY_BUDGET', '25'))
+
+# Optional faster model raced against the primary one once only
+# LLM_HEDGE_REMAINING seconds of the budget are left
+LLM_HEDGE_MODEL = os.getenv('LLM_HEDGE_MODEL', '')
+LLM_HEDGE_REMAINING = float(os.getenv('LLM_HEDGE_REMAINING', '8'))
+
+# Threads making the (possibly hedged) model calls
+LLM_CALL_WORKERS = int(os.getenv('LLM_CALL_WORKERS', '64'))
+llm_call_executor = ThreadPoolExecutor(max_workers=LLM_CALL_WORKERS, thread_name_prefix='llm')
+
+# Stream model replies and stop reading once every analysis field is complete
+LLM_STREAM = os.getenv('LLM_STREAM', 'true').lower() in ('1', 'true', 'yes')
+
+# Runs streamed analyses whose partial fields are forwarded to the client
+stream_executor = ThreadPoolExecutor(max_workers=LLM_CALL_WORKERS, thread_name_prefix='stream')
+
+# Sends analyses straight to the heuristic fallback while OpenAI is failing
+llm_breaker = CircuitBreaker('openai')
+
+# Admin token required for cache management endpoints (disabled when unset)
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# Vinted item URLs look like /items/<numeric id>-<slug>
+ITEM_ID_PATTERN = re.compile(r'/items/(\d+)')
+
 # Mock product database with sold items for comparison
 MOCK_SOLD_ITEMS = [
     {
@@ -150,229 +210,57 @@ MOCK_SOLD_ITEMS = [
     }
 ]
 
+def load_comparables_store():
+    """Use the on-disk sold items dataset when configured, else the mock items"""
+    dataset_path = os.getenv('SOLD_ITEMS_DATASET')
+    if dataset_path:
+        try:
+            dataset = SoldItemsDataset(dataset_path)
+            print(f"Loaded {len(dataset)} sold items from {dataset_path}")
+            return ComparablesStore.from_dataset(dataset)
+        except (OSError, ValueError) as e:
+            print(f"Error loading sold items dataset, using mock items: {e}")
+    return ComparablesStore(MOCK_SOLD_ITEMS)
+
+# Indexed comparables, built once per worker
+comparables_store = load_comparables_store()
+
+# Past model analyses join the comparables as they are stored; a dataset-backed store is read-only.
+# Delivery waits for the history writer, started with each worker's first request
+if HISTORY_COMPARABLES and not comparables_store.read_only:
+    analysis_history.subscribe(comparables_store.add_many)
+
+def extract_item_id(url):
+    """Return the numeric Vinted item ID from a URL, or None"""
+    item_id_match = ITEM_ID_PATTERN.search(url)
+    return item_id_match.group(1) if item_id_match else None
+
+def record_history(item_data, analysis):
+    """Queue a freshly made analysis for the analysis history and return it
+
+    Memoized analyses are skipped, so repeat lookups of a listing never
+    count as more sales of it.
+    """
+    if item_data and analysis and analysis.get('source') != 'cache':
+        analysis_history.record(extract_item_id(item_data.get('url') or ''), item_data, analysis)
+    return analysis
+
+def is_admin_request():
+    """Check the request's admin token against ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+
 def scrape_vinted_item(url):
     """Scrape product information from Vinted item page"""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Cache-Control': 'no-cache',
-            'Pragma': 'no-cache',
-        }
-        
-        # Try with session for better handling
-        session = requests.Session()
-        session.headers.update(headers)
-        
-        response = session.get(url, timeout=20)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Extract product information with more comprehensive selectors
-        title = ""
-        price = ""
-        brand = ""
-        size = ""
-        category = ""
-        condition = ""
-        
-        # Try multiple selectors for title
-        title_selectors = [
-            'h1[data-testid="item-title"]',
-            'h1',
-            '[data-testid="item-title"]',
-            '.item-title',
-            'title'
-        ]
-        
-        for selector in title_selectors:
-            title_elem = soup.select_one(selector)
-            if title_elem:
-                title = title_elem.get_text().strip()
-                if title and title != "Vinted":
-                    break
-        
-        # Try multiple selectors for price - Vinted specific
-        price_selectors = [
-            '[data-testid="item-price"]',
-            '[data-testid="price"]',
-            '.web_ui__Text__text',
-            '[class*="price"]',
-            '[class*="Price"]',
-            'span[class*="price"]',
-            'div[class*="price"]',
-            '[class*="amount"]',
-            '[class*="Amount"]',
-            'span[class*="amount"]',
-            'div[class*="amount"]',
-            '[data-testid*="price"]',
-            '[data-testid*="Price"]',
-            '[class*="cost"]',
-            '[class*="Cost"]',
-            # Vinted specific selectors
-            '[data-testid="item-price"] span',
-            '[data-testid="price"] span',
-            '.web_ui__Text__text[class*="price"]',
-            '.web_ui__Text__text[class*="Price"]',
-            # Look for any element containing price-like text
-            'span:contains("€")',
-            'div:contains("€")',
-            'p:contains("€")'
-        ]
-        
-        for selector in price_selectors:
-            price_elem = soup.select_one(selector)
-            if price_elem:
-                price_text = price_elem.get_text().strip()
-                print(f"Found price element with text: {price_text}")  # Debug
-                
-                # Look for various price formats
-                price_patterns = [
-                    r'€(\d+(?:[.,]\d+)?)',
-                    r'(\d+(?:[.,]\d+)?)\s*€',
-                    r'(\d+(?:[.,]\d+)?)',
-                    r'(\d+)\s*EUR',
-                    r'(\d+)\s*euro'
-                ]
-                for pattern in price_patterns:
-                    price_match = re.search(pattern, price_text)
-                    if price_match:
-                        price = price_match.group(1).replace(',', '.')
-                        print(f"Extracted price: {price}")  # Debug
-                        break
-                if price:
-                    break
+        # Fetch through the shared pooled client so connections are reused
+        with stage_timer('fetch'):
+            response = shared_fetcher.get(url)
+            response.raise_for_status()
         
-        # If still no price, try to find any number that looks like a price
-        if not price:
-            # Look for any text containing numbers and euro symbols
-            all_text = soup.get_text()
-            price_matches = re.findall(r'€\s*(\d+(?:[.,]\d+)?)', all_text)
-            if price_matches:
-                price = price_matches[0].replace(',', '.')
-                print(f"Found price in page text: {price}")  # Debug
-        
-        # Debug: Print the entire HTML to see what we're working with
-        if not price:
-            print("DEBUG: No price found, printing page structure...")
-            print("Page title:", soup.title.get_text() if soup.title else "No title")
-            print("All text containing '€':")
-            all_text = soup.get_text()
-            euro_lines = [line.strip() for line in all_text.split('\n') if '€' in line]
-            for line in euro_lines[:10]:  # Show first 10 lines with euro
-                print(f"  {line}")
-            
-            # Try to find any number that could be a price (between 5 and 500 euros)
-            all_numbers = re.findall(r'(\d{1,3}(?:[.,]\d{2})?)', all_text)
-            potential_prices = [num for num in all_numbers if 5 <= float(num.replace(',', '.')) <= 500]
-            if potential_prices:
-                # Take the first reasonable price found
-                price = potential_prices[0].replace(',', '.')
-                print(f"Found potential price from numbers: {price}")
-        
-        # Try multiple selectors for brand
-        brand_selectors = [
-            'a[href*="/brand/"]',
-            '[data-testid="item-brand"]',
-            '.brand',
-            '.item-brand',
-            'a[href*="brand"]'
-        ]
-        
-        for selector in brand_selectors:
-            brand_elem = soup.select_one(selector)
-            if brand_elem:
-                brand = brand_elem.get_text().strip()
-                if brand and brand.lower() not in ['brand', 'marque']:
-                    break
-        
-        # Try multiple selectors for size
-        size_selectors = [
-            '[data-testid="item-size"]',
-            '.size',
-            '.item-size',
-            'span:contains("Size")',
-            'span:contains("Taille")'
-        ]
-        
-        for selector in size_selectors:
-            size_elem = soup.select_one(selector)
-            if size_elem:
-                size_text = size_elem.get_text().strip()
-                if 'size' in size_text.lower() or 'taille' in size_text.lower():
-                    # Extract just the size value
-                    size_match = re.search(r'(?:Size|Taille)[:\s]*([^\s]+)', size_text, re.IGNORECASE)
-                    if size_match:
-                        size = size_match.group(1)
-                    else:
-                        size = size_text
-                    break
-        
-        # Try multiple selectors for category
-        category_selectors = [
-            'a[href*="/catalog/"]',
-            '[data-testid="item-category"]',
-            '.category',
-            '.item-category',
-            'nav a[href*="catalog"]'
-        ]
-        
-        for selector in category_selectors:
-            category_elem = soup.select_one(selector)
-            if category_elem:
-                category = category_elem.get_text().strip()
-                if category and category.lower() not in ['catalog', 'catégorie']:
-                    break
-        
-        # Try multiple selectors for condition
-        condition_selectors = [
-            '[data-testid="item-condition"]',
-            '.condition',
-            '.item-condition',
-            'span:contains("Condition")',
-            'span:contains("État")'
-        ]
-        
-        for selector in condition_selectors:
-            condition_elem = soup.select_one(selector)
-            if condition_elem:
-                condition_text = condition_elem.get_text().strip()
-                if 'condition' in condition_text.lower() or 'état' in condition_text.lower():
-                    # Extract just the condition value
-                    condition_match = re.search(r'(?:Condition|État)[:\s]*(.+)', condition_text, re.IGNORECASE)
-                    if condition_match:
-                        condition = condition_match.group(1).strip()
-                    else:
-                        condition = condition_text
-                    break
-        
-        # Fallback: try to extract from breadcrumbs or navigation
-        if not category:
-            breadcrumbs = soup.find_all('a', href=re.compile(r'/catalog/'))
-            if breadcrumbs:
-                category = breadcrumbs[-1].get_text().strip()
-        
-        if not brand:
-            # Try to extract brand from title
-            if title:
-                brand_match = re.search(r'(\w+)\s+(?:Pantalon|Pants|Shirt|T-shirt|Sweater|Jacket|Shoes|Sneakers)', title, re.IGNORECASE)
-                if brand_match:
-                    brand = brand_match.group(1)
-        
-        return {
-            'title': title,
-            'price': price,
-            'brand': brand,
-            'size': size,
-            'category': category,
-            'condition': condition,
-            'url': url
-        }
+        with stage_timer('parse'):
+            return extract_item_fields(response.content, url, extract_item_id(url))
         
     except Exception as e:
         print(f"Error scraping Vinted item: {e}")
@@ -382,8 +270,7 @@ def create_fallback_data(url):
     """Create fallback data when scraping fails"""
     try:
         # Extract item ID from URL
-        item_id_match = re.search(r'/items/(\d+)', url)
-        if not item_id_match:
+        if not extract_item_id(url):
             return None
         
         # Extract basic info from URL path
@@ -460,105 +347,371 @@ def create_fallback_data(url):
         print(f"Error creating fallback data: {e}")
         return None
 
-def analyze_resell_potential(item_data, comparison_data):
-    """Analyze resell potential using OpenAI GPT-4 with much better prompts"""
+# Chat completion settings for resell analyses
+ANALYSIS_COMPLETION = {
+    'model': 'gpt-4',
+    'max_tokens': 800,
+    'temperature': 0.2
+}
+
+# Fields of a complete analysis, in the order the prompt asks for them
+ANALYSIS_FIELDS = ('resellable', 'estimated_resale_price', 'time_to_sell', 'estimated_profit', 'risks')
+
+# Items analysed per model call in packed mode, and the reply tokens allowed for each
+LLM_PACK_SIZE = int(os.getenv('LLM_PACK_SIZE', '8'))
+PACKED_TOKENS_PER_ITEM = 160
+
+# Whether batch requests use packed analyses unless they say otherwise
+BATCH_PACKED = os.getenv('BATCH_PACKED', 'false').lower() in ('1', 'true', 'yes')
+
+def resell_costs(item_data):
+    """Return the item's price and its total cost including shipping and fees"""
+    # Calculate fees and shipping estimates
+    original_price = float(item_data.get('price', 0))
+    shipping_cost = 5.0  # Estimated shipping cost
+    platform_fees = original_price * 0.05  # 5% platform fees
+    total_cost = original_price + shipping_cost + platform_fees
+    return original_price, total_cost
+
+def cached_resell_analysis(item_data, comparison_data, total_cost):
+    """Return a memoized analysis for the item, or None"""
+    # Reuse a recent analysis of the same (or, in near-match mode, a
+    # near-identical) item instead of another model round trip
+    cached_analysis, match = analysis_cache.get(item_data, comparison_data)
+    if cached_analysis and match == 'near':
+        # The resale estimate carries over, but profit depends on this item's price
+        resale_price = parse_price(cached_analysis.get('estimated_resale_price'))
+        if resale_price is not None:
+            cached_analysis['estimated_profit'] = f"€{max(0, resale_price - total_cost):.2f}"
+    if cached_analysis:
+        cached_analysis['source'] = 'cache'
+    return cached_analysis
+
+def fallback_analysis(item_data, comparison_data, original_price, total_cost, reason):
+    """Heuristic analysis labeled with why no model answer was used"""
+    analysis = create_smart_fallback_analysis(item_data, comparison_data, original_price, total_cost)
+    analysis['source'] = 'fallback'
+    analysis['fallback_reason'] = reason
+    return analysis
+
+def accept_model_analysis(analysis, item_data, comparison_data, original_price, total_cost, source='llm'):
+    """Fill in the fields a model analysis left out, label it with its source and memoize it"""
+    # Validate and clean the analysis
+    if not analysis.get('resellable'):
+        analysis['resellable'] = 'No'
+    if not analysis.get('estimated_resale_price'):
+        analysis['estimated_resale_price'] = f"€{original_price + 10:.2f}"
+    if not analysis.get('time_to_sell'):
+        analysis['time_to_sell'] = '7-14 days'
+    if not analysis.get('estimated_profit'):
+        # Calculate a reasonable profit
+        resale_price = float(analysis.get('estimated_resale_price', '€50').replace('€', ''))
+        profit = resale_price - total_cost
+        analysis['estimated_profit'] = f"€{max(0, profit):.2f}"
+    if not analysis.get('risks'):
+        analysis['risks'] = 'Market analysis needed'
+    analysis['source'] = source
+    
+    # Only model answers are memoized; fallbacks are cheap to redo
+    analysis_cache.set(item_data, comparison_data, analysis)
+    return analysis
+
+def parse_resell_analysis(analysis_text, item_data, comparison_data, original_price, total_cost, source='llm'):
+    """Turn the model's reply into an analysis dict labeled with its source, falling back to heuristics"""
+    
+    # Try to extract JSON from the response
     try:
-        # Calculate fees and shipping estimates
-        original_price = float(item_data.get('price', 0))
-        shipping_cost = 5.0  # Estimated shipping cost
-        platform_fees = original_price * 0.05  # 5% platform fees
-        total_cost = original_price + shipping_cost + platform_fees
-        
-        # Prepare a much more detailed and specific prompt
-        prompt = f"""
-You are an expert Vinted reseller with 5+ years of experience. Analyze this item for reselling potential.
-
-ITEM TO ANALYZE:
-- Title: {item_data.get('title', 'N/A')}
-- Current Price: €{item_data.get('price', 'N/A')}
-- Brand: {item_data.get('brand', 'N/A')}
-- Size: {item_data.get('size', 'N/A')}
-- Category: {item_data.get('category', 'N/A')}
-- Condition: {item_data.get('condition', 'N/A')}
-
-SIMILAR SOLD ITEMS (for reference):
-{json.dumps(comparison_data, indent=2)}
-
-ANALYSIS REQUIREMENTS:
-1. Resellability: Consider brand popularity, demand, seasonality, and competition
-2. Resale Price: Base on similar sold items, brand value, and current market
-3. Time to Sell: Consider demand, season, and competition level
-4. Profit Calculation: Resale price - original price - €5 shipping - 5% platform fees
-5. Risks: Market saturation, seasonal factors, condition issues, etc.
-
-Provide your analysis in this EXACT JSON format:
-{{
-    "resellable": "Yes" or "No",
-    "estimated_resale_price": "€XX.XX",
-    "time_to_sell": "X-X days",
-    "estimated_profit": "€XX.XX",
-    "risks": "Specific risk factors"
-}}
-
-IMPORTANT: Be realistic and conservative. Consider that:
-- Vinted has high competition
-- Shipping costs €5
-- Platform fees are 5%
-- Most items take 7-30 days to sell
-- Profit margins are typically 20-50% for good items
-"""
+        # Look for JSON in the response; a reply cut short keeps its complete fields
+        analysis = extract_json_object(analysis_text)
+        if analysis:
+            analysis = accept_model_analysis(analysis, item_data, comparison_data, original_price, total_cost, source)
+        else:
+            # If no JSON found, create a smart fallback based on data
+            analysis = fallback_analysis(item_data, comparison_data, original_price, total_cost, 'unparseable')
+            
+    except (AttributeError, ValueError) as e:
+        print(f"Invalid analysis JSON: {e}")
+        # Create smart fallback analysis
+        analysis = fallback_analysis(item_data, comparison_data, original_price, total_cost, 'unparseable')
+    
+    return analysis
 
+def local_model_analysis(item_data, prediction, original_price, total_cost):
+    """Analysis answered by the local pricing model's prediction"""
+    resale_price = prediction['resale_price']
+    price_low, price_high = prediction['price_interval']
+    days_low, days_high = prediction['days_interval']
+    profit = resale_price - total_cost
+    
+    risks = []
+    if price_low < total_cost:
+        risks.append("May sell below cost at the low end of the price range")
+    if days_high > 30:
+        risks.append("May take over a month to sell")
+    if profit < 10:
+        risks.append("Low profit margin")
+    if not risks:
+        risks.append("Standard market risks")
+    
+    return {
+        "resellable": "Yes" if profit > 5 else "No",
+        "estimated_resale_price": f"€{resale_price:.2f}",
+        "time_to_sell": f"{max(1, int(days_low))}-{max(1, math.ceil(days_high))} days",
+        "estimated_profit": f"€{max(0, profit):.2f}",
+        "risks": ", ".join(risks),
+        "price_range": f"€{price_low:.2f}-€{price_high:.2f}",
+        "source": "local_model"
+    }
+
+def routed_local_analysis(item_data, original_price, total_cost):
+    """The local pricing model's analysis when the router trusts it, else None for the LLM"""
+    if not PRICING_ROUTER:
+        return None
+    try:
+        with stage_timer('local_model'):
+            prediction, route = timed_route(comparables_store.pricing_model(), item_data, original_price)
+    except Exception as e:
+        print(f"Error predicting resale price: {e}")
+        return None
+    if route != 'local':
+        return None
+    return local_model_analysis(item_data, prediction, original_price, total_cost)
+
+def analysis_flight_key(item_data, comparison_data):
+    """Single-flight key shared by analyses of the same item and comparables"""
+    return f"analysis:{analysis_key(item_data, comparison_data)}"
+
+def complete_analysis(model, messages, deadline, on_partial=None):
+    """One chat completion; returns (reply text, usage or None)
+    
+    Streamed replies are read only until every analysis field is complete,
+    calling on_partial with the fields read so far as new ones arrive.
+    """
+    params = dict(ANALYSIS_COMPLETION, model=model)
+    if not LLM_STREAM:
         response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a professional Vinted reseller. Provide realistic, data-driven analysis. Always return valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=800,
-            temperature=0.2
+            messages=messages,
+            request_timeout=max(deadline.remaining(), 1),
+            **params
         )
+        return response.choices[0].message.content.strip(), response.get('usage')
+    
+    reply = JSONObjectStream(ANALYSIS_FIELDS)
+    chunks = openai.ChatCompletion.create(
+        messages=messages,
+        stream=True,
+        request_timeout=max(deadline.remaining(), 1),
+        **params
+    )
+    try:
+        for chunk in chunks:
+            delta = chunk.choices[0].delta.get('content') if chunk.choices else None
+            if delta and reply.feed(delta) and on_partial:
+                on_partial(dict(reply.fields))
+            if reply.complete() or deadline.expired():
+                break
+    finally:
+        # Dropping the response closes the connection, so generation stops too
+        chunks.close()
+    # Streamed replies carry no usage report
+    return reply.text.strip(), None
+
+def request_model_analysis(messages, deadline, on_partial=None):
+    """Chat completion within the deadline; returns ((reply text, usage), hedged)"""
+    def complete(model, on_partial=None):
+        # A profiled request's samples include the pool thread waiting on the model
+        return request_profiler.follow(lambda: complete_analysis(model, messages, deadline, on_partial))
+    
+    # Only the primary call reports partial fields, so they never mix two replies
+    hedge = complete(LLM_HEDGE_MODEL) if LLM_HEDGE_MODEL else None
+    return hedged_call(llm_call_executor, complete(ANALYSIS_COMPLETION['model'], on_partial), deadline,
+                       hedge=hedge, hedge_after=hedge_delay(deadline, LLM_HEDGE_REMAINING))
+
+def analyze_resell_potential(item_data, comparison_data, deadline=None, on_partial=None):
+    """Analyze resell potential using OpenAI GPT-4 with much better prompts
+    
+    The analysis carries a 'source' of 'llm', 'llm_hedge', 'local_model',
+    'cache' or 'fallback' (with a 'fallback_reason'). While the model's
+    reply streams in, on_partial is called with the fields read so far.
+    """
+    with stage_timer('analysis'):
+        analysis = resell_analysis(item_data, comparison_data, deadline, on_partial)
+    record_analysis(analysis)
+    return analysis
+
+def resell_analysis(item_data, comparison_data, deadline=None, on_partial=None):
+    """analyze_resell_potential without the metrics"""
+    if deadline is None:
+        deadline = Deadline(ANALYSIS_LATENCY_BUDGET)
+    try:
+        original_price, total_cost = resell_costs(item_data)
         
-        # Parse the response
-        analysis_text = response.choices[0].message.content.strip()
-        print(f"OpenAI Response: {analysis_text}")  # Debug
+        cached_analysis = cached_resell_analysis(item_data, comparison_data, total_cost)
+        if cached_analysis:
+            return cached_analysis
         
-        # Try to extract JSON from the response
-        try:
-            # Look for JSON in the response
-            json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', analysis_text, re.DOTALL)
-            if json_match:
-                analysis = json.loads(json_match.group())
-                
-                # Validate and clean the analysis
-                if not analysis.get('resellable'):
-                    analysis['resellable'] = 'No'
-                if not analysis.get('estimated_resale_price'):
-                    analysis['estimated_resale_price'] = f"€{original_price + 10:.2f}"
-                if not analysis.get('time_to_sell'):
-                    analysis['time_to_sell'] = '7-14 days'
-                if not analysis.get('estimated_profit'):
-                    # Calculate a reasonable profit
-                    resale_price = float(analysis.get('estimated_resale_price', '€50').replace('€', ''))
-                    profit = resale_price - total_cost
-                    analysis['estimated_profit'] = f"€{max(0, profit):.2f}"
-                if not analysis.get('risks'):
-                    analysis['risks'] = 'Market analysis needed'
-                    
-            else:
-                # If no JSON found, create a smart fallback based on data
-                analysis = create_smart_fallback_analysis(item_data, comparison_data, original_price, total_cost)
-                
-        except json.JSONDecodeError as e:
-            print(f"JSON decode error: {e}")
-            # Create smart fallback analysis
-            analysis = create_smart_fallback_analysis(item_data, comparison_data, original_price, total_cost)
+        # Well-covered, low-value items are priced locally in microseconds
+        local_analysis = routed_local_analysis(item_data, original_price, total_cost)
+        if local_analysis:
+            return record_history(item_data, local_analysis)
+        
+        def request_analysis():
+            if deadline.expired():
+                return fallback_analysis(item_data, comparison_data, original_price, total_cost, 'deadline')
+            if not llm_breaker.allow():
+                return fallback_analysis(item_data, comparison_data, original_price, total_cost, 'circuit_open')
+            
+            started = time.perf_counter()
+            try:
+                messages = build_analysis_messages(item_data, comparison_data)
+                (analysis_text, usage), hedged = request_model_analysis(messages, deadline, on_partial)
+            except DeadlineExceeded as e:
+                print(f"OpenAI analysis timed out: {e}")
+                llm_breaker.record_failure()
+                record_llm_call('single', 'timeout', started)
+                return fallback_analysis(item_data, comparison_data, original_price, total_cost, 'deadline')
+            except Exception as e:
+                print(f"Error analyzing with OpenAI: {e}")
+                llm_breaker.record_failure()
+                record_llm_call('single', 'error', started)
+                return fallback_analysis(item_data, comparison_data, original_price, total_cost, 'error')
+            llm_breaker.record_success()
+            
+            # Parse the response
+            input_tokens, output_tokens = prompt_stats.record_usage(messages, usage, analysis_text)
+            record_llm_call('single', 'ok', started, input_tokens, output_tokens)
+            print(f"OpenAI tokens: {input_tokens} in, {output_tokens} out")
+            return parse_resell_analysis(analysis_text, item_data, comparison_data, original_price, total_cost,
+                                         'llm_hedge' if hedged else 'llm')
         
-        return analysis
+        # Identical concurrent analyses share one model call, recorded once by the caller that made it
+        try:
+            return single_flight.do(analysis_flight_key(item_data, comparison_data),
+                                    lambda: record_history(item_data, request_analysis()), deadline)
+        except DeadlineExceeded as e:
+            print(f"Shared OpenAI analysis timed out: {e}")
+            return fallback_analysis(item_data, comparison_data, original_price, total_cost, 'deadline')
         
     except Exception as e:
         print(f"Error analyzing with OpenAI: {e}")
         # Create smart fallback analysis
-        return create_smart_fallback_analysis(item_data, comparison_data, float(item_data.get('price', 0)), 0)
+        return fallback_analysis(item_data, comparison_data, float(item_data.get('price', 0)), 0, 'error')
+
+def packed_completion(pack):
+    """Completion settings for a packed analysis, with room for every item's answer"""
+    return dict(ANALYSIS_COMPLETION, max_tokens=PACKED_TOKENS_PER_ITEM * len(pack))
+
+def pack_fallbacks(pack, reason):
+    """Heuristic analyses for every (item_data, comparison_data, original_price, total_cost) in pack"""
+    return [fallback_analysis(*entry, reason) for entry in pack]
+
+def unpack_analyses(analysis_text, pack):
+    """Map a packed reply back onto the items of pack, in order
+    
+    Items the reply leaves out, or answers without any analysis field, get
+    the heuristic fallback on their own.
+    """
+    
+    answers = {}
+    for answer in extract_json_array(analysis_text) or []:
+        if isinstance(answer, dict) and any(answer.get(field) for field in ANALYSIS_FIELDS):
+            answers[str(answer.pop('item', '')).strip().lstrip('#')] = answer
+    
+    analyses = []
+    for position, (item_data, comparison_data, original_price, total_cost) in enumerate(pack):
+        answer = answers.get(str(position + 1))
+        analysis = None
+        if answer is not None:
+            try:
+                analysis = accept_model_analysis(answer, item_data, comparison_data, original_price, total_cost,
+                                                 'llm_packed')
+            except (AttributeError, ValueError) as e:
+                print(f"Invalid packed analysis JSON: {e}")
+        if analysis is None:
+            analysis = fallback_analysis(item_data, comparison_data, original_price, total_cost, 'missing_from_pack')
+        analyses.append(analysis)
+    return analyses
+
+def analyze_pack(pack, deadline):
+    """Analyze every (item_data, comparison_data, original_price, total_cost) in pack with one model call"""
+    if deadline.expired():
+        return pack_fallbacks(pack, 'deadline')
+    if not llm_breaker.allow():
+        return pack_fallbacks(pack, 'circuit_open')
+    
+    messages = build_packed_messages([(item_data, comparison_data) for item_data, comparison_data, _, _ in pack])
+    started = time.perf_counter()
+    try:
+        response, _ = hedged_call(llm_call_executor, lambda: openai.ChatCompletion.create(
+            messages=messages,
+            request_timeout=max(deadline.remaining(), 1),
+            **packed_completion(pack)
+        ), deadline)
+    except DeadlineExceeded as e:
+        print(f"OpenAI packed analysis timed out: {e}")
+        llm_breaker.record_failure()
+        record_llm_call('packed', 'timeout', started)
+        return pack_fallbacks(pack, 'deadline')
+    except Exception as e:
+        print(f"Error analyzing pack with OpenAI: {e}")
+        llm_breaker.record_failure()
+        record_llm_call('packed', 'error', started)
+        return pack_fallbacks(pack, 'error')
+    llm_breaker.record_success()
+    
+    analysis_text = response.choices[0].message.content.strip()
+    input_tokens, output_tokens = prompt_stats.record_usage(messages, response.get('usage'), analysis_text)
+    record_llm_call('packed', 'ok', started, input_tokens, output_tokens)
+    print(f"OpenAI tokens: {input_tokens} in, {output_tokens} out for {len(pack)} items")
+    return unpack_analyses(analysis_text, pack)
+
+def plan_packs(entries):
+    """Split (item_data, comparison_data) pairs into cached analyses and packs for the model
+    
+    Returns (analyses, packs, positions): analyses holds the cached and
+    locally priced ones and None elsewhere; positions[i] lists where packs[i]'s results belong.
+    """
+    analyses = [None] * len(entries)
+    pending = []
+    for index, (item_data, comparison_data) in enumerate(entries):
+        try:
+            original_price, total_cost = resell_costs(item_data)
+            analyses[index] = (cached_resell_analysis(item_data, comparison_data, total_cost)
+                               or routed_local_analysis(item_data, original_price, total_cost))
+        except Exception as e:
+            print(f"Error preparing packed analysis: {e}")
+            analyses[index] = fallback_analysis(item_data, comparison_data, float(item_data.get('price') or 0), 0, 'error')
+        if analyses[index] is None:
+            pending.append((index, (item_data, comparison_data, original_price, total_cost)))
+    
+    packs = []
+    positions = []
+    for start in range(0, len(pending), max(1, LLM_PACK_SIZE)):
+        chunk = pending[start:start + max(1, LLM_PACK_SIZE)]
+        positions.append([index for index, _ in chunk])
+        packs.append([entry for _, entry in chunk])
+    return analyses, packs, positions
+
+def analyze_resell_potential_packed(entries, deadline=None):
+    """Analyses for a list of (item_data, comparison_data) pairs, LLM_PACK_SIZE items per model call"""
+    if deadline is None:
+        deadline = Deadline(ANALYSIS_LATENCY_BUDGET)
+    analyses, packs, positions = plan_packs(entries)
+    
+    futures = {analysis_executor.submit(analyze_pack, pack, deadline): index for index, pack in enumerate(packs)}
+    for future in as_completed(futures):
+        pack_index = futures[future]
+        try:
+            pack_analyses = future.result()
+        except Exception as e:
+            print(f"Error analyzing pack: {e}")
+            pack_analyses = pack_fallbacks(packs[pack_index], 'error')
+        for index, analysis in zip(positions[pack_index], pack_analyses):
+            analyses[index] = analysis
+    for (item_data, _), analysis in zip(entries, analyses):
+        record_analysis(analysis)
+        record_history(item_data, analysis)
+    return analyses
 
 def create_smart_fallback_analysis(item_data, comparison_data, original_price, total_cost):
     """Create intelligent fallback analysis when OpenAI fails"""
@@ -630,14 +783,178 @@ def create_smart_fallback_analysis(item_data, comparison_data, original_price, t
         "risks": ", ".join(risks)
     }
 
+def scrape_and_cache_item(url, item_id):
+    """Scrape an item and cache it under its ID"""
+    item_data = scrape_vinted_item(url)
+    
+    # Only real scrapes are cached; fallback guesses should be retried
+    if item_data:
+        item_cache.set(item_id, item_data)
+    return item_data
+
+def get_item_data(url, deadline=None):
+    """Scrape a Vinted item, falling back to data parsed from the URL
+
+    Waiting on a scrape of the same listing by another request gives up,
+    for the URL fallback, once the deadline has passed.
+    """
+    item_id = extract_item_id(url)
+    
+    # Serve repeat lookups of the same listing from the item cache
+    if item_id:
+        with stage_timer('item_cache'):
+            cached = item_cache.get(item_id)
+        metrics.inc('vintelli_item_cache_lookups_total', result='hit' if cached else 'miss')
+        if cached:
+            cached['url'] = url
+            return cached
+    
+    if item_id:
+        # Concurrent requests for the same listing share one scrape
+        try:
+            item_data = single_flight.do(f"scrape:{item_id}", lambda: scrape_and_cache_item(url, item_id), deadline)
+        except DeadlineExceeded as e:
+            print(f"Shared scrape of {url} timed out: {e}")
+            item_data = None
+        if item_data:
+            item_data['url'] = url
+    else:
+        item_data = scrape_vinted_item(url)
+    
+    # If scraping fails, create fallback data from URL
+    if not item_data:
+        item_data = create_fallback_data(url)
+    record_scrape(item_data)
+    
+    return item_data
+
+def record_scrape(item_data):
+    """Count an item lookup that missed the cache by how it ended"""
+    if not item_data:
+        outcome = 'failed'
+    elif item_data.get('fallback'):
+        outcome = 'url_fallback'
+    else:
+        outcome = 'scraped'
+    metrics.inc('vintelli_scrapes_total', outcome=outcome)
+
+def find_similar_items(item_data):
+    """Find sold items comparable to the scraped item"""
+    with stage_timer('comparables'):
+        try:
+            return comparables_store.find_similar(item_data)
+        except Exception as e:
+            print(f"Error scoring comparables, falling back to the cascade: {e}")
+        try:
+            return comparables_store.find_similar_cascade(item_data)
+        except Exception as e:
+            # The analysis still runs without comparables rather than failing the request
+            print(f"Error finding comparables: {e}")
+            return []
+
 @app.route('/')
 def index():
     """Render the main page"""
     return render_template('index.html')
 
+def runtime_stats(fetcher=shared_fetcher):
+    """Runtime statistics for this worker process"""
+    return {
+        'fetcher': fetcher.stats(),
+        'item_cache': item_cache.stats(),
+        'analysis_cache': analysis_cache.stats(),
+        'parser': parse_stats.stats(),
+        'singleflight': single_flight.stats(),
+        'llm_breaker': llm_breaker.stats(),
+        'prompt': prompt_stats.stats(),
+        'pricing_router': router_stats.stats(),
+        'jobs': dict(job_queue.stats(), **job_workers.stats()),
+        'profiler': request_profiler.stats(),
+        'history': analysis_history.stats()
+    }
+
+@app.route('/stats')
+def stats():
+    """Report runtime statistics for this worker process"""
+    return jsonify(runtime_stats())
+
+def request_route(rule):
+    """Route label of a request; unmatched paths share one to keep the series bounded"""
+    return rule or 'unmatched'
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    """Count and time every request by route; streams are timed until their headers"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request_route(request.url_rule and request.url_rule.rule)
+        metrics.inc('vintelli_http_requests_total', route=route, method=request.method, status=response.status_code)
+        metrics.observe('vintelli_http_request_seconds', time.perf_counter() - started, route=route,
+                        method=request.method)
+    return response
+
+# Endpoints that can be profiled, by Flask endpoint name
+PROFILED_ENDPOINTS = {'analyze'}
+
+def wants_profile():
+    """Profile on an admin's X-Profile header or ?profile=1, or for a sampled share of requests"""
+    if request.endpoint not in PROFILED_ENDPOINTS:
+        return False
+    if request.headers.get('X-Profile') or request.args.get('profile'):
+        return is_admin_request()
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+@app.before_request
+def start_request_profile():
+    if wants_profile():
+        g.profile = request_profiler.start(f"{request.method} {request.path}")
+
+@app.after_request
+def stop_request_profile(response):
+    """Write the request's profile and name it in X-Profile-Id"""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        request_profiler.stop(profile)
+        response.headers['X-Profile-Id'] = profile.id
+    return response
+
+@app.teardown_request
+def discard_request_profile(error=None):
+    """Stop the profile of a request that failed before its response"""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        request_profiler.stop(profile)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics summed over every worker process"""
+    try:
+        return Response(metrics.render(), content_type=CONTENT_TYPE)
+    except sqlite3.Error as e:
+        print(f"Error rendering metrics: {e}")
+        return Response('metrics store unavailable\n', status=503, content_type=CONTENT_TYPE)
+
+@app.route('/cache/items/<item_id>', methods=['DELETE'])
+def invalidate_cached_item(item_id):
+    """Drop a cached Vinted item so the next lookup scrapes it again"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    if not item_id.isdigit():
+        return jsonify({'error': 'Invalid item ID'}), 400
+    
+    item_cache.invalidate(item_id)
+    return jsonify({'invalidated': item_id})
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
     """Analyze a Vinted item for resell potential"""
+    # The latency budget covers the whole request, scraping included
+    deadline = Deadline(ANALYSIS_LATENCY_BUDGET)
     try:
         data = request.get_json()
         vinted_url = data.get('url', '').strip()
@@ -648,103 +965,16 @@ def analyze():
         if 'www.vinted' not in vinted_url:
             return jsonify({'error': 'Please provide a valid Vinted URL'}), 400
         
-        # Scrape the Vinted item
-        item_data = scrape_vinted_item(vinted_url)
-        
-        # If scraping fails, create fallback data from URL
+        # Scrape the Vinted item, falling back to URL data
+        item_data = get_item_data(vinted_url, deadline)
         if not item_data:
-            # Extract basic info from URL as fallback
-            fallback_data = create_fallback_data(vinted_url)
-            if fallback_data:
-                item_data = fallback_data
-            else:
-                return jsonify({'error': 'Failed to scrape item data'}), 500
+            return jsonify({'error': 'Failed to scrape item data'}), 500
         
         # Find similar items for comparison
-        similar_items = []
-        
-        # First try to find items with the same brand
-        if item_data.get('brand'):
-            brand_similar = [
-                item for item in MOCK_SOLD_ITEMS 
-                if item['brand'].lower() == item_data['brand'].lower()
-            ]
-            similar_items.extend(brand_similar)
-        
-        # Then try to find items with the same category
-        if item_data.get('category'):
-            category_similar = [
-                item for item in MOCK_SOLD_ITEMS 
-                if item['category'].lower() == item_data['category'].lower() and 
-                item not in similar_items
-            ]
-            similar_items.extend(category_similar)
-        
-        # If still no similar items, try partial brand matches
-        if not similar_items and item_data.get('brand'):
-            partial_brand_similar = [
-                item for item in MOCK_SOLD_ITEMS 
-                if item_data['brand'].lower() in item['brand'].lower() or 
-                item['brand'].lower() in item_data['brand'].lower()
-            ]
-            similar_items.extend(partial_brand_similar)
-        
-        # If still no similar items, try category keywords
-        if not similar_items and item_data.get('category'):
-            category_keywords = {
-                'hommes': ['jeans', 'pants', 'trousers', 'shirts', 'tops'],
-                'femmes': ['dresses', 'tops', 'skirts', 'blouses'],
-                'chaussures': ['shoes', 'sneakers', 'boots'],
-                'sacs': ['bags', 'handbags', 'backpacks'],
-                'accessoires': ['accessories', 'jewelry', 'watches']
-            }
-            
-            current_category = item_data['category'].lower()
-            for keyword, related_categories in category_keywords.items():
-                if keyword in current_category or any(cat in current_category for cat in related_categories):
-                    keyword_similar = [
-                        item for item in MOCK_SOLD_ITEMS 
-                        if any(cat in item['category'].lower() for cat in related_categories)
-                    ]
-                    similar_items.extend(keyword_similar)
-                    break
-        
-        # If no similar items found, use items with similar price range
-        if not similar_items and item_data.get('price'):
-            try:
-                item_price = float(item_data['price'])
-                price_range_similar = [
-                    item for item in MOCK_SOLD_ITEMS 
-                    if abs(item['original_price'] - item_price) <= 20  # Within €20 range
-                ]
-                similar_items.extend(price_range_similar)
-            except (ValueError, TypeError):
-                pass
-        
-        # If still no similar items, use a mix of popular items
-        if not similar_items:
-            # Get items that are likely to be similar based on common categories
-            popular_categories = ['Shoes', 'Jeans', 'Sweaters', 'Jackets']
-            similar_items = [
-                item for item in MOCK_SOLD_ITEMS 
-                if item['category'] in popular_categories
-            ][:3]
-        
-        # Ensure we don't have duplicates and limit to top 3
-        unique_similar_items = []
-        seen = set()
-        for item in similar_items:
-            item_key = f"{item['brand']}-{item['title']}"
-            if item_key not in seen:
-                unique_similar_items.append(item)
-                seen.add(item_key)
-            if len(unique_similar_items) >= 3:
-                break
-        
-        similar_items = unique_similar_items
+        similar_items = find_similar_items(item_data)
         
         # Analyze resell potential
-        analysis = analyze_resell_potential(item_data, similar_items)
+        analysis = analyze_resell_potential(item_data, similar_items, deadline)
         
         # Prepare response
         response_data = {
@@ -759,5 +989,296 @@ def analyze():
         print(f"Error in analyze endpoint: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def run_analysis_job(payload):
+    """Job handler: scrape, match and analyze one URL, like /analyze"""
+    item_data = get_item_data(payload['url'])
+    if not item_data:
+        # Raising lets the queue retry the job later
+        raise RuntimeError('Failed to scrape item data')
+    
+    similar_items = find_similar_items(item_data)
+    return {
+        'item_data': item_data,
+        'analysis': analyze_resell_potential(item_data, similar_items),
+        'similar_items': similar_items[:3]
+    }
+
+# Background analyses, processed by worker threads in every app process
+job_queue = JobQueue()
+job_workers = WorkerPool(job_queue, {'analyze': run_analysis_job})
+
+# Longest a client may long-poll a job, in seconds
+JOB_LONG_POLL_MAX = float(os.getenv('JOB_LONG_POLL_MAX', '25'))
+
+@app.before_request
+def start_job_workers():
+    """Start this process's job workers and history writer with its first request"""
+    job_workers.start()
+    analysis_history.start()
+
+def job_response(job):
+    """Public view of a job"""
+    response = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'priority': job['priority'],
+        'attempts': job['attempts'],
+        'created_at': datetime.fromtimestamp(job['created_at']).isoformat(),
+        'updated_at': datetime.fromtimestamp(job['updated_at']).isoformat()
+    }
+    if job['result'] is not None:
+        response['result'] = job['result']
+    if job['error']:
+        response['error'] = job['error']
+    return response
+
+def job_submission(data):
+    """Validate a job request; returns (url, priority, error)"""
+    vinted_url = str(data.get('url', '')).strip()
+    if not vinted_url:
+        return None, None, 'No URL provided'
+    if 'www.vinted' not in vinted_url:
+        return None, None, 'Please provide a valid Vinted URL'
+    try:
+        priority = int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        return None, None, 'Priority must be an integer'
+    return vinted_url, priority, None
+
+def long_poll_seconds(value):
+    """Seconds to wait for a job from the wait query parameter"""
+    try:
+        return min(max(float(value or 0), 0.0), JOB_LONG_POLL_MAX)
+    except ValueError:
+        return 0.0
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue an analysis and return its job ID right away"""
+    vinted_url, priority, error = job_submission(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({'error': error}), 400
+    
+    job_id = job_queue.submit('analyze', {'url': vinted_url}, priority)
+    return jsonify({'job_id': job_id, 'status': 'queued'}), 202
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Report a job, waiting up to ?wait= seconds for it to finish"""
+    job = job_queue.wait(job_id, long_poll_seconds(request.args.get('wait')))
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_response(job)), 200 if job['status'] in FINISHED else 202
+
+def history_filters(args):
+    """(brand, category, since, until, limit) from query parameters; times are ISO 8601 or epoch seconds"""
+    def timestamp(name):
+        value = args.get(name)
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.fromisoformat(value).timestamp()
+    
+    limit = min(max(int(args.get('limit', 100)), 1), QUERY_MAX_ROWS)
+    return args.get('brand'), args.get('category'), timestamp('since'), timestamp('until'), limit
+
+@app.route('/history')
+def get_history():
+    """Stored analyses, newest first, filtered by ?brand=, ?category=, ?since= and ?until="""
+    try:
+        brand, category, since, until, limit = history_filters(request.args)
+    except ValueError:
+        return jsonify({'error': 'limit must be a number, since and until ISO dates or timestamps'}), 400
+    return jsonify({'analyses': analysis_history.query(brand, category, since, until, limit=limit)})
+
+@app.route('/history/comparables')
+def get_history_comparables():
+    """Past model analyses as sold-item rows, with the filters of /history"""
+    try:
+        brand, category, since, until, limit = history_filters(request.args)
+    except ValueError:
+        return jsonify({'error': 'limit must be a number, since and until ISO dates or timestamps'}), 400
+    return jsonify({'items': analysis_history.comparables(brand, category, since, until, limit)})
+
+def watch_listing(url):
+    """Watcher handler: scrape, match and score a new listing locally; returns its alert or None"""
+    item_data = get_item_data(url)
+    if not item_data or item_data.get('fallback'):
+        # Raising leaves the listing unseen, so the next poll retries it
+        raise RuntimeError('Failed to scrape item data')
+    
+    # Listings without a usable price cannot be underpriced
+    price = parse_price(item_data.get('price'))
+    if price is None or price <= 0:
+        return None
+    
+    similar_items = find_similar_items(item_data)
+    original_price, total_cost = resell_costs(item_data)
+    with stage_timer('local_model'):
+        prediction = comparables_store.pricing_model().predict(item_data)
+    score = listing_score(item_data, similar_items, prediction, total_cost)
+    if score is None:
+        return None
+    return dict(score, url=url, title=item_data.get('title'), brand=item_data.get('brand'),
+                price=original_price, total_cost=round(total_cost, 2), similar_items=similar_items[:3])
+
+# Alerts raised by the catalog watcher (python watcher.py)
+watch_alerts = AlertStore()
+
+# Most alerts returned by GET /watch/alerts
+WATCH_ALERTS_MAX = 500
+
+@app.route('/watch/alerts')
+def get_watch_alerts():
+    """Catalog watcher alerts, best first; ?limit= and ?max_age= in seconds narrow them down"""
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), WATCH_ALERTS_MAX)
+        max_age = float(request.args['max_age']) if 'max_age' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'limit and max_age must be numbers'}), 400
+    return jsonify({'alerts': watch_alerts.top(limit, max_age)})
+
+# Headers that keep proxies from buffering a streamed response
+STREAM_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
+def ndjson_line(payload):
+    """Encode one streamed stage as a line of newline-delimited JSON"""
+    return json.dumps(payload) + '\n'
+
+def analysis_updates(item_data, similar_items, deadline):
+    """Yield ('analysis_partial', fields) as the model writes them, then ('analysis', analysis)"""
+    updates = queue.Queue()
+    future = stream_executor.submit(analyze_resell_potential, item_data, similar_items, deadline, updates.put)
+    future.add_done_callback(lambda _: updates.put(None))
+    
+    while True:
+        fields = updates.get()
+        if fields is None:
+            break
+        yield 'analysis_partial', fields
+    yield 'analysis', future.result()
+
+@app.route('/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """Analyze a Vinted item, streaming each stage as soon as it is ready"""
+    deadline = Deadline(ANALYSIS_LATENCY_BUDGET)
+    data = request.get_json(silent=True) or {}
+    vinted_url = str(data.get('url', '')).strip()
+    
+    if not vinted_url:
+        return jsonify({'error': 'No URL provided'}), 400
+    
+    if 'www.vinted' not in vinted_url:
+        return jsonify({'error': 'Please provide a valid Vinted URL'}), 400
+    
+    def generate():
+        try:
+            # Scrape the Vinted item, falling back to URL data
+            item_data = get_item_data(vinted_url, deadline)
+            if not item_data:
+                yield ndjson_line({'stage': 'error', 'error': 'Failed to scrape item data'})
+                return
+            yield ndjson_line({'stage': 'item', 'item_data': item_data})
+            
+            similar_items = find_similar_items(item_data)
+            yield ndjson_line({'stage': 'similar_items', 'similar_items': similar_items[:3]})
+            
+            for stage, analysis in analysis_updates(item_data, similar_items, deadline):
+                yield ndjson_line({'stage': stage, 'analysis': analysis})
+            
+        except Exception as e:
+            print(f"Error in analyze stream: {e}")
+            yield ndjson_line({'stage': 'error', 'error': 'Internal server error'})
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers=STREAM_HEADERS)
+
+def scrape_batch_item(url, deadline=None):
+    """Scrape one batch URL and pick its comparables"""
+    if 'www.vinted' not in url:
+        return {'url': url, 'status': 'error', 'error': 'Please provide a valid Vinted URL'}
+    
+    item_data = get_item_data(url, deadline)
+    if not item_data:
+        return {'url': url, 'status': 'error', 'error': 'Failed to scrape item data'}
+    
+    return {
+        'url': url,
+        'status': 'fallback' if item_data.get('fallback') else 'ok',
+        'item_data': item_data,
+        'similar_items': find_similar_items(item_data)
+    }
+
+def analyze_batch_item(result):
+    """Run the resell analysis for a scraped batch item"""
+    result['analysis'] = analyze_resell_potential(result['item_data'], result['similar_items'])
+    return result
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Analyze several Vinted items concurrently"""
+    try:
+        data = request.get_json() or {}
+        urls = data.get('urls')
+        
+        if not isinstance(urls, list) or not urls:
+            return jsonify({'error': 'No URLs provided'}), 400
+        
+        if len(urls) > BATCH_MAX_URLS:
+            return jsonify({'error': f'A batch can contain at most {BATCH_MAX_URLS} URLs'}), 400
+        
+        urls = [str(url).strip() for url in urls]
+        results = [None] * len(urls)
+        packed = bool(data.get('packed', BATCH_PACKED))
+        # Bounds waits on scrapes shared with other requests, like /analyze
+        scrape_deadline = Deadline(ANALYSIS_LATENCY_BUDGET)
+        
+        # Scrape every URL at once, then hand each item to the bounded
+        # analysis pool as soon as its own scrape finishes
+        scrape_futures = {
+            scrape_executor.submit(scrape_batch_item, url, scrape_deadline): index
+            for index, url in enumerate(urls)
+        }
+        analysis_futures = {}
+        for future in as_completed(scrape_futures):
+            index = scrape_futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error scraping batch item {urls[index]}: {e}")
+                result = {'url': urls[index], 'status': 'error', 'error': 'Failed to scrape item data'}
+            
+            if result['status'] == 'error' or packed:
+                results[index] = result
+            else:
+                analysis_futures[analysis_executor.submit(analyze_batch_item, result)] = index
+        
+        if packed:
+            # Several items share each model call once every scrape is done
+            scraped = [result for result in results if result['status'] != 'error']
+            analyses = analyze_resell_potential_packed(
+                [(result['item_data'], result['similar_items']) for result in scraped]
+            )
+            for result, analysis in zip(scraped, analyses):
+                result['analysis'] = analysis
+        
+        for future in as_completed(analysis_futures):
+            index = analysis_futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                print(f"Error analyzing batch item {urls[index]}: {e}")
+                results[index] = {'url': urls[index], 'status': 'error', 'error': 'Failed to analyze item'}
+        
+        return jsonify({'results': results})
+        
+    except Exception as e:
+        print(f"Error in batch analyze endpoint: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
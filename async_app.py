@@ -0,0 +1,650 @@
+"""
+Asyncio version of the Vintelli web app
+
+Vinted fetches and OpenAI calls are awaited instead of holding a worker,
+so one process can keep hundreds of analyses in flight. CPU-bound work
+(page parsing, comparable scoring, SQLite cache access) runs on a small
+thread pool so it never blocks the event loop.
+
+Serve with:
+    gunicorn async_app:app --worker-class aiohttp.GunicornWebWorker
+"""
+
+import asyncio
+import functools
+import hmac
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+from aiohttp import ClientSession, web
+from flask import render_template
+
+from app import (
+    ADMIN_TOKEN,
+    ANALYSIS_COMPLETION,
+    ANALYSIS_FIELDS,
+    ANALYSIS_LATENCY_BUDGET,
+    BATCH_MAX_URLS,
+    BATCH_PACKED,
+    LLM_HEDGE_MODEL,
+    LLM_HEDGE_REMAINING,
+    LLM_STREAM,
+    STREAM_HEADERS,
+    WATCH_ALERTS_MAX,
+    analysis_flight_key,
+    app as flask_app,
+    cached_resell_analysis,
+    create_fallback_data,
+    extract_item_id,
+    fallback_analysis,
+    history_filters,
+    find_similar_items,
+    job_queue,
+    job_response,
+    job_submission,
+    job_workers,
+    llm_breaker,
+    long_poll_seconds,
+    ndjson_line,
+    pack_fallbacks,
+    packed_completion,
+    plan_packs,
+    parse_resell_analysis,
+    record_history,
+    record_scrape,
+    request_route,
+    resell_costs,
+    routed_local_analysis,
+    runtime_stats,
+    unpack_analyses,
+    watch_alerts,
+)
+from extractor import extract_item_fields
+from fetcher import AsyncFetcher
+from history import analysis_history
+from item_cache import item_cache
+from jobs import FINISHED
+from json_stream import JSONObjectStream
+from metrics import CONTENT_TYPE, metrics, record_analysis, record_llm_call, stage_timer
+from prompts import build_analysis_messages, build_packed_messages, prompt_stats
+from resilience import Deadline, DeadlineExceeded, hedge_delay, hedged_call_async
+from singleflight import single_flight
+
+# Threads for parsing, scoring and cache access
+CPU_WORKERS = int(os.getenv('ASYNC_CPU_WORKERS', str(os.cpu_count() or 4)))
+
+# Model calls in flight at once per process
+ASYNC_LLM_MAX_CONCURRENCY = int(os.getenv('ASYNC_LLM_MAX_CONCURRENCY', '200'))
+
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix='cpu')
+async_fetcher = AsyncFetcher()
+llm_slots = asyncio.Semaphore(ASYNC_LLM_MAX_CONCURRENCY)
+
+
+async def run_blocking(func, *args):
+    """Run a blocking call on the CPU pool without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, functools.partial(func, *args))
+
+
+async def scrape_vinted_item(url):
+    """Fetch a Vinted item page without blocking and parse it off the loop"""
+    try:
+        with stage_timer('fetch'):
+            response, content = await async_fetcher.get(url)
+            response.raise_for_status()
+        with stage_timer('parse'):
+            return await run_blocking(extract_item_fields, content, url, extract_item_id(url))
+
+    except Exception as e:
+        print(f"Error scraping Vinted item: {e!r}")
+        return None
+
+
+async def scrape_and_cache_item(url, item_id):
+    """Scrape an item and cache it under its ID"""
+    item_data = await scrape_vinted_item(url)
+
+    # Only real scrapes are cached; fallback guesses should be retried
+    if item_data:
+        await run_blocking(item_cache.set, item_id, item_data)
+    return item_data
+
+
+async def get_item_data(url, deadline=None):
+    """Scrape a Vinted item, falling back to data parsed from the URL once the deadline passes"""
+    item_id = extract_item_id(url)
+
+    # Serve repeat lookups of the same listing from the item cache
+    if item_id:
+        with stage_timer('item_cache'):
+            cached = await run_blocking(item_cache.get, item_id)
+        metrics.inc('vintelli_item_cache_lookups_total', result='hit' if cached else 'miss')
+        if cached:
+            cached['url'] = url
+            return cached
+
+    if item_id:
+        # Concurrent requests for the same listing share one scrape
+        try:
+            item_data = await single_flight.do_async(f"scrape:{item_id}", lambda: scrape_and_cache_item(url, item_id),
+                                                     deadline)
+        except DeadlineExceeded as e:
+            print(f"Shared scrape of {url} timed out: {e}")
+            item_data = None
+        if item_data:
+            item_data['url'] = url
+    else:
+        item_data = await scrape_vinted_item(url)
+
+    # If scraping fails, create fallback data from URL
+    if not item_data:
+        item_data = create_fallback_data(url)
+    record_scrape(item_data)
+
+    return item_data
+
+
+_openai_session = None
+
+
+def openai_session():
+    """aiohttp session reused by every OpenAI call made from this process"""
+    global _openai_session
+    if _openai_session is None or _openai_session.closed:
+        _openai_session = ClientSession()
+    return _openai_session
+
+
+async def complete_analysis(model, messages, deadline, on_partial=None):
+    """complete_analysis from app.py, without blocking the event loop"""
+    # openai reads its session from a context variable, local to this task
+    openai.aiosession.set(openai_session())
+    params = dict(ANALYSIS_COMPLETION, model=model)
+    async with llm_slots:
+        if not LLM_STREAM:
+            response = await openai.ChatCompletion.acreate(
+                messages=messages,
+                request_timeout=max(deadline.remaining(), 1),
+                **params
+            )
+            return response.choices[0].message.content.strip(), response.get('usage')
+
+        reply = JSONObjectStream(ANALYSIS_FIELDS)
+        chunks = await openai.ChatCompletion.acreate(
+            messages=messages,
+            stream=True,
+            request_timeout=max(deadline.remaining(), 1),
+            **params
+        )
+        try:
+            async for chunk in chunks:
+                delta = chunk.choices[0].delta.get('content') if chunk.choices else None
+                if delta and reply.feed(delta) and on_partial:
+                    on_partial(dict(reply.fields))
+                if reply.complete() or deadline.expired():
+                    break
+        finally:
+            # Releases the connection, so generation stops too
+            await chunks.aclose()
+        return reply.text.strip(), None
+
+
+async def request_model_analysis(messages, deadline, on_partial=None):
+    """Chat completion within the deadline; returns ((reply text, usage), hedged)"""
+    def complete(model, on_partial=None):
+        return lambda: complete_analysis(model, messages, deadline, on_partial)
+
+    # Only the primary call reports partial fields, so they never mix two replies
+    hedge = complete(LLM_HEDGE_MODEL) if LLM_HEDGE_MODEL else None
+    return await hedged_call_async(complete(ANALYSIS_COMPLETION['model'], on_partial), deadline,
+                                   hedge=hedge, hedge_after=hedge_delay(deadline, LLM_HEDGE_REMAINING))
+
+
+async def analyze_resell_potential(item_data, comparison_data, deadline=None, on_partial=None):
+    """Analyze resell potential with a non-blocking OpenAI call, labeled with its source"""
+    with stage_timer('analysis'):
+        analysis = await resell_analysis(item_data, comparison_data, deadline, on_partial)
+    record_analysis(analysis)
+    return analysis
+
+
+async def resell_analysis(item_data, comparison_data, deadline=None, on_partial=None):
+    """analyze_resell_potential without the metrics"""
+    if deadline is None:
+        deadline = Deadline(ANALYSIS_LATENCY_BUDGET)
+    try:
+        original_price, total_cost = resell_costs(item_data)
+
+        cached_analysis = cached_resell_analysis(item_data, comparison_data, total_cost)
+        if cached_analysis:
+            return cached_analysis
+
+        # Well-covered, low-value items are priced locally
+        local_analysis = await run_blocking(routed_local_analysis, item_data, original_price, total_cost)
+        if local_analysis:
+            return record_history(item_data, local_analysis)
+
+        async def request_analysis():
+            if deadline.expired():
+                return fallback_analysis(item_data, comparison_data, original_price, total_cost, 'deadline')
+            if not llm_breaker.allow():
+                return fallback_analysis(item_data, comparison_data, original_price, total_cost, 'circuit_open')
+
+            started = time.perf_counter()
+            try:
+                messages = build_analysis_messages(item_data, comparison_data)
+                (analysis_text, usage), hedged = await request_model_analysis(messages, deadline, on_partial)
+            except DeadlineExceeded as e:
+                print(f"OpenAI analysis timed out: {e}")
+                llm_breaker.record_failure()
+                record_llm_call('single', 'timeout', started)
+                return fallback_analysis(item_data, comparison_data, original_price, total_cost, 'deadline')
+            except Exception as e:
+                print(f"Error analyzing with OpenAI: {e}")
+                llm_breaker.record_failure()
+                record_llm_call('single', 'error', started)
+                return fallback_analysis(item_data, comparison_data, original_price, total_cost, 'error')
+            llm_breaker.record_success()
+
+            # Parse the response
+            input_tokens, output_tokens = prompt_stats.record_usage(messages, usage, analysis_text)
+            record_llm_call('single', 'ok', started, input_tokens, output_tokens)
+            print(f"OpenAI tokens: {input_tokens} in, {output_tokens} out")
+            return parse_resell_analysis(analysis_text, item_data, comparison_data, original_price, total_cost,
+                                         'llm_hedge' if hedged else 'llm')
+
+        async def recorded_analysis():
+            return record_history(item_data, await request_analysis())
+
+        # Identical concurrent analyses share one model call, recorded once by the caller that made it
+        try:
+            return await single_flight.do_async(analysis_flight_key(item_data, comparison_data), recorded_analysis,
+                                                deadline)
+        except DeadlineExceeded as e:
+            print(f"Shared OpenAI analysis timed out: {e}")
+            return fallback_analysis(item_data, comparison_data, original_price, total_cost, 'deadline')
+
+    except Exception as e:
+        print(f"Error analyzing with OpenAI: {e}")
+        # Create smart fallback analysis
+        return fallback_analysis(item_data, comparison_data, float(item_data.get('price', 0)), 0, 'error')
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def index(request):
+    """Render the main page"""
+    return web.Response(text=request.app['index_html'], content_type='text/html')
+
+
+async def stats(request):
+    """Report runtime statistics for this worker process"""
+    return web.json_response(runtime_stats(async_fetcher))
+
+
+@web.middleware
+async def observe_request(request, handler):
+    """Count and time every request by route; streams are timed until they end"""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        route = request_route(resource and resource.canonical)
+        metrics.inc('vintelli_http_requests_total', route=route, method=request.method, status=status)
+        metrics.observe('vintelli_http_request_seconds', time.perf_counter() - started, route=route,
+                        method=request.method)
+
+
+async def metrics_endpoint(request):
+    """Prometheus metrics summed over every worker process"""
+    try:
+        text = await run_blocking(metrics.render)
+    except sqlite3.Error as e:
+        print(f"Error rendering metrics: {e}")
+        return web.Response(text='metrics store unavailable\n', status=503, headers={'Content-Type': CONTENT_TYPE})
+    return web.Response(text=text, headers={'Content-Type': CONTENT_TYPE})
+
+
+async def invalidate_cached_item(request):
+    """Drop a cached Vinted item so the next lookup scrapes it again"""
+    token = request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+        return web.json_response({'error': 'Forbidden'}, status=403)
+
+    item_id = request.match_info['item_id']
+    if not item_id.isdigit():
+        return web.json_response({'error': 'Invalid item ID'}, status=400)
+
+    await run_blocking(item_cache.invalidate, item_id)
+    return web.json_response({'invalidated': item_id})
+
+
+async def submit_job(request):
+    """Queue an analysis and return its job ID right away"""
+    vinted_url, priority, error = job_submission(await read_json(request) or {})
+    if error:
+        return web.json_response({'error': error}, status=400)
+
+    job_id = await run_blocking(job_queue.submit, 'analyze', {'url': vinted_url}, priority)
+    return web.json_response({'job_id': job_id, 'status': 'queued'}, status=202)
+
+
+async def get_job(request):
+    """Report a job, waiting up to ?wait= seconds for it to finish"""
+    job = await job_queue.wait_async(request.match_info['job_id'], long_poll_seconds(request.query.get('wait')))
+    if job is None:
+        return web.json_response({'error': 'Job not found'}, status=404)
+    return web.json_response(job_response(job), status=200 if job['status'] in FINISHED else 202)
+
+
+async def start_job_workers(aiohttp_app):
+    # Jobs run the blocking handlers on their own threads
+    job_workers.start()
+    analysis_history.start()
+
+
+async def get_history(request):
+    """Stored analyses, newest first, filtered by ?brand=, ?category=, ?since= and ?until="""
+    try:
+        brand, category, since, until, limit = history_filters(request.query)
+    except ValueError:
+        return web.json_response({'error': 'limit must be a number, since and until ISO dates or timestamps'},
+                                 status=400)
+    analyses = await run_blocking(functools.partial(analysis_history.query, brand, category, since, until, limit=limit))
+    return web.json_response({'analyses': analyses})
+
+
+async def get_history_comparables(request):
+    """Past model analyses as sold-item rows, with the filters of /history"""
+    try:
+        brand, category, since, until, limit = history_filters(request.query)
+    except ValueError:
+        return web.json_response({'error': 'limit must be a number, since and until ISO dates or timestamps'},
+                                 status=400)
+    items = await run_blocking(analysis_history.comparables, brand, category, since, until, limit)
+    return web.json_response({'items': items})
+
+
+async def get_watch_alerts(request):
+    """Catalog watcher alerts, best first; ?limit= and ?max_age= in seconds narrow them down"""
+    try:
+        limit = min(max(int(request.query.get('limit', 50)), 1), WATCH_ALERTS_MAX)
+        max_age = float(request.query['max_age']) if 'max_age' in request.query else None
+    except ValueError:
+        return web.json_response({'error': 'limit and max_age must be numbers'}, status=400)
+    alerts = await run_blocking(watch_alerts.top, limit, max_age)
+    return web.json_response({'alerts': alerts})
+
+
+async def analyze(request):
+    """Analyze a Vinted item for resell potential"""
+    # Requests share the event loop thread, so one request's stacks cannot be
+    # told apart from the others'; refuse rather than ignore a profile request
+    if request.headers.get('X-Profile') or request.query.get('profile'):
+        return web.json_response({'error': 'Profiling is only available on the Flask app'}, status=400)
+
+    # The latency budget covers the whole request, scraping included
+    deadline = Deadline(ANALYSIS_LATENCY_BUDGET)
+    try:
+        data = await read_json(request) or {}
+        vinted_url = str(data.get('url', '')).strip()
+
+        if not vinted_url:
+            return web.json_response({'error': 'No URL provided'}, status=400)
+
+        if 'www.vinted' not in vinted_url:
+            return web.json_response({'error': 'Please provide a valid Vinted URL'}, status=400)
+
+        # Scrape the Vinted item, falling back to URL data
+        item_data = await get_item_data(vinted_url, deadline)
+        if not item_data:
+            return web.json_response({'error': 'Failed to scrape item data'}, status=500)
+
+        # Find similar items for comparison
+        similar_items = await run_blocking(find_similar_items, item_data)
+
+        # Analyze resell potential
+        analysis = await analyze_resell_potential(item_data, similar_items, deadline)
+
+        return web.json_response({
+            'item_data': item_data,
+            'analysis': analysis,
+            'similar_items': similar_items[:3]  # Show top 3 similar items
+        })
+
+    except Exception as e:
+        print(f"Error in analyze endpoint: {e!r}")
+        return web.json_response({'error': 'Internal server error'}, status=500)
+
+
+async def analyze_stream(request):
+    """Analyze a Vinted item, streaming each stage as soon as it is ready"""
+    deadline = Deadline(ANALYSIS_LATENCY_BUDGET)
+    data = await read_json(request) or {}
+    vinted_url = str(data.get('url', '')).strip()
+
+    if not vinted_url:
+        return web.json_response({'error': 'No URL provided'}, status=400)
+
+    if 'www.vinted' not in vinted_url:
+        return web.json_response({'error': 'Please provide a valid Vinted URL'}, status=400)
+
+    response = web.StreamResponse(headers=STREAM_HEADERS)
+    response.content_type = 'application/x-ndjson'
+    await response.prepare(request)
+
+    async def send(payload):
+        await response.write(ndjson_line(payload).encode('utf-8'))
+
+    try:
+        # Scrape the Vinted item, falling back to URL data
+        item_data = await get_item_data(vinted_url, deadline)
+        if not item_data:
+            await send({'stage': 'error', 'error': 'Failed to scrape item data'})
+        else:
+            await send({'stage': 'item', 'item_data': item_data})
+
+            similar_items = await run_blocking(find_similar_items, item_data)
+            await send({'stage': 'similar_items', 'similar_items': similar_items[:3]})
+
+            # Fields of the model's reply are forwarded as they are read
+            updates = asyncio.Queue()
+            analysis = asyncio.ensure_future(
+                analyze_resell_potential(item_data, similar_items, deadline, updates.put_nowait)
+            )
+            analysis.add_done_callback(lambda _: updates.put_nowait(None))
+            while True:
+                fields = await updates.get()
+                if fields is None:
+                    break
+                await send({'stage': 'analysis_partial', 'analysis': fields})
+            await send({'stage': 'analysis', 'analysis': analysis.result()})
+
+    except ConnectionResetError:
+        # The client went away; nothing left to send to
+        return response
+    except Exception as e:
+        print(f"Error in analyze stream: {e!r}")
+        await send({'stage': 'error', 'error': 'Internal server error'})
+
+    await response.write_eof()
+    return response
+
+
+async def analyze_pack(pack, deadline):
+    """analyze_pack from app.py, without blocking the event loop"""
+    if deadline.expired():
+        return pack_fallbacks(pack, 'deadline')
+    if not llm_breaker.allow():
+        return pack_fallbacks(pack, 'circuit_open')
+
+    messages = build_packed_messages([(item_data, comparison_data) for item_data, comparison_data, _, _ in pack])
+
+    async def complete():
+        openai.aiosession.set(openai_session())
+        async with llm_slots:
+            return await openai.ChatCompletion.acreate(
+                messages=messages,
+                request_timeout=max(deadline.remaining(), 1),
+                **packed_completion(pack)
+            )
+
+    started = time.perf_counter()
+    try:
+        response, _ = await hedged_call_async(complete, deadline)
+    except DeadlineExceeded as e:
+        print(f"OpenAI packed analysis timed out: {e}")
+        llm_breaker.record_failure()
+        record_llm_call('packed', 'timeout', started)
+        return pack_fallbacks(pack, 'deadline')
+    except Exception as e:
+        print(f"Error analyzing pack with OpenAI: {e}")
+        llm_breaker.record_failure()
+        record_llm_call('packed', 'error', started)
+        return pack_fallbacks(pack, 'error')
+    llm_breaker.record_success()
+
+    analysis_text = response.choices[0].message.content.strip()
+    input_tokens, output_tokens = prompt_stats.record_usage(messages, response.get('usage'), analysis_text)
+    record_llm_call('packed', 'ok', started, input_tokens, output_tokens)
+    print(f"OpenAI tokens: {input_tokens} in, {output_tokens} out for {len(pack)} items")
+    return await run_blocking(unpack_analyses, analysis_text, pack)
+
+
+async def analyze_resell_potential_packed(entries, deadline=None):
+    """Analyses for a list of (item_data, comparison_data) pairs, LLM_PACK_SIZE items per model call"""
+    if deadline is None:
+        deadline = Deadline(ANALYSIS_LATENCY_BUDGET)
+    analyses, packs, positions = await run_blocking(plan_packs, entries)
+
+    pack_analyses = await asyncio.gather(*(analyze_pack(pack, deadline) for pack in packs))
+    for indexes, results in zip(positions, pack_analyses):
+        for index, analysis in zip(indexes, results):
+            analyses[index] = analysis
+    for (item_data, _), analysis in zip(entries, analyses):
+        record_analysis(analysis)
+        record_history(item_data, analysis)
+    return analyses
+
+
+async def scrape_batch_item(url, deadline=None):
+    """Scrape one batch URL and pick its comparables"""
+    if 'www.vinted' not in url:
+        return {'url': url, 'status': 'error', 'error': 'Please provide a valid Vinted URL'}
+
+    try:
+        item_data = await get_item_data(url, deadline)
+        if not item_data:
+            return {'url': url, 'status': 'error', 'error': 'Failed to scrape item data'}
+
+        return {
+            'url': url,
+            'status': 'fallback' if item_data.get('fallback') else 'ok',
+            'item_data': item_data,
+            'similar_items': await run_blocking(find_similar_items, item_data)
+        }
+
+    except Exception as e:
+        print(f"Error scraping batch item {url}: {e!r}")
+        return {'url': url, 'status': 'error', 'error': 'Failed to scrape item data'}
+
+
+async def analyze_batch_item(url, scrape_deadline):
+    """Scrape, match and analyze one batch URL"""
+    result = await scrape_batch_item(url, scrape_deadline)
+    if result['status'] == 'error':
+        return result
+
+    try:
+        result['analysis'] = await analyze_resell_potential(result['item_data'], result['similar_items'])
+        return result
+
+    except Exception as e:
+        print(f"Error analyzing batch item {url}: {e!r}")
+        return {'url': url, 'status': 'error', 'error': 'Failed to analyze item'}
+
+
+async def analyze_batch(request):
+    """Analyze several Vinted items concurrently"""
+    data = await read_json(request) or {}
+    urls = data.get('urls')
+
+    if not isinstance(urls, list) or not urls:
+        return web.json_response({'error': 'No URLs provided'}, status=400)
+
+    if len(urls) > BATCH_MAX_URLS:
+        return web.json_response({'error': f'A batch can contain at most {BATCH_MAX_URLS} URLs'}, status=400)
+
+    urls = [str(url).strip() for url in urls]
+    # Bounds waits on scrapes shared with other requests, like /analyze
+    scrape_deadline = Deadline(ANALYSIS_LATENCY_BUDGET)
+    if not data.get('packed', BATCH_PACKED):
+        results = await asyncio.gather(*(analyze_batch_item(url, scrape_deadline) for url in urls))
+        return web.json_response({'results': list(results)})
+
+    # Several items share each model call once every scrape is done
+    results = await asyncio.gather(*(scrape_batch_item(url, scrape_deadline) for url in urls))
+    scraped = [result for result in results if result['status'] != 'error']
+    analyses = await analyze_resell_potential_packed(
+        [(result['item_data'], result['similar_items']) for result in scraped]
+    )
+    for result, analysis in zip(scraped, analyses):
+        result['analysis'] = analysis
+    return web.json_response({'results': list(results)})
+
+
+async def close_clients(aiohttp_app):
+    await async_fetcher.close()
+    if _openai_session is not None and not _openai_session.closed:
+        await _openai_session.close()
+
+
+def create_app():
+    """Build the aiohttp application"""
+    aiohttp_app = web.Application(middlewares=[observe_request])
+
+    # The page is static apart from its asset URLs, so render it once
+    with flask_app.test_request_context('/'):
+        aiohttp_app['index_html'] = render_template('index.html')
+
+    aiohttp_app.add_routes([
+        web.get('/', index),
+        web.get('/stats', stats),
+        web.get('/metrics', metrics_endpoint),
+        web.delete('/cache/items/{item_id}', invalidate_cached_item),
+        web.post('/analyze', analyze),
+        web.post('/analyze/stream', analyze_stream),
+        web.post('/analyze/batch', analyze_batch),
+        web.post('/jobs', submit_job),
+        web.get('/jobs/{job_id}', get_job),
+        web.get('/history', get_history),
+        web.get('/history/comparables', get_history_comparables),
+        web.get('/watch/alerts', get_watch_alerts),
+        web.static('/static', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')),
+    ])
+    aiohttp_app.on_startup.append(start_job_workers)
+    aiohttp_app.on_cleanup.append(close_clients)
+    return aiohttp_app
+
+
+app = create_app()
+
+
+if __name__ == '__main__':
+    web.run_app(app, host='0.0.0.0', port=int(os.getenv('PORT', '5000')))
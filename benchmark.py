@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Offline microbenchmarks for scraping, comparable selection, fallback analysis
+and the catalog watcher
+
+Item pages are served from the saved corpus in benchmarks/pages through a
+stub transport mounted on the shared fetcher, so scrape_vinted_item runs
+unchanged without touching the network. The catalog watcher polls a local
+stand-in HTTP server whose search pages list new items on every poll. Comparables are timed on synthetic
+sold-item sets; sets of DATASET_MIN_ROWS rows and more are built as
+memory-mapped datasets, as they would be in production. Every benchmark
+reports operations per second and peak traced memory, compared against
+benchmarks/baseline.json:
+
+    python benchmark.py                      # compare, exit 1 on regressions
+    python benchmark.py --quick              # small comparable sets only
+    python benchmark.py --filter comparables --sizes 10,1000000
+    python benchmark.py --save-baseline      # record this machine's numbers
+
+Baselines are machine-specific; record them on the machine that runs the
+comparison.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+PAGES_DIR = os.path.join(BENCH_DIR, 'pages')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+
+# The app's SQLite stores must not end up in the working tree
+os.environ.setdefault('ITEM_CACHE_DB', os.path.join(tempfile.gettempdir(), 'vintelli_benchmark.db'))
+# Saved pages and the stand-in server are local; pacing them would only time the limiter's waits
+os.environ.setdefault('FETCH_RATE_LIMIT', 'false')
+
+import requests
+from requests.adapters import BaseAdapter
+
+import app
+from comparables import ComparablesStore
+from sold_items import DATASET_VERSION, SoldItemsDataset, build_dataset
+from watcher import CatalogWatcher
+
+# Sold-item set sizes timed by default, and by --quick
+DEFAULT_SIZES = (10, 1000, 10000, 100000, 1000000)
+QUICK_SIZES = (10, 1000)
+
+# Sets this large are built as memory-mapped datasets instead of dicts
+DATASET_MIN_ROWS = 100000
+
+# Each timing round lasts at least this long; the fastest round counts, as
+# slower ones measure interference from the rest of the machine
+MIN_ROUND_SECONDS = 0.2
+ROUNDS = 5
+
+# Allowed slowdown or memory growth against the baseline
+DEFAULT_TOLERANCE = 0.25
+
+# Peaks this small are noise, so they may grow by this many KB regardless
+MEMORY_SLACK_KB = 64
+
+SYNTHETIC_BRANDS = [
+    'Nike', 'Adidas', 'Zara', 'H&M', "Levi's", 'Ralph Lauren', 'Uniqlo', 'Mango', 'Bershka', 'Pull&Bear',
+    'Converse', 'Lacoste', 'Tommy Hilfiger', 'Carhartt', 'The North Face', 'Vans', 'Puma', 'New Balance',
+    'Reebok', 'Calvin Klein', 'Guess', 'Massimo Dutti', 'Stradivarius', 'Sandro', 'Maje', 'Kiabi',
+] + [f'Label {index}' for index in range(300)]
+SYNTHETIC_CATEGORIES = [
+    'Shoes', 'Sneakers', 'Boots', 'Jeans', 'Pants', 'Trousers', 'Shirts', 'Tops', 'Blouses', 'Sweaters',
+    'Hoodies', 'Jackets', 'Blazers', 'Coats', 'Dresses', 'Skirts', 'Bags', 'Handbags', 'Backpacks',
+    'Accessories', 'Jewelry', 'Watches', 'Shorts', 'Swimwear',
+]
+SYNTHETIC_CONDITIONS = ['New with tags', 'Used - Excellent', 'Used - Very Good', 'Used - Good', 'Used - Fair']
+SYNTHETIC_SIZES = ['XS', 'S', 'M', 'L', 'XL', '32/32', '34/32', '38', '40', '42', 'One Size']
+SYNTHETIC_WORDS = ['vintage', 'classic', 'slim', 'oversize', 'cotton', 'leather', 'denim', 'striped',
+                   'black', 'white', 'navy', 'summer', 'winter', 'original', 'logo', 'retro']
+
+# New listings on each stand-in search page, and older ones listed below them
+WATCH_PAGE_SIZES = (24, 96)
+WATCH_OLD_LISTINGS = 48
+
+# Items to find comparables for, covering every branch of the cascade
+QUERY_ITEMS = [
+    {'title': 'Nike Air Max 90 Sneakers', 'price': '45.00', 'brand': 'Nike', 'category': 'Shoes',
+     'condition': 'Used - Good', 'size': '42'},
+    {'title': "Levi's 501 slim jeans", 'price': '25.00', 'brand': "Levi's", 'category': 'Jeans',
+     'condition': 'Used - Very Good', 'size': '32/32'},
+    {'title': 'Polo Ralph Lauren homme', 'price': '28.00', 'brand': 'Ralph', 'category': 'Polos',
+     'condition': 'Used', 'size': 'M'},
+    {'title': 'Jean brut coupe droite', 'price': '19.00', 'brand': '', 'category': 'Hommes > Jeans',
+     'condition': '', 'size': ''},
+    {'title': 'Veste sans marque', 'price': '60.00', 'brand': 'Inconnue', 'category': 'Divers',
+     'condition': 'Bon état', 'size': 'L'},
+    {'title': 'Article', 'price': '', 'brand': '', 'category': '', 'condition': '', 'size': ''},
+]
+
+# Listing URLs for create_fallback_data, covering its brand and category rules
+FALLBACK_URLS = [
+    'https://www.vinted.fr/items/3812569021-polo-ralph-lauren-homme',
+    'https://www.vinted.fr/items/1234567890-nike-air-max-sneakers',
+    'https://www.vinted.fr/items/2234567890-adidas-hoodie-noir',
+    'https://www.vinted.fr/items/3234567890-levis-501-jeans',
+    'https://www.vinted.fr/items/4234567890-zara-robe-ete',
+    'https://www.vinted.fr/items/5234567890-pantalon-hm-chino',
+    'https://www.vinted.fr/items/6234567890-veste-en-jean.html',
+    'https://www.vinted.fr/items/7234567890',
+    'https://www.vinted.fr/member/12345-no-item-here',
+]
+
+
+class CorpusAdapter(BaseAdapter):
+    """requests transport answering with saved pages instead of the network"""
+
+    def __init__(self, pages):
+        super().__init__()
+        self.pages = pages
+
+    def send(self, request, **kwargs):
+        content = self.pages.get(request.url)
+        response = requests.Response()
+        response.status_code = 200 if content is not None else 404
+        response._content = content if content is not None else b''
+        response.headers['Content-Type'] = 'text/html; charset=utf-8'
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class StandInCatalog(ThreadingHTTPServer):
+    """Local Vinted stand-in: every search page lists fresh items, newest first, above older ones"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.lock = threading.Lock()
+        self.next_id = 5000000000
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        threading.Thread(target=self.serve_forever, name='stand-in', daemon=True).start()
+
+    def handle_error(self, request, client_address):
+        # The watcher hangs up on purpose once a page shows only known listings
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def search_page(self, new_listings):
+        with self.lock:
+            first = self.next_id
+            self.next_id += new_listings
+        ids = range(first + new_listings - 1, max(first - WATCH_OLD_LISTINGS, 5000000000) - 1, -1)
+        # Each card links its listing twice, from the photo and from the title
+        cards = ''.join(
+            f'<div class="feed-grid__item"><a href="/items/{item_id}-listing-{item_id}"><img src="/photo/{item_id}.jpg"></a>'
+            f'<a class="title" href="https://www.vinted.fr/items/{item_id}-listing-{item_id}">Listing {item_id}</a>'
+            f'<span class="price">{item_id % 90 + 5} €</span></div>'
+            for item_id in ids
+        )
+        return f'<html><head><title>Catalog</title></head><body><div class="feed-grid">{cards}</div></body></html>'
+
+    def item_page(self, item_id):
+        rng = random.Random(item_id)
+        brand = rng.choice(SYNTHETIC_BRANDS[:10])
+        category = rng.choice(SYNTHETIC_CATEGORIES)
+        product = {
+            '@context': 'https://schema.org', '@type': 'Product',
+            'name': f"{brand} {rng.choice(SYNTHETIC_WORDS)} {category.lower()}",
+            'brand': {'@type': 'Brand', 'name': brand},
+            'category': category,
+            'itemCondition': rng.choice(SYNTHETIC_CONDITIONS),
+            'offers': {'@type': 'Offer', 'price': f"{rng.randint(3, 90)}.00", 'priceCurrency': 'EUR'},
+        }
+        return (f'<html><head><script type="application/ld+json">{json.dumps(product)}</script></head>'
+                f'<body><h1>{product["name"]}</h1></body></html>')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.startswith('/catalog'):
+            size = int(self.path.rsplit('per_page=', 1)[-1]) if 'per_page=' in self.path else WATCH_PAGE_SIZES[0]
+            body = self.server.search_page(size)
+        elif self.path.startswith('/items/'):
+            body = self.server.item_page(int(self.path[len('/items/'):].split('-')[0]))
+        else:
+            self.send_error(404)
+            return
+        content = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+def load_corpus():
+    """(name, url, content, expected fields) of every saved page"""
+    with open(os.path.join(PAGES_DIR, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    corpus = []
+    for name, entry in manifest.items():
+        with open(os.path.join(PAGES_DIR, name), 'rb') as f:
+            corpus.append((os.path.splitext(name)[0], entry['url'], f.read(), entry['expected']))
+    return corpus
+
+
+def synthetic_sold_items(count, seed=0):
+    """count reproducible sold items with a long tail of brands"""
+    rng = random.Random(seed)
+    items = []
+    for _ in range(count):
+        brand = SYNTHETIC_BRANDS[min(int(rng.expovariate(1 / 12)), len(SYNTHETIC_BRANDS) - 1)]
+        category = rng.choice(SYNTHETIC_CATEGORIES)
+        original_price = rng.randint(4, 150)
+        items.append({
+            'title': f"{brand} {rng.choice(SYNTHETIC_WORDS)} {rng.choice(SYNTHETIC_WORDS)} {category.lower()}",
+            'brand': brand,
+            'category': category,
+            'original_price': original_price,
+            'sold_price': round(original_price * rng.uniform(0.9, 2.2)),
+            'days_to_sell': rng.randint(1, 45),
+            'condition': rng.choice(SYNTHETIC_CONDITIONS),
+            'size': rng.choice(SYNTHETIC_SIZES),
+        })
+    return items
+
+
+def synthetic_dataset(count):
+    """Path of a memory-mapped dataset of count synthetic items, built once per machine"""
+    path = os.path.join(tempfile.gettempdir(), f'vintelli_benchmark_sold_{count}_v{DATASET_VERSION}')
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        print(f"Building a {count}-row sold items dataset in {path}...")
+        build_dataset(synthetic_sold_items(count), path)
+    return path
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the log lines printed by the code under test, such as watcher alerts"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def timed_calls(operation, inputs, calls):
+    """Seconds taken by calls calls of operation, cycling through inputs"""
+    count = len(inputs)
+    started = time.perf_counter()
+    for index in range(calls):
+        operation(inputs[index % count])
+    return time.perf_counter() - started
+
+
+def measure(operation, inputs):
+    """(ops/sec, peak KB) of calling operation on each of inputs in turn
+
+    The first calls warm up lazily built indexes and size the rounds.
+    Memory is traced in a separate pass over the inputs, since tracing
+    slows every allocation down.
+    """
+    calls = 1
+    while True:
+        elapsed = timed_calls(operation, inputs, calls)
+        if elapsed >= MIN_ROUND_SECONDS / 10 or calls >= 10 ** 7:
+            break
+        calls *= 10
+    calls = max(1, int(calls * MIN_ROUND_SECONDS / max(elapsed, 1e-9)))
+    rounds = [timed_calls(operation, inputs, calls) for _ in range(ROUNDS)]
+    ops_per_sec = calls / min(rounds)
+
+    tracemalloc.start()
+    try:
+        current, _ = tracemalloc.get_traced_memory()
+        timed_calls(operation, inputs, len(inputs))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return ops_per_sec, (peak - current) / 1024
+
+
+def scrape_benchmarks(corpus):
+    """scrape_vinted_item on each saved page, fetched through the stub transport"""
+    app.shared_fetcher.session.mount('https://', CorpusAdapter({url: content for _, url, content, _ in corpus}))
+    for name, url, _, expected in corpus:
+        with quiet():
+            fields = app.scrape_vinted_item(url)
+        if not fields or {key: fields.get(key) for key in expected} != expected:
+            raise AssertionError(f"scrape_vinted_item no longer extracts {name} as expected: {fields}")
+        yield f'scrape[{name}]', app.scrape_vinted_item, [url], {}
+
+
+def fallback_data_benchmarks():
+    yield 'fallback_data', app.create_fallback_data, FALLBACK_URLS, {}
+
+
+def comparables_store(size):
+    """(store, seconds, traced MB) for a synthetic set, timing the build and the first lookup"""
+    dataset_path = synthetic_dataset(size) if size >= DATASET_MIN_ROWS else None
+    items = synthetic_sold_items(size) if dataset_path is None else None
+
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        if dataset_path is None:
+            store = ComparablesStore(items)
+        else:
+            store = ComparablesStore.from_dataset(SoldItemsDataset(dataset_path))
+        # The scorer and title index are built on first use
+        store.find_similar(QUERY_ITEMS[0])
+        seconds = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return store, seconds, peak / 1024 / 1024
+
+
+def comparables_benchmarks(sizes, selected):
+    """find_similar, as called by analyze(), and the older brand/category cascade"""
+    for size in sizes:
+        if not (selected(f'comparables[{size}]') or selected(f'cascade[{size}]')):
+            continue
+        store, seconds, setup_mb = comparables_store(size)
+        setup = {'setup_seconds': round(seconds, 3), 'setup_mb': round(setup_mb, 1)}
+        yield f'comparables[{size}]', store.find_similar, QUERY_ITEMS, setup
+        yield f'cascade[{size}]', store.find_similar_cascade, QUERY_ITEMS, {}
+
+
+def smart_fallback_benchmarks():
+    store = ComparablesStore(app.MOCK_SOLD_ITEMS)
+    inputs = []
+    for item_data in QUERY_ITEMS:
+        price = float(item_data['price'] or 0)
+        inputs.append((item_data, store.find_similar(item_data), price, price * 1.05 + 5))
+    yield 'smart_fallback', lambda args: app.create_smart_fallback_analysis(*args), inputs, {}
+
+
+def watch_benchmarks(selected):
+    """One poll of a stand-in search page, until its new listings are scraped, matched and scored"""
+    names = {size: f'watch_page[{size}]' for size in WATCH_PAGE_SIZES}
+    if not any(selected(name) for name in names.values()):
+        return
+    server = StandInCatalog()
+    watcher = CatalogWatcher([], app.watch_listing, alerts=app.watch_alerts)
+    watcher.start()
+
+    def poll(search_url):
+        watcher.poll(search_url)
+        watcher.queue.join()
+
+    for size in WATCH_PAGE_SIZES:
+        yield names[size], poll, [f"{server.url}/catalog?order=newest_first&per_page={size}"], {}
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'results': {}}
+
+
+def change(value, base):
+    return f"{(value - base) / base:+.1%}" if base else '-'
+
+
+def regressions(result, base, tolerance):
+    """Why result is worse than its baseline, if it is"""
+    problems = []
+    if result['ops_per_sec'] < base['ops_per_sec'] * (1 - tolerance):
+        problems.append('slower')
+    if result['peak_kb'] > base['peak_kb'] * (1 + tolerance) + MEMORY_SLACK_KB:
+        problems.append('more memory')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the offline benchmarks and compare them with a baseline')
+    parser.add_argument('--sizes', help='comma-separated sold-item set sizes for the comparables benchmarks')
+    parser.add_argument('--quick', action='store_true', help=f"only time sets of {', '.join(map(str, QUICK_SIZES))} items")
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this text')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file to compare with or save to')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed slowdown and memory growth as a fraction (default: %(default)s)')
+    args = parser.parse_args()
+
+    if args.sizes:
+        sizes = [int(size) for size in args.sizes.split(',')]
+    else:
+        sizes = QUICK_SIZES if args.quick else DEFAULT_SIZES
+
+    baseline = load_baseline(args.baseline)
+    selected = lambda name: args.filter in name
+    benchmarks = [
+        lambda: scrape_benchmarks(load_corpus()),
+        fallback_data_benchmarks,
+        lambda: comparables_benchmarks(sizes, selected),
+        smart_fallback_benchmarks,
+        lambda: watch_benchmarks(selected),
+    ]
+
+    results = {}
+    failed = []
+    print(f"{'benchmark':<24} {'ops/sec':>12} {'vs base':>9} {'peak KB':>10} {'vs base':>9}")
+    for benchmarks_of_kind in benchmarks:
+        for name, operation, inputs, extra in benchmarks_of_kind():
+            if not selected(name):
+                continue
+            with quiet():
+                ops_per_sec, peak_kb = measure(operation, inputs)
+            result = dict({'ops_per_sec': round(ops_per_sec, 1), 'peak_kb': round(peak_kb, 1)}, **extra)
+            results[name] = result
+
+            base = baseline['results'].get(name)
+            problems = regressions(result, base, args.tolerance) if base else []
+            if problems:
+                failed.append(name)
+            status = ', '.join(problems) if problems else ('new' if base is None else 'ok')
+            print(f"{name:<24} {ops_per_sec:>12,.1f} {change(ops_per_sec, base['ops_per_sec']) if base else '-':>9} "
+                  f"{peak_kb:>10,.1f} {change(peak_kb, base['peak_kb']) if base else '-':>9}  {status}"
+                  + (f"  (setup {extra['setup_seconds']} s, {extra['setup_mb']} MB)" if 'setup_seconds' in extra else ''))
+            sys.stdout.flush()
+
+    if args.save_baseline:
+        baseline['results'].update(results)
+        baseline['machine'] = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpus': os.cpu_count(),
+        }
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"✅ Saved {len(results)} results to {args.baseline}")
+    elif failed:
+        print(f"❌ {len(failed)} regressions beyond {args.tolerance:.0%}: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+"""
+Indexed store of sold items used to find comparables for an analysed item
+"""
+
+import heapq
+import threading
+from bisect import bisect_left, bisect_right
+from itertools import chain
+
+from pricing_model import PricingModel
+from scoring import ComparableScorer
+from title_index import TitleIndex
+
+# Category synonym groups: a scraped category mentioning the key or any of
+# its related categories is matched against sold items in those categories
+CATEGORY_KEYWORDS = {
+    'hommes': ['jeans', 'pants', 'trousers', 'shirts', 'tops'],
+    'femmes': ['dresses', 'tops', 'skirts', 'blouses'],
+    'chaussures': ['shoes', 'sneakers', 'boots'],
+    'sacs': ['bags', 'handbags', 'backpacks'],
+    'accessoires': ['accessories', 'jewelry', 'watches']
+}
+
+# Used when nothing else matches
+POPULAR_CATEGORIES = ['Shoes', 'Jeans', 'Sweaters', 'Jackets']
+
+# Comparables within this many euros of the item's price are considered similar
+PRICE_RANGE = 20
+
+# Most similar titles fed into comparable scoring
+TITLE_MATCHES = 50
+
+
+def in_row_order(rows):
+    """Yield rows in insertion order, sorting lazily so only consumed rows cost a pop"""
+    if isinstance(rows, range):
+        # Dataset price ranges are contiguous row spans, already in order
+        yield from rows
+        return
+    heap = list(rows)
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap)
+
+
+class ComparablesStore:
+    """Sold items with hash indexes on brand and category and a sorted price index"""
+
+    def __init__(self, items=()):
+        self.items = []
+        self._brand_index = {}
+        self._category_index = {}
+        self._keyword_index = {}
+        self._price_keys = []
+        self._price_rows = []
+        self._scorer = None
+        self._title_index = None
+        self._pricing_model = None
+        self._pricing_stale = False
+        self._refit_thread = None
+        self._lock = threading.Lock()
+        self.add_many(items)
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        """Read-only store over a memory-mapped SoldItemsDataset"""
+        store = cls()
+        store.items = dataset
+        store._brand_index = dataset.postings('brand')
+        store._category_index = dataset.postings('category')
+        store._keyword_index = dataset.postings('keyword')
+        # Dataset rows are stored sorted by original price
+        store._price_keys = dataset.column('original_price')
+        store._price_rows = range(len(dataset))
+        store._scorer = ComparableScorer.from_dataset(dataset, CATEGORY_KEYWORDS)
+        store._title_index = TitleIndex.from_dataset(dataset)
+        store.read_only = True
+        return store
+
+    read_only = False
+
+    def __len__(self):
+        return len(self.items)
+
+    def _index(self, row, item):
+        """Add one stored row to the hash indexes"""
+        brand = item['brand'].lower()
+        category = item['category'].lower()
+        self._brand_index.setdefault(brand, []).append(row)
+        self._category_index.setdefault(category, []).append(row)
+        for keyword, related_categories in CATEGORY_KEYWORDS.items():
+            if any(cat in category for cat in related_categories):
+                self._keyword_index.setdefault(keyword, []).append(row)
+
+    def _insert_price(self, row, price):
+        """Insert one row into the sorted price index, after rows of equal price"""
+        position = bisect_right(self._price_keys, price)
+        self._price_keys.insert(position, price)
+        self._price_rows.insert(position, row)
+
+    def _added(self, first):
+        """Bring the scorer and pricing model up to date with the rows from first on
+
+        Runs with the lock held. A built scorer is extended with the new rows
+        rather than rebuilt from every item on the next request, and the
+        pricing model keeps serving while a refit runs in the background.
+        """
+        if self._scorer is not None:
+            self._scorer = self._scorer.extended(self.items[first:])
+        if self._pricing_model is not None:
+            self._pricing_stale = True
+            if self._refit_thread is None:
+                self._refit_thread = threading.Thread(target=self._refit_pricing_model, name='pricing-refit', daemon=True)
+                self._refit_thread.start()
+
+    def _refit_pricing_model(self):
+        """Refit the pricing model until no items were added during the last fit, swapping each fit in"""
+        while True:
+            with self._lock:
+                if not self._pricing_stale:
+                    self._refit_thread = None
+                    return
+                self._pricing_stale = False
+                items = list(self.items)
+            try:
+                model = PricingModel.from_items(items)
+            except Exception as e:
+                print(f"Error refitting pricing model: {e}")
+                continue
+            with self._lock:
+                self._pricing_model = model
+
+    def add(self, item):
+        """Add a single sold item"""
+        if self.read_only:
+            raise TypeError('Cannot add items to a dataset-backed comparables store')
+        with self._lock:
+            row = len(self.items)
+            self.items.append(item)
+            self._index(row, item)
+            self._insert_price(row, item['original_price'])
+            if self._title_index is not None:
+                self._title_index.add(row, item['title'])
+            self._added(row)
+
+    def add_many(self, items):
+        """Add sold items in bulk, re-sorting the price index only when that beats inserting them"""
+        if self.read_only:
+            raise TypeError('Cannot add items to a dataset-backed comparables store')
+        with self._lock:
+            first = len(self.items)
+            for item in items:
+                row = len(self.items)
+                self.items.append(item)
+                self._index(row, item)
+                if self._title_index is not None:
+                    self._title_index.add(row, item['title'])
+            if len(self.items) - first < first:
+                for row in range(first, len(self.items)):
+                    self._insert_price(row, self.items[row]['original_price'])
+            else:
+                order = sorted(range(len(self.items)), key=lambda row: self.items[row]['original_price'])
+                self._price_keys = [self.items[row]['original_price'] for row in order]
+                self._price_rows = order
+            self._added(first)
+
+    def brand_rows(self, brand):
+        """Rows whose brand matches exactly, ignoring case"""
+        return self._brand_index.get(brand.lower(), [])
+
+    def category_rows(self, category):
+        """Rows whose category matches exactly, ignoring case"""
+        return self._category_index.get(category.lower(), [])
+
+    def partial_brand_rows(self, brand):
+        """Rows, unordered, whose brand contains or is contained in the given brand"""
+        brand = brand.lower()
+        rows = []
+        # Scans the distinct brand names, not the sold items
+        for indexed_brand, brand_rows in list(self._brand_index.items()):
+            if brand in indexed_brand or indexed_brand in brand:
+                rows.extend(brand_rows)
+        return rows
+
+    def keyword_rows(self, category):
+        """Rows in the first synonym group the given category belongs to"""
+        category = category.lower()
+        for keyword, related_categories in CATEGORY_KEYWORDS.items():
+            if keyword in category or any(cat in category for cat in related_categories):
+                return self._keyword_index.get(keyword, [])
+        return []
+
+    def price_rows(self, price, price_range=PRICE_RANGE):
+        """Rows, unordered, whose original price is within price_range of the given price"""
+        start = bisect_left(self._price_keys, price - price_range)
+        end = bisect_right(self._price_keys, price + price_range)
+        return self._price_rows[start:end]
+
+    def popular_rows(self, limit):
+        """First rows, in row order, from the popular fallback categories"""
+        rows = []
+        for row in heapq.merge(*(self.category_rows(category) for category in POPULAR_CATEGORIES)):
+            # The index ignores case but the popular categories match exactly
+            if self.items[row]['category'] in POPULAR_CATEGORIES:
+                rows.append(row)
+                if len(rows) >= limit:
+                    break
+        return rows
+
+    def scorer(self):
+        """Column arrays for vectorized scoring, built on first use and then extended as items are added"""
+        scorer = self._scorer
+        if scorer is None:
+            with self._lock:
+                if self._scorer is None:
+                    self._scorer = ComparableScorer.from_items(self.items, CATEGORY_KEYWORDS)
+                scorer = self._scorer
+        return scorer
+
+    def pricing_model(self):
+        """Resale pricing model fitted on the sold items, refitted in the background after items are added"""
+        model = self._pricing_model
+        if model is None:
+            with self._lock:
+                if self._pricing_model is None:
+                    if self.read_only:
+                        self._pricing_model = PricingModel.from_dataset(self.items)
+                    else:
+                        self._pricing_model = PricingModel.from_items(self.items)
+                model = self._pricing_model
+        return model
+
+    def title_index(self):
+        """N-gram index over sold-item titles, built on first use and then kept up to date"""
+        index = self._title_index
+        if index is None:
+            with self._lock:
+                if self._title_index is None:
+                    self._title_index = TitleIndex.from_titles(item['title'] for item in self.items)
+                index = self._title_index
+        return index
+
+    def similar_titles(self, title, limit=TITLE_MATCHES):
+        """(row, similarity) pairs of the sold items with the most similar titles"""
+        if not title:
+            return []
+        return self.title_index().search(title, limit)
+
+    def find_similar(self, item_data, limit=3):
+        """Pick the best-scoring comparables for an item"""
+        # The scorer first: titles indexed after it was built are dropped
+        # rather than scored against arrays that do not have their rows
+        scorer = self.scorer()
+        title_matches = [
+            (row, similarity) for row, similarity in self.similar_titles(item_data.get('title'))
+            if row < len(scorer)
+        ]
+        # Fetch a few extra rows so duplicate listings can be skipped
+        rows = scorer.top_k(item_data, limit * 4, title_matches)
+        return self._unique_items(rows, limit)
+
+    def _unique_items(self, rows, limit):
+        """First limit items from rows, skipping repeated brand/title pairs"""
+        similar_items = []
+        seen = set()
+        for row in rows:
+            item = self.items[row]
+            item_key = f"{item['brand']}-{item['title']}"
+            if item_key not in seen:
+                similar_items.append(item)
+                seen.add(item_key)
+            if len(similar_items) >= limit:
+                break
+
+        return similar_items
+
+    def find_similar_cascade(self, item_data, limit=3):
+        """Pick comparables for an item through the brand → category → fallback cascade"""
+        brand = item_data.get('brand')
+        category = item_data.get('category')
+
+        # Same brand first, then same category; both lists are in row order
+        candidates = []
+        if brand:
+            candidates.append(self.brand_rows(brand))
+        if category:
+            candidates.append(self.category_rows(category))
+
+        # Each fallback only runs when everything before it found nothing
+        if not any(candidates):
+            candidates = []
+            rows = []
+            if brand:
+                rows = self.partial_brand_rows(brand)
+            if not rows and category:
+                # Synonym groups are indexed in row order already
+                rows = self.keyword_rows(category)
+                if rows:
+                    candidates = [rows]
+            if not rows and item_data.get('price'):
+                try:
+                    rows = self.price_rows(float(item_data['price']))
+                except (ValueError, TypeError):
+                    pass
+            if not rows:
+                rows = self.popular_rows(limit)
+            if not candidates:
+                candidates = [in_row_order(rows)]
+
+        # Ensure we don't have duplicates and stop as soon as we have enough
+        return self._unique_items(chain.from_iterable(candidates), limit)
@@ -0,0 +1,581 @@
+"""
+Extraction of item fields from a Vinted item page
+
+The listing is read from the JSON the page embeds (JSON-LD and the app's
+hydration state) straight from the response bytes. Only pages without a
+usable payload are parsed into a DOM and walked once with the selector rules.
+"""
+
+import json
+import re
+import threading
+import time
+from collections import deque
+
+from bs4 import BeautifulSoup, NavigableString
+from bs4.element import CData, Comment, Declaration, Doctype, ProcessingInstruction
+
+try:
+    import lxml  # noqa: F401
+    PARSER_BACKEND = 'lxml'
+except ImportError:
+    PARSER_BACKEND = 'html.parser'
+
+# Strings ignored by :contains() style text matching
+SPECIAL_STRINGS = (Comment, Declaration, CData, ProcessingInstruction, Doctype)
+
+# Precompiled patterns
+PRICE_PATTERNS = [
+    re.compile(r'€(\d+(?:[.,]\d+)?)'),
+    re.compile(r'(\d+(?:[.,]\d+)?)\s*€'),
+    re.compile(r'(\d+(?:[.,]\d+)?)'),
+    re.compile(r'(\d+)\s*EUR'),
+    re.compile(r'(\d+)\s*euro')
+]
+EURO_PRICE_PATTERN = re.compile(r'€\s*(\d+(?:[.,]\d+)?)')
+NUMBER_PATTERN = re.compile(r'(\d{1,3}(?:[.,]\d{2})?)')
+SIZE_VALUE_PATTERN = re.compile(r'(?:Size|Taille)[:\s]*([^\s]+)', re.IGNORECASE)
+CONDITION_VALUE_PATTERN = re.compile(r'(?:Condition|État)[:\s]*(.+)', re.IGNORECASE)
+BRAND_FROM_TITLE_PATTERN = re.compile(r'(\w+)\s+(?:Pantalon|Pants|Shirt|T-shirt|Sweater|Jacket|Shoes|Sneakers)', re.IGNORECASE)
+
+# Candidate rules per field, in priority order. Each name is the CSS selector
+# it replaces; a field takes the first rule whose first match is usable.
+TITLE_RULES = [
+    'h1[data-testid="item-title"]',
+    'h1',
+    '[data-testid="item-title"]',
+    '.item-title',
+    'title'
+]
+PRICE_RULES = [
+    '[data-testid="item-price"]',
+    '[data-testid="price"]',
+    '.web_ui__Text__text',
+    '[class*="price"]',
+    '[class*="Price"]',
+    'span[class*="price"]',
+    'div[class*="price"]',
+    '[class*="amount"]',
+    '[class*="Amount"]',
+    'span[class*="amount"]',
+    'div[class*="amount"]',
+    '[data-testid*="price"]',
+    '[data-testid*="Price"]',
+    '[class*="cost"]',
+    '[class*="Cost"]',
+    '[data-testid="item-price"] span',
+    '[data-testid="price"] span',
+    '.web_ui__Text__text[class*="price"]',
+    '.web_ui__Text__text[class*="Price"]',
+    'span:contains("€")',
+    'div:contains("€")',
+    'p:contains("€")'
+]
+BRAND_RULES = [
+    'a[href*="/brand/"]',
+    '[data-testid="item-brand"]',
+    '.brand',
+    '.item-brand',
+    'a[href*="brand"]'
+]
+SIZE_RULES = [
+    '[data-testid="item-size"]',
+    '.size',
+    '.item-size',
+    'span:contains("Size")',
+    'span:contains("Taille")'
+]
+CATEGORY_RULES = [
+    'a[href*="/catalog/"]',
+    '[data-testid="item-category"]',
+    '.category',
+    '.item-category',
+    'nav a[href*="catalog"]'
+]
+CONDITION_RULES = [
+    '[data-testid="item-condition"]',
+    '.condition',
+    '.item-condition',
+    'span:contains("Condition")',
+    'span:contains("État")'
+]
+
+# Simple attribute rules, looked up from each tag's attributes
+TESTID_RULES = {
+    'item-title': '[data-testid="item-title"]',
+    'item-price': '[data-testid="item-price"]',
+    'price': '[data-testid="price"]',
+    'item-brand': '[data-testid="item-brand"]',
+    'item-size': '[data-testid="item-size"]',
+    'item-category': '[data-testid="item-category"]',
+    'item-condition': '[data-testid="item-condition"]',
+}
+CLASS_RULES = {
+    'web_ui__Text__text': '.web_ui__Text__text',
+    'item-title': '.item-title',
+    'brand': '.brand',
+    'item-brand': '.item-brand',
+    'size': '.size',
+    'item-size': '.item-size',
+    'category': '.category',
+    'item-category': '.item-category',
+    'condition': '.condition',
+    'item-condition': '.item-condition',
+}
+CLASS_SUBSTRING_RULES = ['price', 'Price', 'amount', 'Amount', 'cost', 'Cost']
+
+# (needle, tag name) pairs for the :contains() rules
+CONTAINS_RULES = {
+    ('€', 'span'): 'span:contains("€")',
+    ('€', 'div'): 'div:contains("€")',
+    ('€', 'p'): 'p:contains("€")',
+    ('Size', 'span'): 'span:contains("Size")',
+    ('Taille', 'span'): 'span:contains("Taille")',
+    ('Condition', 'span'): 'span:contains("Condition")',
+    ('État', 'span'): 'span:contains("État")',
+}
+CONTAINS_NEEDLES = sorted({needle for needle, _ in CONTAINS_RULES})
+
+# Embedded JSON payloads, searched in the raw response bytes
+SCRIPT_TAG_PATTERN = re.compile(rb'<script\b([^>]*)>', re.IGNORECASE)
+SCRIPT_END_PATTERN = re.compile(rb'</script', re.IGNORECASE)
+JSON_SCRIPT_TYPE_PATTERN = re.compile(rb'type\s*=\s*["\']?application/(ld\+json|json)', re.IGNORECASE)
+STATE_ASSIGNMENT_PATTERN = re.compile(rb'window\.__[A-Za-z_]+__\s*=\s*')
+
+# Hydration-state keys for each field, in priority order
+EMBEDDED_PRICE_KEYS = ['price', 'price_numeric', 'total_item_price']
+EMBEDDED_BRAND_KEYS = ['brand_title', 'brand', 'brand_dto']
+EMBEDDED_SIZE_KEYS = ['size_title', 'size']
+EMBEDDED_CATEGORY_KEYS = ['catalog_title', 'category']
+EMBEDDED_CONDITION_KEYS = ['status', 'status_title', 'condition']
+
+# schema.org itemCondition values
+SCHEMA_CONDITIONS = {
+    'NewCondition': 'Neuf',
+    'UsedCondition': 'Used',
+    'RefurbishedCondition': 'Refurbished',
+    'DamagedCondition': 'Damaged',
+}
+
+# Number of recent parse timings kept for percentile stats
+PARSE_TIME_WINDOW = 500
+
+
+class ParseStats:
+    """Thread-safe parse timing accumulator"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = deque(maxlen=PARSE_TIME_WINDOW)
+        self.count = 0
+        self.total_ms = 0.0
+        self.sources = {'embedded': 0, 'dom': 0}
+
+    def record(self, elapsed_ms, source):
+        with self._lock:
+            self._timings.append(elapsed_ms)
+            self.count += 1
+            self.total_ms += elapsed_ms
+            self.sources[source] += 1
+
+    def stats(self):
+        with self._lock:
+            timings = sorted(self._timings)
+            count = self.count
+            total_ms = self.total_ms
+            sources = dict(self.sources)
+
+        def percentile(fraction):
+            if not timings:
+                return None
+            return round(timings[min(len(timings) - 1, int(round(fraction * (len(timings) - 1))))], 3)
+
+        return {
+            'backend': PARSER_BACKEND,
+            'parses': count,
+            'sources': sources,
+            'avg_ms': round(total_ms / count, 3) if count else None,
+            'p50_ms': percentile(0.5),
+            'p95_ms': percentile(0.95),
+        }
+
+
+parse_stats = ParseStats()
+
+
+class PageScan:
+    """Everything the field rules need, collected in one walk over the tree"""
+
+    def __init__(self, soup):
+        self.first = {}
+        self.testid_item_price = []
+        self.testid_price = []
+        self.navs = []
+        self.last_catalog_link = None
+        self._text_parts = []
+        self._text = None
+        self._pending_needles = set(CONTAINS_NEEDLES)
+        self._walk(soup)
+
+    def _found(self, rule, tag):
+        if rule not in self.first:
+            self.first[rule] = tag
+
+    def _walk(self, soup):
+        for node in soup.descendants:
+            if isinstance(node, NavigableString):
+                if type(node) is NavigableString:
+                    self._text_parts.append(node)
+                if self._pending_needles and not isinstance(node, SPECIAL_STRINGS):
+                    self._match_contains(node)
+                continue
+
+            self._match_tag(node)
+
+    def _match_contains(self, node):
+        """Record the outermost span/div/p around the first string holding each needle"""
+        for needle in list(self._pending_needles):
+            if needle not in node:
+                continue
+            outermost = {}
+            for parent in node.parents:
+                if parent.name in ('span', 'div', 'p'):
+                    outermost[parent.name] = parent
+            for (rule_needle, name), rule in CONTAINS_RULES.items():
+                if rule_needle == needle and name in outermost:
+                    self._found(rule, outermost[name])
+            if all(rule in self.first for (rule_needle, _), rule in CONTAINS_RULES.items() if rule_needle == needle):
+                self._pending_needles.discard(needle)
+
+    def _match_tag(self, tag):
+        name = tag.name
+        attrs = tag.attrs
+
+        if name == 'h1':
+            self._found('h1', tag)
+        elif name == 'title':
+            self._found('title', tag)
+        elif name == 'nav':
+            self.navs.append(tag)
+
+        testid = attrs.get('data-testid')
+        if testid:
+            rule = TESTID_RULES.get(testid)
+            if rule:
+                self._found(rule, tag)
+                if testid == 'item-title' and name == 'h1':
+                    self._found('h1[data-testid="item-title"]', tag)
+                elif testid == 'item-price':
+                    self.testid_item_price.append(tag)
+                elif testid == 'price':
+                    self.testid_price.append(tag)
+            if 'price' in testid:
+                self._found('[data-testid*="price"]', tag)
+            if 'Price' in testid:
+                self._found('[data-testid*="Price"]', tag)
+
+        classes = attrs.get('class')
+        if classes:
+            if isinstance(classes, str):
+                classes = classes.split()
+            for class_name in classes:
+                rule = CLASS_RULES.get(class_name)
+                if rule:
+                    self._found(rule, tag)
+            class_text = ' '.join(classes)
+            for substring in CLASS_SUBSTRING_RULES:
+                if substring in class_text:
+                    self._found(f'[class*="{substring}"]', tag)
+                    if name in ('span', 'div'):
+                        self._found(f'{name}[class*="{substring}"]', tag)
+                    if substring in ('price', 'Price') and 'web_ui__Text__text' in classes:
+                        self._found(f'.web_ui__Text__text[class*="{substring}"]', tag)
+
+        if name == 'a':
+            href = attrs.get('href')
+            if href:
+                if '/brand/' in href:
+                    self._found('a[href*="/brand/"]', tag)
+                if 'brand' in href:
+                    self._found('a[href*="brand"]', tag)
+                if '/catalog/' in href:
+                    self._found('a[href*="/catalog/"]', tag)
+                    self.last_catalog_link = tag
+
+    def select(self, rule):
+        """First element matching a rule, like soup.select_one(rule)"""
+        if rule in self.first:
+            return self.first[rule]
+        if rule == '[data-testid="item-price"] span':
+            return self._first_descendant(self.testid_item_price, 'span')
+        if rule == '[data-testid="price"] span':
+            return self._first_descendant(self.testid_price, 'span')
+        if rule == 'nav a[href*="catalog"]':
+            for nav in self.navs:
+                link = nav.find('a', href=lambda href: href and 'catalog' in href)
+                if link:
+                    return link
+        return None
+
+    @staticmethod
+    def _first_descendant(ancestors, name):
+        for ancestor in ancestors:
+            match = ancestor.find(name)
+            if match:
+                return match
+        return None
+
+    @property
+    def text(self):
+        """Page text, equivalent to soup.get_text(), joined at most once"""
+        if self._text is None:
+            self._text = ''.join(self._text_parts)
+        return self._text
+
+
+def extract_price(scan):
+    """Price from the first price candidate holding a number, else from page text"""
+    price = ""
+    for rule in PRICE_RULES:
+        price_elem = scan.select(rule)
+        if price_elem:
+            price_text = price_elem.get_text().strip()
+
+            # Look for various price formats
+            for pattern in PRICE_PATTERNS:
+                price_match = pattern.search(price_text)
+                if price_match:
+                    price = price_match.group(1).replace(',', '.')
+                    break
+            if price:
+                return price
+
+    # If still no price, try to find any number that looks like a price
+    price_match = EURO_PRICE_PATTERN.search(scan.text)
+    if price_match:
+        price = price_match.group(1).replace(',', '.')
+        return price
+
+    # Take the first number that could be a price (between 5 and 500 euros)
+    for number_match in NUMBER_PATTERN.finditer(scan.text):
+        number = number_match.group(1)
+        if 5 <= float(number.replace(',', '.')) <= 500:
+            price = number.replace(',', '.')
+            return price
+
+    return price
+
+
+def embedded_payloads(content):
+    """Yield decoded JSON-LD and hydration-state payloads found in raw page bytes"""
+    for script_match in SCRIPT_TAG_PATTERN.finditer(content):
+        start = script_match.end()
+        end_match = SCRIPT_END_PATTERN.search(content, start)
+        end = end_match.start() if end_match else len(content)
+        body = content[start:end]
+
+        if JSON_SCRIPT_TYPE_PATTERN.search(script_match.group(1)):
+            try:
+                yield json.loads(body.decode('utf-8', errors='replace'))
+            except ValueError:
+                continue
+        else:
+            # Inline scripts assigning the initial state to a window global
+            state_match = STATE_ASSIGNMENT_PATTERN.search(body)
+            if state_match:
+                try:
+                    payload, _ = json.JSONDecoder().raw_decode(body[state_match.end():].decode('utf-8', errors='replace'))
+                except ValueError:
+                    continue
+                yield payload
+
+
+def walk_json(payload):
+    """Yield every dict nested in a decoded JSON payload, in document order"""
+    stack = [payload]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            yield value
+            stack.extend(reversed(list(value.values())))
+        elif isinstance(value, list):
+            stack.extend(reversed(value))
+
+
+def embedded_text(value):
+    """Text of a scalar field or of a nested {title/name/amount} object"""
+    if isinstance(value, dict):
+        for key in ('title', 'name', 'amount', 'value'):
+            if value.get(key) not in (None, ''):
+                return embedded_text(value[key])
+        return ''
+    if value is None or isinstance(value, bool):
+        return ''
+    return str(value).strip()
+
+
+def first_embedded(node, keys):
+    for key in keys:
+        text = embedded_text(node.get(key))
+        if text:
+            return text
+    return ''
+
+
+def is_product(node):
+    node_type = node.get('@type')
+    return node_type == 'Product' or (isinstance(node_type, list) and 'Product' in node_type)
+
+
+def json_ld_fields(node):
+    """Item fields from a schema.org Product"""
+    offers = node.get('offers')
+    if isinstance(offers, list):
+        offers = offers[0] if offers else {}
+    condition = embedded_text(node.get('itemCondition')) or embedded_text((offers or {}).get('itemCondition'))
+    return {
+        'title': embedded_text(node.get('name')),
+        'price': embedded_text((offers or {}).get('price')) if isinstance(offers, dict) else '',
+        'brand': embedded_text(node.get('brand')),
+        'size': embedded_text(node.get('size')),
+        'category': embedded_text(node.get('category')),
+        'condition': SCHEMA_CONDITIONS.get(condition.rsplit('/', 1)[-1], condition),
+    }
+
+
+def hydration_fields(node):
+    """Item fields from a listing object in the app's hydration state"""
+    return {
+        'title': embedded_text(node.get('title')),
+        'price': first_embedded(node, EMBEDDED_PRICE_KEYS),
+        'brand': first_embedded(node, EMBEDDED_BRAND_KEYS),
+        'size': first_embedded(node, EMBEDDED_SIZE_KEYS),
+        'category': first_embedded(node, EMBEDDED_CATEGORY_KEYS),
+        'condition': first_embedded(node, EMBEDDED_CONDITION_KEYS),
+    }
+
+
+def extract_embedded_fields(content, item_id=None):
+    """Item fields from the page's embedded JSON, or None when it has no usable listing
+
+    Hydration-state listings are preferred when their id matches item_id;
+    JSON-LD fills in any field they leave empty.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+
+    product = None
+    listing = None
+    for payload in embedded_payloads(content):
+        for node in walk_json(payload):
+            if is_product(node):
+                if product is None:
+                    product = json_ld_fields(node)
+            elif isinstance(node.get('title'), str) and any(key in node for key in EMBEDDED_PRICE_KEYS):
+                if item_id and str(node.get('id')) == str(item_id):
+                    listing = hydration_fields(node)
+                elif listing is None and not item_id:
+                    listing = hydration_fields(node)
+
+    fields = listing or product
+    if fields is None:
+        return None
+    if listing and product:
+        fields = {key: value or product[key] for key, value in listing.items()}
+
+    fields['price'] = fields['price'].replace(',', '.')
+    try:
+        float(fields['price'])
+    except ValueError:
+        return None
+    if not fields['title']:
+        return None
+    return fields
+
+
+def extract_dom_fields(content):
+    """Parse a Vinted item page and extract its fields in one traversal"""
+    soup = BeautifulSoup(content, PARSER_BACKEND)
+    scan = PageScan(soup)
+
+    title = ""
+    brand = ""
+    size = ""
+    category = ""
+    condition = ""
+
+    for rule in TITLE_RULES:
+        title_elem = scan.select(rule)
+        if title_elem:
+            title = title_elem.get_text().strip()
+            if title and title != "Vinted":
+                break
+
+    price = extract_price(scan)
+
+    for rule in BRAND_RULES:
+        brand_elem = scan.select(rule)
+        if brand_elem:
+            brand = brand_elem.get_text().strip()
+            if brand and brand.lower() not in ['brand', 'marque']:
+                break
+
+    for rule in SIZE_RULES:
+        size_elem = scan.select(rule)
+        if size_elem:
+            size_text = size_elem.get_text().strip()
+            if 'size' in size_text.lower() or 'taille' in size_text.lower():
+                # Extract just the size value
+                size_match = SIZE_VALUE_PATTERN.search(size_text)
+                size = size_match.group(1) if size_match else size_text
+                break
+
+    for rule in CATEGORY_RULES:
+        category_elem = scan.select(rule)
+        if category_elem:
+            category = category_elem.get_text().strip()
+            if category and category.lower() not in ['catalog', 'catégorie']:
+                break
+
+    for rule in CONDITION_RULES:
+        condition_elem = scan.select(rule)
+        if condition_elem:
+            condition_text = condition_elem.get_text().strip()
+            if 'condition' in condition_text.lower() or 'état' in condition_text.lower():
+                # Extract just the condition value
+                condition_match = CONDITION_VALUE_PATTERN.search(condition_text)
+                condition = condition_match.group(1).strip() if condition_match else condition_text
+                break
+
+    # Fallback: try to extract from breadcrumbs or navigation
+    if not category and scan.last_catalog_link:
+        category = scan.last_catalog_link.get_text().strip()
+
+    return {
+        'title': title,
+        'price': price,
+        'brand': brand,
+        'size': size,
+        'category': category,
+        'condition': condition
+    }
+
+
+def extract_item_fields(content, url, item_id=None):
+    """Extract item fields from a Vinted item page, from embedded JSON when possible"""
+    started = time.perf_counter()
+    fields = extract_embedded_fields(content, item_id)
+    source = 'embedded'
+    if fields is None:
+        fields = extract_dom_fields(content)
+        source = 'dom'
+
+    if not fields['brand'] and fields['title']:
+        # Try to extract brand from title
+        brand_match = BRAND_FROM_TITLE_PATTERN.search(fields['title'])
+        if brand_match:
+            fields['brand'] = brand_match.group(1)
+    fields['url'] = url
+
+    parse_stats.record((time.perf_counter() - started) * 1000, source)
+    return fields
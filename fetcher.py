@@ -0,0 +1,492 @@
+"""
+Shared HTTP fetcher for Vinted pages
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+# Browser-like headers sent with every request
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Cache-Control': 'no-cache',
+    'Pragma': 'no-cache',
+}
+
+# Timeouts in seconds: connecting should be quick, reading a page may not be
+CONNECT_TIMEOUT = float(os.getenv('FETCH_CONNECT_TIMEOUT', '3.05'))
+READ_TIMEOUT = float(os.getenv('FETCH_READ_TIMEOUT', '15'))
+
+# Retry policy for throttled or failing upstream responses
+MAX_RETRIES = int(os.getenv('FETCH_MAX_RETRIES', '2'))
+BACKOFF_BASE = float(os.getenv('FETCH_BACKOFF_BASE', '0.5'))
+BACKOFF_MAX = float(os.getenv('FETCH_BACKOFF_MAX', '8'))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Connection pool sizing: number of hosts kept pooled, connections per host
+POOL_HOSTS = int(os.getenv('FETCH_POOL_HOSTS', '10'))
+POOL_MAXSIZE = int(os.getenv('FETCH_POOL_MAXSIZE', '50'))
+
+# Number of recent latencies kept per host for percentile stats
+LATENCY_WINDOW = 500
+
+# Pace requests to each host, backing off when it throttles us
+FETCH_RATE_LIMIT = os.getenv('FETCH_RATE_LIMIT', 'true').lower() in ('1', 'true', 'yes')
+
+# Requests per second allowed to a host at first, and the range it adapts within
+FETCH_RATE_INITIAL = float(os.getenv('FETCH_RATE_INITIAL', '5'))
+FETCH_RATE_MIN = float(os.getenv('FETCH_RATE_MIN', '0.5'))
+FETCH_RATE_MAX = float(os.getenv('FETCH_RATE_MAX', '50'))
+
+# Requests per second added for every second of successful requests
+FETCH_RATE_INCREASE = float(os.getenv('FETCH_RATE_INCREASE', '1'))
+
+# Factor applied to the rate and the concurrency limit when a host throttles us
+FETCH_RATE_DECREASE = float(os.getenv('FETCH_RATE_DECREASE', '0.5'))
+
+# Requests in flight to a host at first; the limit grows up to FETCH_POOL_MAXSIZE
+FETCH_CONCURRENCY_INITIAL = float(os.getenv('FETCH_CONCURRENCY_INITIAL', '4'))
+
+# Longest a request waits for its turn before giving up, in seconds
+FETCH_QUEUE_TIMEOUT = float(os.getenv('FETCH_QUEUE_TIMEOUT', '30'))
+
+# Longest pause a host's Retry-After may impose on every request, in seconds
+RETRY_AFTER_MAX = 300
+
+# Statuses and page markers meaning the host wants us to slow down
+THROTTLE_STATUSES = {429, 503}
+CHALLENGE_MARKERS = (b'captcha-delivery.com', b'challenge-platform', b'cf-chl', b'_Incapsula_Resource')
+
+
+def parse_retry_after(value):
+    """Convert a Retry-After header into seconds, or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Exponential backoff with full jitter, never shorter than Retry-After"""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, BACKOFF_MAX))
+    return delay
+
+
+def is_challenge(status, content):
+    """Whether a 403 is a bot challenge page rather than a real refusal"""
+    return status == 403 and any(marker in content for marker in CHALLENGE_MARKERS)
+
+
+def percentile(values, fraction):
+    """Return the given percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class QueueTimeout(Exception):
+    """A request waited longer than FETCH_QUEUE_TIMEOUT for its turn"""
+
+
+class HostLimit:
+    """Token bucket and concurrency limit of one host, adapted by AIMD
+
+    Every successful request adds FETCH_RATE_INCREASE / rate to the rate,
+    about FETCH_RATE_INCREASE per second, and 1 / limit to the concurrency
+    limit, about one more request in flight per round of requests. A 429,
+    challenge page or timeout multiplies both by FETCH_RATE_DECREASE, once
+    per round: requests that started before the last decrease do not
+    decrease again, as they were sent at the old rate.
+    """
+
+    def __init__(self, rate, concurrency, max_concurrency):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.tokens = 1.0
+        self.refilled = time.monotonic()
+        self.in_flight = 0
+        self.queued = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.throttled = 0
+        self.decreases = 0
+
+    def admit(self, now):
+        """Take a slot and a token if both are free; otherwise seconds until a token is due, or None"""
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= max(1, int(self.concurrency)):
+            # A finishing request frees the slot
+            return None
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        self.in_flight += 1
+        return 0.0
+
+    def succeeded(self):
+        self.rate = min(FETCH_RATE_MAX, self.rate + FETCH_RATE_INCREASE / self.rate)
+        self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    def throttle(self, started, now, retry_after):
+        self.throttled += 1
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + min(retry_after, RETRY_AFTER_MAX))
+        if started < self.last_decrease:
+            return
+        self.rate = max(FETCH_RATE_MIN, self.rate * FETCH_RATE_DECREASE)
+        self.concurrency = max(1.0, self.concurrency * FETCH_RATE_DECREASE)
+        self.tokens = min(self.tokens, 0.0)
+        self.last_decrease = now
+        self.decreases += 1
+
+
+class HostLimiter:
+    """Per-host admission control shared by the threads or tasks of one fetcher"""
+
+    def __init__(self, enabled=FETCH_RATE_LIMIT, rate=FETCH_RATE_INITIAL, concurrency=FETCH_CONCURRENCY_INITIAL,
+                 max_concurrency=POOL_MAXSIZE, queue_timeout=FETCH_QUEUE_TIMEOUT):
+        self.enabled = enabled
+        self.rate = rate
+        self.concurrency = min(concurrency, max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        # Woken whenever a request finishes, as its slot may be what a waiter needs
+        self._released = threading.Condition(self._lock)
+        self._hosts = {}
+
+    def _host(self, host):
+        limit = self._hosts.get(host)
+        if limit is None:
+            limit = self._hosts[host] = HostLimit(self.rate, self.concurrency, self.max_concurrency)
+        return limit
+
+    def acquire(self, host):
+        """Wait for the host's turn; returns the start time to hand back to release()"""
+        if not self.enabled:
+            return None
+        give_up = time.monotonic() + self.queue_timeout
+        with self._released:
+            limit = self._host(host)
+            limit.queued += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = limit.admit(now)
+                    if wait == 0:
+                        return now
+                    if now >= give_up:
+                        raise QueueTimeout(f"No turn for {host} within {self.queue_timeout:.0f}s")
+                    self._released.wait(min(wait, give_up - now) if wait is not None else give_up - now)
+            finally:
+                limit.queued -= 1
+
+    async def acquire_async(self, host):
+        """acquire() for coroutines, polling instead of blocking the event loop"""
+        if not self.enabled:
+            return None
+        give_up = time.monotonic() + self.queue_timeout
+        with self._lock:
+            self._host(host).queued += 1
+        try:
+            while True:
+                now = time.monotonic()
+                with self._lock:
+                    wait = self._host(host).admit(now)
+                if wait == 0:
+                    return now
+                if now >= give_up:
+                    raise QueueTimeout(f"No turn for {host} within {self.queue_timeout:.0f}s")
+                await asyncio.sleep(min(wait if wait is not None else 0.01, 0.05, give_up - now))
+        finally:
+            with self._lock:
+                self._host(host).queued -= 1
+
+    def observe(self, host, started, outcome, retry_after=None):
+        """Adapt the host's limits to the outcome of a request that took its turn at started
+
+        outcome is 'ok', 'throttled' or anything else for results that say
+        nothing about the host's capacity, such as 404s or refused connections.
+        """
+        if started is None:
+            return
+        with self._lock:
+            limit = self._host(host)
+            if outcome == 'ok':
+                limit.succeeded()
+            elif outcome == 'throttled':
+                limit.throttle(started, time.monotonic(), retry_after)
+
+    def release(self, host, started):
+        """Free the slot taken at started; call it on every exit path, whatever the outcome"""
+        if started is None:
+            return
+        with self._released:
+            self._host(host).in_flight -= 1
+            self._released.notify_all()
+
+    def stats(self):
+        """Current rate, concurrency limit and queue depth of every host"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                host: {
+                    'rate_per_sec': round(limit.rate, 2),
+                    'concurrency_limit': int(limit.concurrency),
+                    'in_flight': limit.in_flight,
+                    'queued': limit.queued,
+                    'paused_for_sec': round(max(0.0, limit.paused_until - now), 1),
+                    'throttled': limit.throttled,
+                    'decreases': limit.decreases,
+                }
+                for host, limit in self._hosts.items()
+            }
+
+
+def response_outcome(status, content=b''):
+    """Limiter outcome of a response: 'throttled', 'ok', or 'error' for other server errors"""
+    if status in THROTTLE_STATUSES or is_challenge(status, content):
+        return 'throttled'
+    return 'ok' if status < 500 else 'error'
+
+
+class FetcherStats:
+    """Per-host request counters and latency percentiles shared by both fetchers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._host_stats = {}
+        self.limiter = HostLimiter()
+
+    def _record(self, host, elapsed, status=None, error=False):
+        """Update the per-host request counters"""
+        with self._lock:
+            stats = self._host_stats.get(host)
+            if stats is None:
+                stats = self._host_stats[host] = {
+                    'requests': 0,
+                    'errors': 0,
+                    'statuses': {},
+                    'latencies': deque(maxlen=LATENCY_WINDOW),
+                }
+            stats['requests'] += 1
+            stats['latencies'].append(elapsed)
+            if error:
+                stats['errors'] += 1
+            if status is not None:
+                stats['statuses'][str(status)] = stats['statuses'].get(str(status), 0) + 1
+
+    def pool_stats(self):
+        return {}
+
+    def stats(self):
+        """Request and pool statistics for this process"""
+        with self._lock:
+            hosts = {}
+            for host, stats in self._host_stats.items():
+                latencies = list(stats['latencies'])
+                p50 = percentile(latencies, 0.5)
+                p95 = percentile(latencies, 0.95)
+                hosts[host] = {
+                    'requests': stats['requests'],
+                    'errors': stats['errors'],
+                    'statuses': dict(stats['statuses']),
+                    'p50_ms': round(p50 * 1000, 1) if p50 is not None else None,
+                    'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+                }
+        return {'hosts': hosts, 'pools': self.pool_stats(), 'limits': self.limiter.stats()}
+
+
+class Fetcher(FetcherStats):
+    """Process-wide HTTP client with pooled keep-alive connections and retries"""
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_retries=MAX_RETRIES, pool_hosts=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE):
+        super().__init__()
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+
+        # One session shared by every thread; its adapter keeps a separate
+        # connection pool for each host so connections are reused
+        self.adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    def get(self, url, **kwargs):
+        """GET a URL, retrying 429/5xx responses and connection errors"""
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlsplit(url).netloc
+
+        attempt = 0
+        while True:
+            turn = self.limiter.acquire(host)
+            started = time.perf_counter()
+            error = None
+            try:
+                try:
+                    response = self.session.get(url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    self._record(host, time.perf_counter() - started, error=True)
+                    self.limiter.observe(host, turn, 'throttled' if isinstance(e, requests.Timeout) else 'error')
+                    error = e
+                else:
+                    self._record(host, time.perf_counter() - started, status=response.status_code)
+                    # Only refusals are read here, so streamed bodies stay unread
+                    outcome = response_outcome(response.status_code,
+                                               response.content if response.status_code == 403 else b'')
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    self.limiter.observe(host, turn, outcome, retry_after)
+            finally:
+                # Any other exception, redirects and decoding included, must not keep the slot
+                self.limiter.release(host, turn)
+
+            if error is not None:
+                if attempt >= self.max_retries:
+                    raise error
+                print(f"Fetch error for {url}, retrying: {error}")
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            retry = response.status_code in RETRY_STATUSES or outcome == 'throttled'
+            if not retry or attempt >= self.max_retries:
+                return response
+
+            print(f"Fetch got {response.status_code} for {url}, retrying")
+            response.close()
+            time.sleep(backoff_delay(attempt, retry_after))
+            attempt += 1
+
+    def pool_stats(self):
+        """Connection pool usage for every pooled host"""
+        pools = {}
+        container = self.adapter.poolmanager.pools
+        for key in list(container.keys()):
+            pool = container.get(key)
+            if pool is None:
+                continue
+            # The pool queue is pre-filled with None placeholders; only real
+            # connections count as idle keep-alive sockets
+            queued = list(pool.pool.queue) if pool.pool else []
+            pools[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle_connections': sum(1 for conn in queued if conn is not None),
+                'max_size': pool.pool.maxsize if pool.pool else 0,
+            }
+        return pools
+
+
+class AsyncFetcher(FetcherStats):
+    """asyncio counterpart of Fetcher, with the same timeouts and retry policy
+
+    The aiohttp session is created on first use, inside the running event
+    loop of the process that uses it.
+    """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_retries=MAX_RETRIES, pool_hosts=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE):
+        super().__init__()
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.pool_hosts = pool_hosts
+        self.pool_maxsize = pool_maxsize
+        self.session = None
+
+    def _session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_hosts * self.pool_maxsize,
+                                             limit_per_host=self.pool_maxsize)
+            self.session = aiohttp.ClientSession(connector=connector, headers=DEFAULT_HEADERS, timeout=self.timeout)
+        return self.session
+
+    async def get(self, url, **kwargs):
+        """GET a URL, retrying 429/5xx responses and connection errors
+
+        Returns (response, body); the body is read before the connection
+        goes back to the pool.
+        """
+        host = urlsplit(url).netloc
+
+        attempt = 0
+        while True:
+            turn = await self.limiter.acquire_async(host)
+            started = time.perf_counter()
+            error = None
+            try:
+                try:
+                    async with self._session().get(url, **kwargs) as response:
+                        body = await response.read()
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    self._record(host, time.perf_counter() - started, error=True)
+                    self.limiter.observe(host, turn, 'throttled' if isinstance(e, asyncio.TimeoutError) else 'error')
+                    error = e
+                else:
+                    self._record(host, time.perf_counter() - started, status=response.status)
+                    outcome = response_outcome(response.status, body)
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    self.limiter.observe(host, turn, outcome, retry_after)
+            finally:
+                # Payload errors and cancellation by a hedge or deadline must not keep the slot
+                self.limiter.release(host, turn)
+
+            if error is not None:
+                if attempt >= self.max_retries:
+                    raise error
+                print(f"Fetch error for {url}, retrying: {error!r}")
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            retry = response.status in RETRY_STATUSES or outcome == 'throttled'
+            if not retry or attempt >= self.max_retries:
+                return response, body
+
+            print(f"Fetch got {response.status} for {url}, retrying")
+            await asyncio.sleep(backoff_delay(attempt, retry_after))
+            attempt += 1
+
+    def pool_stats(self):
+        """Connection limits of the aiohttp connector"""
+        if self.session is None or self.session.closed:
+            return {}
+        connector = self.session.connector
+        return {'limit': connector.limit, 'limit_per_host': connector.limit_per_host}
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+
+# Shared by the scraper and any other code that fetches Vinted pages
+shared_fetcher = Fetcher()
@@ -0,0 +1,362 @@
+"""
+Persistent history of analysed items, written in the background
+
+Every analysis is queued in memory and a writer thread stores the queue in
+batches, one transaction each, so requests never wait on the disk. A listing
+keeps one row per price, holding its latest analysis at that price. The
+table is indexed on brand, category and time, answers history queries and
+feeds model-backed analyses back into the comparables as sold-item rows.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from analysis_cache import normalize_text, parse_price
+from item_cache import ITEM_CACHE_DB
+
+# Shared store for the analysis history
+HISTORY_DB = os.getenv('HISTORY_DB', ITEM_CACHE_DB)
+
+# Seconds between writes of the queued analyses
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '1'))
+
+# Analyses stored per transaction; a full batch is written right away
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '500'))
+
+# Analyses waiting to be written; beyond this the oldest are dropped
+HISTORY_QUEUE_SIZE = int(os.getenv('HISTORY_QUEUE_SIZE', '10000'))
+
+# Feed stored analyses into the comparables, and how far back in days
+HISTORY_COMPARABLES = os.getenv('HISTORY_COMPARABLES', 'true').lower() in ('1', 'true', 'yes')
+HISTORY_COMPARABLES_MAX_AGE = float(os.getenv('HISTORY_COMPARABLES_MAX_AGE', '90'))
+
+# Analysis sources trusted as comparables; local model and fallback
+# estimates would only teach the comparables their own guesses
+HISTORY_COMPARABLE_SOURCES = tuple(
+    source.strip() for source in os.getenv('HISTORY_COMPARABLE_SOURCES', 'llm,llm_hedge,llm_packed').split(',') if source.strip()
+)
+
+# Seconds between checks for comparables stored by any worker
+HISTORY_REFRESH_INTERVAL = float(os.getenv('HISTORY_REFRESH_INTERVAL', '60'))
+
+# Most rows returned by one query
+QUERY_MAX_ROWS = 1000
+
+# Used when an analysis gives no readable time to sell
+DEFAULT_DAYS_TO_SELL = 14
+
+HISTORY_COLUMNS = ('item_id', 'url', 'title', 'brand', 'brand_key', 'category', 'category_key', 'condition',
+                   'size', 'price', 'scraped', 'source', 'resellable', 'resale_price', 'days_to_sell',
+                   'analysis', 'analyzed_at')
+
+# Columns rewritten when a listing is analysed again at the same price
+LISTING_UPDATE = ', '.join(f'{column} = excluded.{column}' for column in HISTORY_COLUMNS
+                           if column not in ('item_id', 'price'))
+
+
+def days_to_sell(time_to_sell):
+    """Middle of a '3-7 days' estimate, or None"""
+    days = [float(value) for value in re.findall(r'\d+(?:\.\d+)?', str(time_to_sell or ''))[:2]]
+    return sum(days) / len(days) if days else None
+
+
+def history_row(item_id, item_data, analysis, analyzed_at):
+    """Column values of one analysed item"""
+    return (
+        item_id,
+        item_data.get('url') or '',
+        item_data.get('title') or '',
+        item_data.get('brand') or '',
+        normalize_text(item_data.get('brand')),
+        item_data.get('category') or '',
+        normalize_text(item_data.get('category')),
+        item_data.get('condition') or '',
+        item_data.get('size') or '',
+        parse_price(item_data.get('price')),
+        0 if item_data.get('fallback') else 1,
+        analysis.get('source', 'unknown'),
+        analysis.get('resellable') or '',
+        parse_price(analysis.get('estimated_resale_price')),
+        days_to_sell(analysis.get('time_to_sell')),
+        json.dumps(analysis, default=str),
+        analyzed_at,
+    )
+
+
+def record_view(row):
+    """Public view of a stored analysis"""
+    record = dict(zip(('id',) + HISTORY_COLUMNS, row))
+    record['analysis'] = json.loads(record['analysis'])
+    record['scraped'] = bool(record['scraped'])
+    del record['brand_key'], record['category_key']
+    return record
+
+
+def sold_item(record):
+    """A stored analysis as a comparables row: its resale estimate stands in for the sold price"""
+    return {
+        'title': record['title'],
+        'brand': record['brand'],
+        'category': record['category'],
+        'original_price': record['price'],
+        'sold_price': round(record['resale_price'], 2),
+        'days_to_sell': round(record['days_to_sell'] if record['days_to_sell'] is not None else DEFAULT_DAYS_TO_SELL),
+        'condition': record['condition'],
+        'size': record['size'],
+        'analyzed_at': record['analyzed_at'],
+    }
+
+
+class AnalysisHistory:
+    """Analysed items stored in batches by a background writer, with indexed queries"""
+
+    def __init__(self, db_path=HISTORY_DB, flush_interval=HISTORY_FLUSH_INTERVAL, batch_size=HISTORY_BATCH_SIZE,
+                 queue_size=HISTORY_QUEUE_SIZE, refresh_interval=HISTORY_REFRESH_INTERVAL):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.refresh_interval = refresh_interval
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Wakes the writer early once a full batch is waiting
+        self._filled = threading.Condition(self._lock)
+        self._pending = deque(maxlen=queue_size)
+        self._pid = None
+        self._subscribers = []
+        self._counters = {
+            'recorded': 0,
+            'written': 0,
+            'batches': 0,
+            'dropped': 0,
+            'write_errors': 0,
+        }
+
+    def _connection(self):
+        """Per-thread SQLite connection, reopened after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS analysis_history ('
+            ' id INTEGER PRIMARY KEY,'
+            ' item_id TEXT,'
+            ' url TEXT NOT NULL,'
+            ' title TEXT NOT NULL,'
+            ' brand TEXT NOT NULL,'
+            ' brand_key TEXT NOT NULL,'
+            ' category TEXT NOT NULL,'
+            ' category_key TEXT NOT NULL,'
+            ' condition TEXT NOT NULL,'
+            ' size TEXT NOT NULL,'
+            ' price REAL,'
+            ' scraped INTEGER NOT NULL,'
+            ' source TEXT NOT NULL,'
+            ' resellable TEXT NOT NULL,'
+            ' resale_price REAL,'
+            ' days_to_sell REAL,'
+            ' analysis TEXT NOT NULL,'
+            ' analyzed_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS analysis_history_brand ON analysis_history (brand_key, analyzed_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS analysis_history_category'
+                     ' ON analysis_history (category_key, analyzed_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS analysis_history_time ON analysis_history (analyzed_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS analysis_history_item ON analysis_history (item_id, analyzed_at)')
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'analysis_history_listing'").fetchone():
+            # Histories written before listings were unique keep their latest row per price
+            conn.execute('DELETE FROM analysis_history WHERE item_id IS NOT NULL AND id NOT IN'
+                         ' (SELECT MAX(id) FROM analysis_history WHERE item_id IS NOT NULL GROUP BY item_id, price)')
+            conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS analysis_history_listing ON analysis_history (item_id, price)')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def start(self):
+        """Start this process's writer; analyses queued before a fork belong to the parent"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._pending.clear()
+            self._flush_lock = threading.Lock()
+        threading.Thread(target=self._run_writer, name='history-writer', daemon=True).start()
+
+    def record(self, item_id, item_data, analysis):
+        """Queue an analysed item, by its Vinted ID if known, for the next batch; never waits on the disk"""
+        if not item_data or not isinstance(analysis, dict):
+            return
+        self.start()
+        with self._filled:
+            if len(self._pending) == self._pending.maxlen:
+                self._counters['dropped'] += 1
+            self._pending.append((item_id, dict(item_data), dict(analysis), time.time()))
+            self._counters['recorded'] += 1
+            if len(self._pending) >= self.batch_size:
+                self._filled.notify()
+
+    def flush(self):
+        """Write every queued analysis, batch_size rows per transaction"""
+        if self._pid != os.getpid():
+            return
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                if not batch:
+                    return
+                try:
+                    conn = self._connection()
+                    conn.execute('BEGIN IMMEDIATE')
+                    try:
+                        # A listing analysed again at the same price replaces its row
+                        conn.executemany(
+                            f"INSERT INTO analysis_history ({', '.join(HISTORY_COLUMNS)})"
+                            f" VALUES ({', '.join('?' * len(HISTORY_COLUMNS))})"
+                            f" ON CONFLICT (item_id, price) DO UPDATE SET {LISTING_UPDATE}",
+                            [history_row(*entry) for entry in batch]
+                        )
+                        conn.execute('COMMIT')
+                    except BaseException:
+                        conn.execute('ROLLBACK')
+                        raise
+                except sqlite3.Error as e:
+                    print(f"History write error: {e}")
+                    # Keep the batch for the next flush, unless newer analyses filled the queue
+                    with self._lock:
+                        self._counters['write_errors'] += 1
+                        room = self._pending.maxlen - len(self._pending)
+                        self._pending.extendleft(reversed(batch[len(batch) - room:] if room < len(batch) else batch))
+                        self._counters['dropped'] += max(0, len(batch) - room)
+                    return
+                with self._lock:
+                    self._counters['written'] += len(batch)
+                    self._counters['batches'] += 1
+
+    def subscribe(self, callback):
+        """Call callback(sold items) from the writer with the comparables every worker stores
+
+        The first call delivers the last HISTORY_COMPARABLES_MAX_AGE days,
+        later ones what was stored since, every refresh_interval seconds.
+        Subscribing starts no thread, so it is safe before a fork; calls
+        begin once start() runs the writer in the serving process.
+        """
+        with self._lock:
+            self._subscribers.append({'callback': callback, 'after_id': 0, 'delivered': set(), 'due': 0.0})
+
+    def _feed_subscribers(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [subscriber for subscriber in self._subscribers if subscriber['due'] <= now]
+        for subscriber in due:
+            subscriber['due'] = now + self.refresh_interval
+            try:
+                rows, subscriber['after_id'] = self.new_comparables(subscriber['after_id'], subscriber['delivered'])
+                if rows:
+                    subscriber['callback'](rows)
+            except Exception as e:
+                print(f"Error refreshing comparables from history: {e}")
+
+    def _run_writer(self):
+        while True:
+            with self._filled:
+                if len(self._pending) < self.batch_size:
+                    self._filled.wait(self.flush_interval)
+            self.flush()
+            if self._subscribers:
+                self._feed_subscribers()
+
+    def query(self, brand=None, category=None, since=None, until=None, sources=None, limit=100):
+        """Stored analyses, newest first, by exact brand and category and a time window in epoch seconds"""
+        clauses = []
+        params = []
+        if brand:
+            clauses.append('brand_key = ?')
+            params.append(normalize_text(brand))
+        if category:
+            clauses.append('category_key = ?')
+            params.append(normalize_text(category))
+        if since is not None:
+            clauses.append('analyzed_at >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('analyzed_at < ?')
+            params.append(until)
+        if sources:
+            clauses.append(f"source IN ({', '.join('?' * len(sources))})")
+            params.extend(sources)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._connection().execute(
+            f"SELECT id, {', '.join(HISTORY_COLUMNS)} FROM analysis_history{where}"
+            ' ORDER BY analyzed_at DESC LIMIT ?',
+            params + [min(int(limit), QUERY_MAX_ROWS)]
+        ).fetchall()
+        return [record_view(row) for row in rows]
+
+    def comparables(self, brand=None, category=None, since=None, until=None, limit=100):
+        """Sold-item rows of the latest trusted analysis of each scraped item matching the query"""
+        records = self.query(brand, category, since, until, HISTORY_COMPARABLE_SOURCES, QUERY_MAX_ROWS)
+        items = []
+        seen = set()
+        for record in records:
+            if not self._usable(record) or record['item_id'] in seen:
+                continue
+            seen.add(record['item_id'])
+            items.append(sold_item(record))
+            if len(items) >= limit:
+                break
+        return items
+
+    @staticmethod
+    def _usable(record):
+        return (record['scraped'] and record['item_id'] and record['price'] and record['price'] > 0
+                and record['resale_price'] is not None)
+
+    def new_comparables(self, after_id, delivered):
+        """(sold items, last row ID) for trusted analyses stored after row after_id
+
+        (item ID, price) pairs in delivered were delivered before and are
+        skipped; the new ones are added to it. An item relisted at another
+        price is delivered again, as a comparable at its new price.
+        """
+        if not HISTORY_COMPARABLE_SOURCES:
+            return [], after_id
+        since = time.time() - HISTORY_COMPARABLES_MAX_AGE * 86400
+        rows = self._connection().execute(
+            f"SELECT id, {', '.join(HISTORY_COLUMNS)} FROM analysis_history"
+            f" WHERE id > ? AND analyzed_at >= ? AND source IN ({', '.join('?' * len(HISTORY_COMPARABLE_SOURCES))})"
+            ' ORDER BY id DESC',
+            [after_id, since, *HISTORY_COMPARABLE_SOURCES]
+        ).fetchall()
+        items = []
+        # Newest first, so an item analysed twice at one price contributes its latest estimate
+        for row in rows:
+            record = record_view(row)
+            key = (record['item_id'], record['price'])
+            if self._usable(record) and key not in delivered:
+                delivered.add(key)
+                items.append(sold_item(record))
+        last_id = rows[0][0] if rows else after_id
+        return items, last_id
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['queued'] = len(self._pending)
+        return stats
+
+
+analysis_history = AnalysisHistory()
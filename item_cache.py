@@ -0,0 +1,228 @@
+"""
+Two-tier cache of scraped Vinted items, keyed by numeric item ID
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# On-disk tier shared by every worker process on the machine
+ITEM_CACHE_DB = os.getenv('ITEM_CACHE_DB', 'vintelli_cache.db')
+ITEM_CACHE_TTL = float(os.getenv('ITEM_CACHE_TTL', '3600'))
+ITEM_CACHE_MAX_ENTRIES = int(os.getenv('ITEM_CACHE_MAX_ENTRIES', '2048'))
+
+# Expired rows are purged from disk after this many writes
+PURGE_EVERY = 500
+
+# How often each worker checks for invalidations made by other workers
+INVALIDATION_POLL_INTERVAL = 1.0
+
+# Invalidation log marker for clear()
+CLEAR_ALL = '*'
+
+
+class ItemCache:
+    """Bounded in-process LRU in front of a shared SQLite table"""
+
+    def __init__(self, db_path=ITEM_CACHE_DB, ttl=ITEM_CACHE_TTL, max_entries=ITEM_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self._invalidation_seq = None
+        self._next_invalidation_poll = 0.0
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'invalidations': 0,
+            'disk_errors': 0,
+        }
+
+    def _connection(self):
+        """Per-thread SQLite connection, reopened after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS item_cache ('
+            ' item_id TEXT PRIMARY KEY,'
+            ' data TEXT NOT NULL,'
+            ' expires_at REAL NOT NULL)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS item_cache_invalidations ('
+            ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' item_id TEXT NOT NULL,'
+            ' invalidated_at REAL NOT NULL)'
+        )
+        conn.commit()
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _remember(self, item_id, expires_at, data):
+        """Insert into the LRU tier, evicting the least recently used entry"""
+        with self._lock:
+            self._memory[item_id] = (expires_at, data)
+            self._memory.move_to_end(item_id)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _sync_invalidations(self, now):
+        """Drop LRU entries that another worker has invalidated"""
+        with self._lock:
+            if now < self._next_invalidation_poll:
+                return
+            self._next_invalidation_poll = now + INVALIDATION_POLL_INTERVAL
+            last_seq = self._invalidation_seq
+
+        try:
+            conn = self._connection()
+            if last_seq is None:
+                row = conn.execute('SELECT MAX(seq) FROM item_cache_invalidations').fetchone()
+                rows = []
+                last_seq = row[0] or 0
+            else:
+                rows = conn.execute(
+                    'SELECT seq, item_id FROM item_cache_invalidations WHERE seq > ? ORDER BY seq',
+                    (last_seq,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Item cache invalidation poll error: {e}")
+            self._count('disk_errors')
+            return
+
+        with self._lock:
+            for seq, invalidated_id in rows:
+                if invalidated_id == CLEAR_ALL:
+                    self._memory.clear()
+                else:
+                    self._memory.pop(invalidated_id, None)
+                last_seq = seq
+            self._invalidation_seq = last_seq
+
+    def get(self, item_id):
+        """Return the cached item dict, or None on a miss"""
+        item_id = str(item_id)
+        now = time.time()
+        self._sync_invalidations(now)
+
+        with self._lock:
+            entry = self._memory.get(item_id)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(item_id)
+                    self._counters['memory_hits'] += 1
+                    return dict(entry[1])
+                del self._memory[item_id]
+
+        try:
+            row = self._connection().execute(
+                'SELECT data, expires_at FROM item_cache WHERE item_id = ? AND expires_at > ?',
+                (item_id, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Item cache read error: {e}")
+            self._count('disk_errors')
+            row = None
+
+        if row is None:
+            self._count('misses')
+            return None
+
+        data = json.loads(row[0])
+        self._remember(item_id, row[1], data)
+        self._count('disk_hits')
+        return dict(data)
+
+    def set(self, item_id, data, ttl=None):
+        """Store an item dict in both tiers"""
+        item_id = str(item_id)
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._remember(item_id, expires_at, dict(data))
+        self._count('stores')
+
+        try:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO item_cache (item_id, data, expires_at) VALUES (?, ?, ?)',
+                (item_id, json.dumps(data), expires_at)
+            )
+            with self._lock:
+                self._writes += 1
+                purge = self._writes % PURGE_EVERY == 0
+            if purge:
+                conn.execute('DELETE FROM item_cache WHERE expires_at <= ?', (time.time(),))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Item cache write error: {e}")
+            self._count('disk_errors')
+
+    def invalidate(self, item_id):
+        """Drop one item from both tiers"""
+        item_id = str(item_id)
+        with self._lock:
+            self._memory.pop(item_id, None)
+            self._counters['invalidations'] += 1
+
+        # Other workers drop their LRU copy when they next poll the log
+        try:
+            conn = self._connection()
+            conn.execute('DELETE FROM item_cache WHERE item_id = ?', (item_id,))
+            conn.execute(
+                'INSERT INTO item_cache_invalidations (item_id, invalidated_at) VALUES (?, ?)',
+                (item_id, time.time())
+            )
+            conn.execute(
+                'DELETE FROM item_cache_invalidations WHERE invalidated_at < ?',
+                (time.time() - self.ttl,)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Item cache delete error: {e}")
+            self._count('disk_errors')
+
+    def clear(self):
+        """Drop every cached item"""
+        with self._lock:
+            self._memory.clear()
+        try:
+            conn = self._connection()
+            conn.execute('DELETE FROM item_cache')
+            conn.execute(
+                'INSERT INTO item_cache_invalidations (item_id, invalidated_at) VALUES (?, ?)',
+                (CLEAR_ALL, time.time())
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Item cache clear error: {e}")
+            self._count('disk_errors')
+
+    def stats(self):
+        """Hit/miss counters and tier sizes"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 3) if lookups else None
+        return stats
+
+
+item_cache = ItemCache()
@@ -0,0 +1,364 @@
+"""
+Persistent background job queue backed by SQLite, with a pool of worker threads
+
+Jobs are rows in a table shared by every process on the machine. A worker
+claims the highest-priority job that is due by taking a lease on it for
+the visibility timeout; a job whose lease runs out (its worker crashed or
+hung) becomes claimable again. Failed jobs are retried with exponential
+backoff until they run out of attempts.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from item_cache import ITEM_CACHE_DB
+
+# Shared store for queued jobs and their results
+JOBS_DB = os.getenv('JOBS_DB', ITEM_CACHE_DB)
+
+# Worker threads per process; 0 leaves processing to other processes
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+
+# Seconds a claimed job stays invisible to other workers
+JOB_VISIBILITY_TIMEOUT = float(os.getenv('JOB_VISIBILITY_TIMEOUT', '120'))
+
+# Attempts before a job is marked failed
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+
+# First retry delay in seconds, doubled on every further attempt
+JOB_RETRY_BACKOFF = float(os.getenv('JOB_RETRY_BACKOFF', '5'))
+
+# Seconds finished jobs and their results are kept
+JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', '86400'))
+
+# How often idle workers and waiting clients check the table
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '0.5'))
+
+# Finished jobs are purged after this many completions
+PURGE_EVERY = 200
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED = (DONE, FAILED)
+
+JOB_COLUMNS = ('id', 'kind', 'payload', 'priority', 'status', 'attempts', 'max_attempts',
+               'result', 'error', 'created_at', 'updated_at')
+
+
+class JobQueue:
+    """Priority queue of jobs with leases, retries and stored results"""
+
+    def __init__(self, db_path=JOBS_DB, visibility_timeout=JOB_VISIBILITY_TIMEOUT,
+                 max_attempts=JOB_MAX_ATTEMPTS, retry_backoff=JOB_RETRY_BACKOFF,
+                 result_ttl=JOB_RESULT_TTL, poll_interval=JOB_POLL_INTERVAL):
+        self.db_path = db_path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Wakes idle workers and waiting clients in this process early
+        self._changed = threading.Condition(self._lock)
+        self._finished = 0
+        self._counters = {
+            'submitted': 0,
+            'claimed': 0,
+            'completed': 0,
+            'retried': 0,
+            'failed': 0,
+            'expired_leases': 0,
+        }
+
+    def _connection(self):
+        """Per-thread SQLite connection, reopened after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' id TEXT PRIMARY KEY,'
+            ' kind TEXT NOT NULL,'
+            ' payload TEXT NOT NULL,'
+            ' priority INTEGER NOT NULL,'
+            ' status TEXT NOT NULL,'
+            ' attempts INTEGER NOT NULL,'
+            ' max_attempts INTEGER NOT NULL,'
+            ' available_at REAL NOT NULL,'
+            ' lease_owner TEXT,'
+            ' lease_expires REAL,'
+            ' result TEXT,'
+            ' error TEXT,'
+            ' created_at REAL NOT NULL,'
+            ' updated_at REAL NOT NULL)'
+        )
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS jobs_due'
+            ' ON jobs (status, priority DESC, available_at)'
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def submit(self, kind, payload, priority=0, max_attempts=None):
+        """Queue a job and return its ID; higher priorities are claimed first"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._connection().execute(
+            'INSERT INTO jobs (id, kind, payload, priority, status, attempts, max_attempts,'
+            ' available_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?)',
+            (job_id, kind, json.dumps(payload), int(priority), QUEUED,
+             max_attempts or self.max_attempts, now, now, now)
+        )
+        self._count('submitted')
+        self._notify()
+        return job_id
+
+    def _expire_leases(self, conn, now):
+        """Requeue jobs whose worker let the lease run out, failing those out of attempts"""
+        expired = conn.execute(
+            'UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN ? ELSE ? END,'
+            ' error = CASE WHEN attempts >= max_attempts THEN ? ELSE error END,'
+            ' lease_owner = NULL, lease_expires = NULL, available_at = ?, updated_at = ?'
+            ' WHERE status = ? AND lease_expires <= ?',
+            (FAILED, QUEUED, 'Visibility timeout expired', now, now, RUNNING, now)
+        ).rowcount
+        if expired:
+            with self._lock:
+                self._counters['expired_leases'] += expired
+
+    def claim(self, owner):
+        """Lease the most urgent due job to owner; returns (job_id, kind, payload, attempt) or None"""
+        now = time.time()
+        conn = self._connection()
+        # BEGIN IMMEDIATE serializes claims across processes
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._expire_leases(conn, now)
+            row = conn.execute(
+                'UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?,'
+                ' lease_expires = ?, updated_at = ?'
+                ' WHERE id = (SELECT id FROM jobs WHERE status = ? AND available_at <= ?'
+                '  ORDER BY priority DESC, available_at LIMIT 1)'
+                ' RETURNING id, kind, payload, attempts',
+                (RUNNING, owner, now + self.visibility_timeout, now, QUEUED, now)
+            ).fetchone()
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        self._count('claimed')
+        return row[0], row[1], json.loads(row[2]), row[3]
+
+    def complete(self, job_id, owner, result):
+        """Store a job's result; ignored when owner no longer holds the lease"""
+        now = time.time()
+        conn = self._connection()
+        updated = conn.execute(
+            'UPDATE jobs SET status = ?, result = ?, error = NULL, lease_owner = NULL,'
+            ' lease_expires = NULL, updated_at = ? WHERE id = ? AND lease_owner = ?',
+            (DONE, json.dumps(result), now, job_id, owner)
+        ).rowcount
+        if updated:
+            self._count('completed')
+            self._finish(conn, now)
+        return bool(updated)
+
+    def fail(self, job_id, owner, error):
+        """Retry a failed attempt after a backoff, or mark the job failed once out of attempts"""
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            'SELECT attempts, max_attempts FROM jobs WHERE id = ? AND lease_owner = ?',
+            (job_id, owner)
+        ).fetchone()
+        if row is None:
+            return False
+
+        attempts, max_attempts = row
+        if attempts < max_attempts:
+            delay = self.retry_backoff * 2 ** (attempts - 1)
+            conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, lease_expires = NULL,'
+                ' available_at = ?, updated_at = ? WHERE id = ? AND lease_owner = ?',
+                (QUEUED, str(error), now + delay, now, job_id, owner)
+            )
+            self._count('retried')
+        else:
+            conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, lease_expires = NULL,'
+                ' updated_at = ? WHERE id = ? AND lease_owner = ?',
+                (FAILED, str(error), now, job_id, owner)
+            )
+            self._count('failed')
+            self._finish(conn, now)
+        return True
+
+    def _finish(self, conn, now):
+        """Wake waiting clients and now and then purge old finished jobs"""
+        with self._lock:
+            self._finished += 1
+            purge = self._finished % PURGE_EVERY == 0
+        if purge:
+            conn.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND updated_at <= ?',
+                (DONE, FAILED, now - self.result_ttl)
+            )
+        self._notify()
+
+    def get(self, job_id):
+        """The job as a dict, or None if it does not exist"""
+        row = self._connection().execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_COLUMNS, row))
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def wait(self, job_id, timeout):
+        """get(job_id), waiting up to timeout seconds for the job to finish"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in FINISHED or remaining <= 0:
+                return job
+            # Jobs finished by another process are only seen on the next poll
+            with self._changed:
+                self._changed.wait(min(self.poll_interval, remaining))
+
+    async def wait_async(self, job_id, timeout):
+        """wait() for the event loop; table reads run off the loop"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await asyncio.to_thread(self.get, job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in FINISHED or remaining <= 0:
+                return job
+            await asyncio.sleep(min(self.poll_interval, remaining))
+
+    def wait_for_work(self, timeout):
+        """Sleep until a job is submitted in this process or timeout passes"""
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        try:
+            stats['jobs'] = dict(self._connection().execute(
+                'SELECT status, COUNT(*) FROM jobs GROUP BY status'
+            ).fetchall())
+        except sqlite3.Error as e:
+            print(f"Job queue stats error: {e}")
+        return stats
+
+
+class WorkerPool:
+    """Threads that claim jobs from a queue and run the handler for their kind"""
+
+    def __init__(self, job_queue, handlers, workers=JOB_WORKERS):
+        self.job_queue = job_queue
+        self.handlers = handlers
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._busy = 0
+
+    def start(self):
+        """Start the worker threads once per process; safe to call on every request"""
+        if self._pid == os.getpid() or self.workers <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for index in range(self.workers):
+                threading.Thread(target=self._run, name=f'job-worker-{index}', daemon=True).start()
+        print(f"Started {self.workers} job workers")
+
+    def _run(self):
+        owner = f"{os.getpid()}:{threading.current_thread().name}:{uuid.uuid4().hex[:8]}"
+        while True:
+            try:
+                claimed = self.job_queue.claim(owner)
+            except sqlite3.Error as e:
+                print(f"Job claim error: {e}")
+                claimed = None
+            if claimed is None:
+                self.job_queue.wait_for_work(self.job_queue.poll_interval)
+                continue
+
+            job_id, kind, payload, attempt = claimed
+            with self._lock:
+                self._busy += 1
+            try:
+                handler = self.handlers.get(kind)
+                if handler is None:
+                    raise ValueError(f"No handler for job kind {kind!r}")
+                result = handler(payload)
+            except Exception as e:
+                print(f"Job {job_id} attempt {attempt} failed: {e}")
+                self._settle(self.job_queue.fail, job_id, owner, e)
+            else:
+                self._settle(self.job_queue.complete, job_id, owner, result)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+    def _settle(self, settle, job_id, owner, outcome):
+        try:
+            if not settle(job_id, owner, outcome):
+                print(f"Job {job_id} lease was lost before it finished")
+        except sqlite3.Error as e:
+            print(f"Job store error: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers if self._pid == os.getpid() else 0,
+                'busy': self._busy,
+            }
+
+
+def main():
+    """Run the app's job workers in the foreground, without serving HTTP"""
+    from app import job_workers
+
+    if job_workers.workers <= 0:
+        print('JOB_WORKERS is 0, nothing to run')
+        return
+    job_workers.start()
+    while True:
+        time.sleep(3600)
+
+
+if __name__ == '__main__':
+    main()
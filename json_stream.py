@@ -0,0 +1,154 @@
+"""
+Incremental parsing of the JSON object in a model reply as it streams in
+
+The parser follows string, escape and nesting state one character at a
+time, so each top-level member of the first JSON object is available as
+soon as its value is complete, before the object itself is closed.
+"""
+
+import json
+
+
+class JSONObjectStream:
+    """Top-level fields of the first JSON object in a stream of text chunks"""
+
+    def __init__(self, required=()):
+        self.required = tuple(required)
+        self.fields = {}
+        self.text = ''
+        self.closed = False
+
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._in_value = False
+        self._member_start = None
+        self._member_done = False
+
+    def feed(self, chunk):
+        """Add text; returns the names of the fields it completed"""
+        self.text += chunk
+        completed = []
+        text = self.text
+        while self._pos < len(text) and not self.closed:
+            i = self._pos
+            c = text[i]
+            self._pos += 1
+
+            if self._depth == 0:
+                # Anything before the object, such as prose, is skipped
+                if c == '{':
+                    self._depth = 1
+                    self._member_start = i + 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._in_value:
+                        self._complete_member(i + 1, completed)
+            elif c == '"':
+                self._in_string = True
+            elif c in '{[':
+                self._depth += 1
+            elif c in '}]':
+                self._depth -= 1
+                if self._depth == 1 and self._in_value:
+                    self._complete_member(i + 1, completed)
+                elif self._depth == 0:
+                    # Numbers and literals only end at the closing brace
+                    self._complete_member(i, completed)
+                    self.closed = True
+            elif self._depth == 1:
+                if c == ':':
+                    self._in_value = True
+                elif c == ',':
+                    self._complete_member(i, completed)
+                    self._member_start = i + 1
+                    self._in_value = False
+                    self._member_done = False
+        return completed
+
+    def _complete_member(self, end, completed):
+        """Parse the member ending at end once; malformed members are skipped"""
+        if self._member_done:
+            return
+        member = self.text[self._member_start:end].strip()
+        if not member:
+            return
+        try:
+            parsed = json.loads('{' + member + '}')
+        except ValueError:
+            return
+        self._member_done = True
+        for key, value in parsed.items():
+            self.fields[key] = value
+            completed.append(key)
+
+    def complete(self):
+        """Whether every required field has been read, or the object has ended"""
+        return self.closed or all(field in self.fields for field in self.required)
+
+
+def extract_json_object(text):
+    """First JSON object in text, or the fields read before it was cut off; None if there are none"""
+    decoder = json.JSONDecoder()
+    start = text.find('{')
+    while start != -1:
+        try:
+            value, _ = decoder.raw_decode(text, start)
+        except ValueError:
+            pass
+        else:
+            if isinstance(value, dict):
+                return value
+        start = text.find('{', start + 1)
+
+    # A reply stopped early, or truncated by max_tokens, keeps its complete fields
+    stream = JSONObjectStream()
+    stream.feed(text)
+    return stream.fields or None
+
+
+def extract_json_array(text):
+    """First JSON array in text, or the first list value of a JSON object
+
+    A truncated array yields the elements completed before it was cut
+    off; None if there is no array at all.
+    """
+    decoder = json.JSONDecoder()
+    first = start = text.find('[')
+    while start != -1:
+        try:
+            value, _ = decoder.raw_decode(text, start)
+        except ValueError:
+            pass
+        else:
+            if isinstance(value, list):
+                return value
+        start = text.find('[', start + 1)
+
+    # Some replies wrap the array, as in {"analyses": [...]}
+    value = extract_json_object(text)
+    if isinstance(value, dict):
+        for member in value.values():
+            if isinstance(member, list):
+                return member
+
+    if first == -1:
+        return None
+    elements = []
+    position = first + 1
+    while True:
+        while position < len(text) and text[position] in ' \t\r\n,':
+            position += 1
+        try:
+            value, position = decoder.raw_decode(text, position)
+        except ValueError:
+            return elements
+        elements.append(value)
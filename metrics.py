@@ -0,0 +1,259 @@
+"""
+Prometheus metrics shared by every worker process
+
+Each process counts into memory and a background thread adds what it
+counted since the last flush to one SQLite table, so the totals cover all
+gunicorn workers, survive worker restarts and never go backwards. /metrics
+flushes the serving process first and renders the table in the Prometheus
+text format; the other workers' latest METRICS_FLUSH_INTERVAL seconds are
+not in it yet.
+"""
+
+import atexit
+import bisect
+import os
+import sqlite3
+import threading
+import time
+
+from item_cache import ITEM_CACHE_DB
+
+# Shared store the workers add their counts to
+METRICS_DB = os.getenv('METRICS_DB', ITEM_CACHE_DB)
+
+# Seconds between flushes of each process's counts
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+
+# Histogram bucket upper bounds in seconds, from cache lookups to model calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# name -> (type, help) of every metric family
+FAMILIES = {
+    'vintelli_http_requests_total': ('counter', 'HTTP requests by route, method and status'),
+    'vintelli_http_request_seconds': ('histogram', 'Time to answer HTTP requests, until the headers for streams'),
+    'vintelli_stage_seconds': ('histogram', 'Time spent in each stage of an analysis'),
+    'vintelli_item_cache_lookups_total': ('counter', 'Item cache lookups by result'),
+    'vintelli_scrapes_total': ('counter', 'Item lookups that missed the cache, by outcome'),
+    'vintelli_analyses_total': ('counter', 'Analyses served by source and fallback reason'),
+    'vintelli_openai_requests_total': ('counter', 'OpenAI analysis calls by kind and outcome'),
+    'vintelli_openai_request_seconds': ('histogram', 'Duration of OpenAI analysis calls by kind and outcome'),
+    'vintelli_openai_tokens_total': ('counter', 'OpenAI tokens by direction'),
+    'vintelli_watch_polls_total': ('counter', 'Catalog watcher search polls by outcome'),
+    'vintelli_watch_listings_total': ('counter', 'Listings found by the catalog watcher, by outcome'),
+}
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def label_text(labels):
+    """Labels rendered the Prometheus way, sorted by name"""
+    return ','.join(f'{name}="{escape_label(value)}"' for name, value in sorted(labels.items()))
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Timer:
+    """Context manager observing its elapsed seconds into a histogram"""
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """Counters and histograms of this process, flushed into the shared table"""
+
+    def __init__(self, db_path=METRICS_DB, flush_interval=METRICS_FLUSH_INTERVAL, buckets=LATENCY_BUCKETS):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pid = None
+        # Counts since the last flush: (name, labels) -> value, or
+        # [per-bucket counts..., +Inf count, sum] for histograms
+        self._counters = {}
+        self._histograms = {}
+        self._conn = None
+
+    def _ensure_process(self):
+        """Start this process's flusher; counts inherited through a fork belong to the parent"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._counters = {}
+            self._histograms = {}
+            self._conn = None
+            self._flush_lock = threading.Lock()
+        threading.Thread(target=self._run_flusher, name='metrics-flush', daemon=True).start()
+
+    def inc(self, name, amount=1, **labels):
+        """Add amount to a counter"""
+        self._ensure_process()
+        key = (name, label_text(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Record one value in a histogram"""
+        self._ensure_process()
+        key = (name, label_text(labels))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._histograms.get(key)
+            if counts is None:
+                counts = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def timer(self, name, **labels):
+        """with metrics.timer(name, ...): observes the block's duration"""
+        return Timer(self, name, labels)
+
+    def _connection(self):
+        """The flushing connection; only used under the flush lock"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS metric_samples ('
+                ' name TEXT NOT NULL,'
+                ' labels TEXT NOT NULL,'
+                ' suffix TEXT NOT NULL,'
+                ' le TEXT NOT NULL,'
+                ' value REAL NOT NULL,'
+                ' PRIMARY KEY (name, labels, suffix, le))'
+            )
+            self._conn = conn
+        return self._conn
+
+    def _samples(self, counters, histograms):
+        """(name, labels, suffix, le, delta) rows for a set of counts"""
+        rows = [(name, labels, '', '', value) for (name, labels), value in counters.items()]
+        for (name, labels), counts in histograms.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                rows.append((name, labels, '_bucket', format_value(bound), cumulative))
+            rows.append((name, labels, '_count', '', cumulative))
+            rows.append((name, labels, '_sum', '', counts[-1]))
+        return rows
+
+    def flush(self):
+        """Add this process's counts since the last flush to the shared table"""
+        if self._pid != os.getpid():
+            return
+        with self._flush_lock:
+            with self._lock:
+                counters, self._counters = self._counters, {}
+                histograms, self._histograms = self._histograms, {}
+            if not counters and not histograms:
+                return
+            try:
+                conn = self._connection()
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    conn.executemany(
+                        'INSERT INTO metric_samples (name, labels, suffix, le, value) VALUES (?, ?, ?, ?, ?)'
+                        ' ON CONFLICT (name, labels, suffix, le) DO UPDATE SET value = value + excluded.value',
+                        self._samples(counters, histograms)
+                    )
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+            except sqlite3.Error as e:
+                print(f"Metrics flush error: {e}")
+                # Keep the counts for the next flush
+                with self._lock:
+                    for key, value in counters.items():
+                        self._counters[key] = self._counters.get(key, 0) + value
+                    for key, counts in histograms.items():
+                        merged = self._histograms.setdefault(key, [0] * len(counts))
+                        for index, count in enumerate(counts):
+                            merged[index] += count
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def render(self):
+        """Every worker's metrics in the Prometheus text format"""
+        self._ensure_process()
+        self.flush()
+        with self._flush_lock:
+            rows = self._connection().execute(
+                'SELECT name, labels, suffix, le, value FROM metric_samples'
+            ).fetchall()
+
+        families = {}
+        for name, labels, suffix, le, value in rows:
+            families.setdefault(name, []).append((labels, suffix, le, value))
+
+        suffix_order = {'_bucket': 0, '_count': 1, '_sum': 2, '': 3}
+        lines = []
+        for name in sorted(families):
+            kind, help_text = FAMILIES.get(name, ('untyped', name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            samples = sorted(families[name], key=lambda sample: (
+                sample[0], suffix_order[sample[1]], float(sample[2]) if sample[2] else 0.0
+            ))
+            for labels, suffix, le, value in samples:
+                if le:
+                    labels = ','.join(filter(None, (labels, f'le="{le}"')))
+                lines.append(f"{name}{suffix}{{{labels}}} {format_value(value)}" if labels
+                             else f"{name}{suffix} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+# Counts from the last moments of a worker that exits cleanly are kept too
+atexit.register(metrics.flush)
+
+
+def stage_timer(stage):
+    """with stage_timer('fetch'): times one stage of an analysis"""
+    return metrics.timer('vintelli_stage_seconds', stage=stage)
+
+
+def record_analysis(analysis):
+    """Count an analysis served, by where it came from"""
+    if isinstance(analysis, dict):
+        metrics.inc('vintelli_analyses_total', source=analysis.get('source', 'unknown'),
+                    fallback_reason=analysis.get('fallback_reason', ''))
+
+
+def record_llm_call(kind, outcome, started, input_tokens=0, output_tokens=0):
+    """Count one OpenAI call started at perf_counter() value started, and its tokens"""
+    metrics.inc('vintelli_openai_requests_total', kind=kind, outcome=outcome)
+    metrics.observe('vintelli_openai_request_seconds', time.perf_counter() - started, kind=kind, outcome=outcome)
+    if input_tokens:
+        metrics.inc('vintelli_openai_tokens_total', input_tokens, direction='input')
+    if output_tokens:
+        metrics.inc('vintelli_openai_tokens_total', output_tokens, direction='output')
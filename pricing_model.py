@@ -0,0 +1,286 @@
+"""
+Local statistical pricing model fitted on the sold-item data
+
+A ridge regression on log prices predicts an item's resale price and its
+days to sell from brand, category, condition and listing price, with a
+prediction interval from the residual spread. The router uses it to answer
+well-covered items locally and send uncertain or high-value ones to the LLM.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from analysis_cache import normalize_text, parse_price
+from scoring import condition_grade, encode
+
+# Answer confident predictions locally instead of calling the model
+PRICING_ROUTER = os.getenv('PRICING_ROUTER', 'true').lower() in ('1', 'true', 'yes')
+
+# Sold items of the same brand needed before a local answer is trusted
+PRICING_MIN_SUPPORT = int(os.getenv('PRICING_MIN_SUPPORT', '30'))
+
+# Widest price interval, relative to the predicted price, still answered locally
+PRICING_MAX_INTERVAL = float(os.getenv('PRICING_MAX_INTERVAL', '0.6'))
+
+# Items listed at or above this many euros always get the LLM's analysis
+PRICING_HIGH_VALUE = float(os.getenv('PRICING_HIGH_VALUE', '150'))
+
+# z-score of the two-sided 80% prediction interval
+INTERVAL_Z = 1.2816
+
+# Brands and categories need this many sold items to get their own coefficient
+MIN_LEVEL_ROWS = 5
+
+# One-hot levels kept per column, most frequent first
+MAX_LEVELS = 500
+
+# Ridge penalty on every coefficient but the intercept
+RIDGE_PENALTY = 1.0
+
+# Rows turned into a design matrix at once while fitting
+FIT_CHUNK_ROWS = 65536
+
+
+def levels(codes, vocabulary):
+    """Map of lowercased value -> one-hot column for values frequent enough to get one"""
+    counts = np.bincount(codes, minlength=len(vocabulary))
+    frequent = [code for code in np.argsort(-counts, kind='stable')[:MAX_LEVELS] if counts[code] >= MIN_LEVEL_ROWS]
+    columns = {}
+    for code in frequent:
+        columns.setdefault(normalize_text(vocabulary[code]), len(columns))
+    return columns
+
+
+def code_columns(vocabulary, columns):
+    """One-hot column of each vocabulary code, -1 for pooled values"""
+    return np.array([columns.get(normalize_text(value), -1) for value in vocabulary], dtype=np.int64)
+
+
+class PricingModel:
+    """Ridge regressions of log sold price and log days to sell"""
+
+    def __init__(self, brand_columns, category_columns, grade_mean, coef_price, coef_days,
+                 precision, sigma_price, sigma_days, brand_support, rows):
+        self.brand_columns = brand_columns
+        self.category_columns = category_columns
+        self.grade_mean = grade_mean
+        self.coef_price = coef_price
+        self.coef_days = coef_days
+        self.precision = precision
+        self.sigma_price = sigma_price
+        self.sigma_days = sigma_days
+        self.brand_support = brand_support
+        self.rows = rows
+
+    def dense_features(self, grades, price):
+        """Design columns shared by every row: intercept, log price, condition grade and its presence"""
+        known = ~np.isnan(grades)
+        return np.column_stack((
+            np.ones(len(price)),
+            np.log1p(np.maximum(price, 0)),
+            np.where(known, grades, self.grade_mean),
+            known,
+        ))
+
+    @classmethod
+    def fit(cls, brand, brand_vocab, category, category_vocab, grades, price, sold_price, days):
+        """Fit on dictionary-encoded columns; grades holds one condition grade per row
+
+        The design matrix is four dense columns plus brand and category
+        one-hots. Its normal equations are summed block by block with
+        bincounts, chunk by chunk, so fitting is linear in the number of
+        sold items and memory stays bounded.
+        """
+        brand = np.asarray(brand, dtype=np.int64)
+        category = np.asarray(category, dtype=np.int64)
+        grades = np.asarray(grades, dtype=np.float64)
+        brand_columns = levels(brand, brand_vocab)
+        category_columns = levels(category, category_vocab)
+        brand_map = code_columns(brand_vocab, brand_columns)
+        category_map = code_columns(category_vocab, category_columns)
+        known_grades = grades[~np.isnan(grades)]
+        grade_mean = float(known_grades.mean()) if len(known_grades) else 0.0
+
+        # Sold items per brand column; slot 0 counts the pooled brands
+        brand_support = np.bincount(brand_map[brand] + 1, minlength=len(brand_columns) + 1)
+        model = cls(brand_columns, category_columns, grade_mean, None, None, None, 0.0, 0.0,
+                    brand_support, len(price))
+
+        nb = len(brand_columns)
+        nc = len(category_columns)
+        width = 4 + nb + nc
+        brands = slice(4, 4 + nb)
+        categories = slice(4 + nb, width)
+
+        def chunks():
+            for start in range(0, len(price), FIT_CHUNK_ROWS):
+                end = start + FIT_CHUNK_ROWS
+                dense = model.dense_features(grades[start:end], np.asarray(price[start:end], dtype=np.float64))
+                targets = np.log1p(np.maximum(np.column_stack((
+                    np.asarray(sold_price[start:end], dtype=np.float64),
+                    np.asarray(days[start:end], dtype=np.float64),
+                )), 0))
+                yield dense, brand_map[brand[start:end]], category_map[category[start:end]], targets
+
+        gram = np.zeros((width, width))
+        moments = np.zeros((width, 2))
+        for dense, b, c, targets in chunks():
+            has_b = b >= 0
+            has_c = c >= 0
+            gram[:4, :4] += dense.T @ dense
+            moments[:4] += dense.T @ targets
+            for j in range(4):
+                gram[j, brands] += np.bincount(b[has_b], weights=dense[has_b, j], minlength=nb)
+                gram[j, categories] += np.bincount(c[has_c], weights=dense[has_c, j], minlength=nc)
+            for k in range(2):
+                moments[brands, k] += np.bincount(b[has_b], weights=targets[has_b, k], minlength=nb)
+                moments[categories, k] += np.bincount(c[has_c], weights=targets[has_c, k], minlength=nc)
+            gram[brands, brands] += np.diag(np.bincount(b[has_b], minlength=nb).astype(np.float64))
+            gram[categories, categories] += np.diag(np.bincount(c[has_c], minlength=nc).astype(np.float64))
+            both = has_b & has_c
+            gram[brands, categories] += np.bincount(b[both] * nc + c[both], minlength=nb * nc).reshape(nb, nc)
+
+        # Only the upper blocks were summed
+        gram[brands, :4] = gram[:4, brands].T
+        gram[categories, :4] = gram[:4, categories].T
+        gram[categories, brands] = gram[brands, categories].T
+
+        penalty = np.full(width, RIDGE_PENALTY)
+        penalty[0] = 0.0
+        precision = np.linalg.pinv(gram + np.diag(penalty))
+        coefficients = precision @ moments
+        model.precision = precision
+        model.coef_price = coefficients[:, 0]
+        model.coef_days = coefficients[:, 1]
+
+        # Residual spread on the log scale gives the prediction intervals
+        squares = np.zeros(2)
+        for dense, b, c, targets in chunks():
+            predicted = dense @ coefficients[:4]
+            predicted += np.where(b[:, None] >= 0, coefficients[brands][np.maximum(b, 0)] if nb else 0.0, 0.0)
+            predicted += np.where(c[:, None] >= 0, coefficients[categories][np.maximum(c, 0)] if nc else 0.0, 0.0)
+            squares += np.sum((targets - predicted) ** 2, axis=0)
+        dof = max(len(price) - width, 1)
+        model.sigma_price, model.sigma_days = (float(value) for value in np.sqrt(squares / dof))
+        return model
+
+    @classmethod
+    def from_items(cls, items):
+        """Fit on a list of sold-item dicts"""
+        brand, brand_vocab = encode([item['brand'] for item in items])
+        category, category_vocab = encode([item['category'] for item in items])
+        grades = np.array([condition_grade(item['condition']) for item in items], dtype=np.float64)
+        column = lambda name: np.array([item[name] for item in items], dtype=np.float64)
+        return cls.fit(brand, brand_vocab, category, category_vocab, grades,
+                       column('original_price'), column('sold_price'), column('days_to_sell'))
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        """Fit on a memory-mapped SoldItemsDataset's columns"""
+        def column(name, dtype):
+            return np.frombuffer(dataset.column(name), dtype=dtype)
+
+        vocab = dataset.dictionaries
+        grade_table = np.array([condition_grade(value) for value in vocab['condition']], dtype=np.float64)
+        return cls.fit(column('brand', np.int32), vocab['brand'],
+                       column('category', np.int32), vocab['category'],
+                       grade_table[column('condition', np.int32)],
+                       column('original_price', np.float32), column('sold_price', np.float32),
+                       column('days_to_sell', np.int32))
+
+    def predict(self, item_data):
+        """Predicted resale price and days to sell with 80% intervals, or None without a usable price"""
+        price = parse_price(item_data.get('price'))
+        if price is None or price <= 0 or self.coef_price is None:
+            return None
+
+        # The item's design row has at most six non-zero entries, so only
+        # those coefficients and that block of the precision matrix are used
+        grade = condition_grade(item_data.get('condition'))
+        known = not np.isnan(grade)
+        columns = [0, 1, 2, 3]
+        values = [1.0, float(np.log1p(price)), grade if known else self.grade_mean, float(known)]
+        brand_column = self.brand_columns.get(normalize_text(item_data.get('brand')), -1)
+        if brand_column >= 0:
+            columns.append(4 + brand_column)
+            values.append(1.0)
+        category_column = self.category_columns.get(normalize_text(item_data.get('category')), -1)
+        if category_column >= 0:
+            columns.append(4 + len(self.brand_columns) + category_column)
+            values.append(1.0)
+        columns = np.array(columns)
+        x = np.array(values)
+
+        # Spread of a new observation: residual noise plus coefficient uncertainty
+        spread = (1.0 + float(x @ self.precision[np.ix_(columns, columns)] @ x)) ** 0.5
+        log_price = float(x @ self.coef_price[columns])
+        log_days = float(x @ self.coef_days[columns])
+        margin_price = INTERVAL_Z * self.sigma_price * spread
+        margin_days = INTERVAL_Z * self.sigma_days * spread
+
+        resale_price = float(np.expm1(log_price))
+        price_low, price_high = (float(np.expm1(log_price - margin_price)), float(np.expm1(log_price + margin_price)))
+        return {
+            'resale_price': resale_price,
+            'price_interval': (max(price_low, 0.0), price_high),
+            'days_to_sell': float(np.expm1(log_days)),
+            'days_interval': (max(float(np.expm1(log_days - margin_days)), 0.0), float(np.expm1(log_days + margin_days))),
+            'relative_interval': (price_high - price_low) / resale_price if resale_price > 0 else float('inf'),
+            'support': int(self.brand_support[brand_column + 1]) if brand_column >= 0 else 0,
+        }
+
+
+def route(prediction, price):
+    """'local' when the prediction can answer for the LLM, else why the LLM is needed"""
+    if prediction is None:
+        return 'no_prediction'
+    if price is not None and price >= PRICING_HIGH_VALUE:
+        return 'high_value'
+    if prediction['support'] < PRICING_MIN_SUPPORT:
+        return 'low_support'
+    if prediction['relative_interval'] > PRICING_MAX_INTERVAL:
+        return 'uncertain'
+    return 'local'
+
+
+class RouterStats:
+    """How analyses were routed, and how long local predictions took"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._predictions = 0
+        self._predict_seconds = 0.0
+
+    def record(self, route_name, elapsed):
+        with self._lock:
+            self._routes[route_name] = self._routes.get(route_name, 0) + 1
+            self._predictions += 1
+            self._predict_seconds += elapsed
+
+    def stats(self):
+        with self._lock:
+            routes = dict(self._routes)
+            predictions = self._predictions
+            seconds = self._predict_seconds
+        return {
+            'enabled': PRICING_ROUTER,
+            'routes': routes,
+            'local_rate': round(routes.get('local', 0) / predictions, 3) if predictions else 0.0,
+            'avg_predict_us': round(seconds / predictions * 1e6, 1) if predictions else 0.0,
+        }
+
+
+router_stats = RouterStats()
+
+
+def timed_route(model, item_data, price):
+    """(prediction, route) for an item, recorded in router_stats"""
+    start = time.perf_counter()
+    prediction = model.predict(item_data) if model is not None else None
+    route_name = route(prediction, price)
+    router_stats.record(route_name, time.perf_counter() - start)
+    return prediction, route_name
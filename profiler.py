@@ -0,0 +1,247 @@
+"""
+On-demand statistical profiling of single requests
+
+A profile samples the wall-clock stacks of the request's thread, and of the
+pool threads doing work for it, every PROFILE_INTERVAL_MS. It is written to
+PROFILE_DIR as collapsed stacks, ready for flamegraph.pl or speedscope, and
+a JSON summary of the hottest functions. The sampler thread only runs while
+a profile is active, so requests that are not profiled pay nothing but the
+check that decides it.
+"""
+
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+# Directory profiles are written to
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+# Milliseconds between stack samples
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+
+# Fraction of requests profiled without being asked, e.g. 0.001; 0 disables
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+
+# Profiles kept on disk; the oldest are deleted beyond this
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
+
+# Functions listed in each summary ranking
+SUMMARY_TOP = 25
+
+# Profile of the request the current context is serving, if it is profiled
+_current_profile = contextvars.ContextVar('current_profile', default=None)
+
+
+def frame_label(code):
+    """Flame graph frame name of a code object: function (package/file.py:line)"""
+    path = code.co_filename.replace('\\', '/')
+    short = '/'.join(path.rsplit('/', 2)[-2:])
+    return f"{code.co_name} ({short}:{code.co_firstlineno})"
+
+
+def thread_role(name):
+    """Thread name without its pool index, so a pool's threads share one root frame"""
+    return name.rstrip('0123456789').rstrip('_-') or name
+
+
+class Profile:
+    """Stack samples collected for one request"""
+
+    def __init__(self, label):
+        self.id = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.label = label
+        self.started_at = time.time()
+        self.duration = None
+        self.samples = 0
+        self.stacks = Counter()
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        # Sampled thread ID -> how many of its calls are currently followed
+        self._threads = {}
+
+    def add_thread(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._threads[thread_id] = self._threads.get(thread_id, 0) + 1
+
+    def remove_thread(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            if self._threads.get(thread_id, 0) <= 1:
+                self._threads.pop(thread_id, None)
+            else:
+                self._threads[thread_id] -= 1
+
+    def sample(self, frames, names, labels):
+        """Record the current stack of every followed thread"""
+        with self._lock:
+            thread_ids = list(self._threads)
+        for thread_id in thread_ids:
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = frame_label(code)
+                stack.append(label)
+                frame = frame.f_back
+            stack.append(thread_role(names.get(thread_id, 'thread')))
+            stack.reverse()
+            self.stacks[';'.join(stack)] += 1
+        self.samples += 1
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._started
+
+    def collapsed(self):
+        """Collapsed stacks: one 'root;...;leaf count' line per distinct stack"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, interval):
+        """Sample counts per thread and the functions with the most own and total samples"""
+        own = Counter()
+        total = Counter()
+        threads = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            threads[frames[0]] += count
+            if len(frames) > 1:
+                own[frames[-1]] += count
+            # A recursive function counts once per stack
+            for frame in set(frames[1:]):
+                total[frame] += count
+        # Percent of the request's wall time; a function running on two threads can pass 100
+        ticks = self.samples or 1
+
+        def ranking(counter):
+            return [
+                {'function': frame, 'samples': count, 'percent': round(100 * count / ticks, 1)}
+                for frame, count in counter.most_common(SUMMARY_TOP)
+            ]
+
+        return {
+            'id': self.id,
+            'request': self.label,
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(),
+            'duration_ms': round(self.duration * 1000, 1) if self.duration is not None else None,
+            'interval_ms': interval * 1000,
+            'samples': self.samples,
+            'threads': dict(threads.most_common()),
+            'top_own': ranking(own),
+            'top_total': ranking(total),
+        }
+
+
+class RequestProfiler:
+    """Starts and stops request profiles and runs the sampler thread while any is active"""
+
+    def __init__(self, directory=PROFILE_DIR, interval_ms=PROFILE_INTERVAL_MS, max_files=PROFILE_MAX_FILES):
+        self.directory = directory
+        self.interval = interval_ms / 1000
+        self.max_files = max_files
+
+        self._lock = threading.Lock()
+        self._active = set()
+        self._sampler = None
+        self._labels = {}
+        self._counters = {'profiles': 0, 'samples': 0, 'write_errors': 0}
+
+    def start(self, label):
+        """Profile the calling thread, and the calls it follow()s, until stop()"""
+        profile = Profile(label)
+        profile.add_thread()
+        profile.token = _current_profile.set(profile)
+        with self._lock:
+            self._active.add(profile)
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._sampler.start()
+        return profile
+
+    def stop(self, profile):
+        """End a profile and write it out; returns the paths written, or None on failure"""
+        with self._lock:
+            self._active.discard(profile)
+            self._counters['profiles'] += 1
+            self._counters['samples'] += profile.samples
+        profile.finish()
+        try:
+            _current_profile.reset(profile.token)
+        except ValueError:
+            # Stopped from another context, which never saw the profile
+            pass
+        try:
+            return self._write(profile)
+        except OSError as e:
+            print(f"Error writing profile {profile.id}: {e}")
+            with self._lock:
+                self._counters['write_errors'] += 1
+            return None
+
+    def follow(self, fn):
+        """fn, sampled as part of the current profile when it runs on another thread"""
+        profile = _current_profile.get()
+        if profile is None:
+            return fn
+
+        def followed(*args, **kwargs):
+            profile.add_thread()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.remove_thread()
+        return followed
+
+    def _run(self):
+        while True:
+            with self._lock:
+                active = list(self._active)
+                if not active:
+                    # Exit when idle; the next profile starts a new sampler
+                    self._sampler = None
+                    return
+            frames = sys._current_frames()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for profile in active:
+                profile.sample(frames, names, self._labels)
+            del frames
+            time.sleep(self.interval)
+
+    def _write(self, profile):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, profile.id)
+        with open(f"{base}.collapsed", 'w', encoding='utf-8') as f:
+            f.write(profile.collapsed())
+        with open(f"{base}.json", 'w', encoding='utf-8') as f:
+            json.dump(profile.summary(self.interval), f, indent=2)
+        self._prune()
+        return f"{base}.collapsed", f"{base}.json"
+
+    def _prune(self):
+        """Delete the oldest profiles beyond max_files"""
+        summaries = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        for name in summaries[:max(0, len(summaries) - self.max_files)]:
+            for suffix in ('.json', '.collapsed'):
+                try:
+                    os.remove(os.path.join(self.directory, name[:-len('.json')] + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['active'] = len(self._active)
+        stats['sample_rate'] = PROFILE_SAMPLE_RATE
+        return stats
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,330 @@
+"""
+Compact, token-budgeted analysis prompts and token accounting for model calls
+
+The fixed instructions live in a static system prompt that is identical on
+every call. The per-item user message carries the item and its comparables
+as a pipe-separated table. When the prompt would exceed the token budget,
+the least relevant comparables are dropped first.
+"""
+
+import math
+import os
+import threading
+
+from analysis_cache import normalize_text, parse_price
+
+# Input tokens allowed per analysis prompt, system prompt included
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '700'))
+
+# Input tokens allowed per packed prompt analysing several items at once
+PACKED_PROMPT_TOKEN_BUDGET = int(os.getenv('PACKED_PROMPT_TOKEN_BUDGET', '2500'))
+
+# Comparable titles are cut to this many characters in the table
+PROMPT_TITLE_CHARS = 40
+
+# Tokens the chat format adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Rough size of a token for the estimate used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('cl100k_base')
+    TOKEN_COUNTER = 'tiktoken'
+except Exception:
+    # Not installed, or the encoding could not be loaded
+    _encoding = None
+    TOKEN_COUNTER = 'estimate'
+
+ANALYST = "You are an expert Vinted reseller with 5+ years of experience. Analyze items for reselling potential with realistic, data-driven analysis."
+
+REQUIREMENTS = """ANALYSIS REQUIREMENTS:
+1. Resellability: Consider brand popularity, demand, seasonality, and competition
+2. Resale Price: Base on similar sold items, brand value, and current market
+3. Time to Sell: Consider demand, season, and competition level
+4. Profit Calculation: Resale price - original price - €5 shipping - 5% platform fees
+5. Risks: Market saturation, seasonal factors, condition issues, etc."""
+
+GUIDELINES = """IMPORTANT: Be realistic and conservative. Consider that:
+- Vinted has high competition
+- Shipping costs €5
+- Platform fees are 5%
+- Most items take 7-30 days to sell
+- Profit margins are typically 20-50% for good items"""
+
+SYSTEM_PROMPT = f"""{ANALYST}
+
+You get the item to analyze and a table of similar sold items (paid and sold prices in euros, days it took to sell), most relevant first.
+
+{REQUIREMENTS}
+
+Always answer with valid JSON in this EXACT format:
+{{
+    "resellable": "Yes" or "No",
+    "estimated_resale_price": "€XX.XX",
+    "time_to_sell": "X-X days",
+    "estimated_profit": "€XX.XX",
+    "risks": "Specific risk factors"
+}}
+
+{GUIDELINES}"""
+
+PACKED_SYSTEM_PROMPT = f"""{ANALYST}
+
+You get a numbered table of similar sold items (paid and sold prices in euros, days it took to sell) and a numbered table of items to analyze. Each item lists the sold items most relevant to it, most relevant first.
+
+{REQUIREMENTS}
+
+Always answer with a valid JSON array holding one object per item, in this EXACT format:
+[
+    {{
+        "item": 1,
+        "resellable": "Yes" or "No",
+        "estimated_resale_price": "€XX.XX",
+        "time_to_sell": "X-X days",
+        "estimated_profit": "€XX.XX",
+        "risks": "Specific risk factors"
+    }}
+]
+
+{GUIDELINES}"""
+
+COMPARABLE_COLUMNS = ('title', 'brand', 'category', 'condition', 'size', 'paid', 'sold', 'days')
+
+PACKED_ITEM_COLUMNS = ('item', 'title', 'price', 'brand', 'size', 'category', 'condition', 'comparables')
+
+
+def count_tokens(text):
+    """Tokens in text, exact with tiktoken and estimated otherwise"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def message_tokens(messages):
+    """Input tokens of a list of chat messages"""
+    return sum(count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def cell(value):
+    """Table cell text; the column separator is not allowed inside cells"""
+    if isinstance(value, float):
+        value = f"{value:g}"
+    return ' '.join(str(value if value is not None else '').replace('|', '/').split()) or '-'
+
+
+def comparable_row(item):
+    """One pipe-separated table row for a sold item"""
+    title = str(item.get('title') or '')[:PROMPT_TITLE_CHARS]
+    return '|'.join(cell(value) for value in (
+        title,
+        item.get('brand'),
+        item.get('category'),
+        item.get('condition'),
+        item.get('size'),
+        item.get('original_price'),
+        item.get('sold_price'),
+        item.get('days_to_sell'),
+    ))
+
+
+def comparable_relevance(item_data, comparable):
+    """How much a sold item tells about the analysed one; higher is more relevant"""
+    relevance = 0.0
+    for field, weight in (('brand', 3.0), ('category', 2.0), ('condition', 1.0), ('size', 0.5)):
+        value = normalize_text(item_data.get(field))
+        if value and value == normalize_text(comparable.get(field)):
+            relevance += weight
+
+    price = parse_price(item_data.get('price'))
+    paid = parse_price(comparable.get('original_price'))
+    if price and paid is not None:
+        # Up to one point for a comparable bought at a similar price
+        relevance += max(0.0, 1.0 - abs(paid - price) / price)
+    return relevance
+
+
+def rank_comparables(item_data, comparison_data):
+    """Comparables ordered by relevance, keeping the given order between equals"""
+    return sorted(comparison_data or [], key=lambda comparable: -comparable_relevance(item_data, comparable))
+
+
+def item_message(item_data, rows):
+    """User message with the item and the comparables table"""
+    lines = [
+        'ITEM TO ANALYZE:',
+        f"- Title: {item_data.get('title', 'N/A')}",
+        f"- Current Price: €{item_data.get('price', 'N/A')}",
+        f"- Brand: {item_data.get('brand', 'N/A')}",
+        f"- Size: {item_data.get('size', 'N/A')}",
+        f"- Category: {item_data.get('category', 'N/A')}",
+        f"- Condition: {item_data.get('condition', 'N/A')}",
+        '',
+    ]
+    if rows:
+        lines.append('SIMILAR SOLD ITEMS:')
+        lines.append('|'.join(COMPARABLE_COLUMNS))
+        lines.extend(rows)
+    else:
+        lines.append('SIMILAR SOLD ITEMS: none found')
+    return '\n'.join(lines)
+
+
+def packed_message(pack, table, refs):
+    """User message with the shared comparables table and one row per item"""
+    lines = ['SIMILAR SOLD ITEMS:', '|'.join(('#',) + COMPARABLE_COLUMNS)]
+    lines.extend(f"{number}|{row}" for row, number in table.items())
+    lines.append('')
+    lines.append('ITEMS TO ANALYZE:')
+    lines.append('|'.join(PACKED_ITEM_COLUMNS))
+    for position, (item_data, _) in enumerate(pack):
+        lines.append('|'.join(cell(value) for value in (
+            position + 1,
+            item_data.get('title'),
+            item_data.get('price'),
+            item_data.get('brand'),
+            item_data.get('size'),
+            item_data.get('category'),
+            item_data.get('condition'),
+            ','.join(str(table[row]) for row in refs[position]),
+        )))
+    return '\n'.join(lines)
+
+
+class PromptStats:
+    """Prompt sizes and token usage of the analysis calls in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {
+            'prompts': 0,
+            'calls': 0,
+            'input_tokens': 0,
+            'output_tokens': 0,
+            'comparables_sent': 0,
+            'comparables_trimmed': 0,
+            'over_budget': 0,
+        }
+
+    def record_prompt(self, sent, trimmed, over_budget):
+        with self._lock:
+            self._counters['prompts'] += 1
+            self._counters['comparables_sent'] += sent
+            self._counters['comparables_trimmed'] += trimmed
+            if over_budget:
+                self._counters['over_budget'] += 1
+
+    def record_usage(self, messages, usage, text=None):
+        """Count a call's tokens, from the API's usage report when there is one
+
+        Returns (input_tokens, output_tokens).
+        """
+        if usage:
+            input_tokens = usage.get('prompt_tokens', 0)
+            output_tokens = usage.get('completion_tokens', 0)
+        else:
+            input_tokens = message_tokens(messages)
+            output_tokens = count_tokens(text or '')
+
+        with self._lock:
+            self._counters['calls'] += 1
+            self._counters['input_tokens'] += input_tokens
+            self._counters['output_tokens'] += output_tokens
+        return input_tokens, output_tokens
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['token_counter'] = TOKEN_COUNTER
+        stats['budget'] = PROMPT_TOKEN_BUDGET
+        calls = stats['calls']
+        stats['avg_input_tokens'] = round(stats['input_tokens'] / calls, 1) if calls else 0.0
+        stats['avg_output_tokens'] = round(stats['output_tokens'] / calls, 1) if calls else 0.0
+        return stats
+
+
+prompt_stats = PromptStats()
+
+
+def build_analysis_messages(item_data, comparison_data, budget=PROMPT_TOKEN_BUDGET):
+    """Chat messages asking for a resell analysis, within budget input tokens
+
+    The most relevant comparables that fit are kept; if even the bare item
+    does not fit, it is sent without comparables.
+    """
+    system = {"role": "system", "content": SYSTEM_PROMPT}
+    rows = [comparable_row(comparable) for comparable in rank_comparables(item_data, comparison_data)]
+
+    # Rows only ever add tokens, so take the longest prefix that fits
+    base_tokens = message_tokens([system, {"role": "user", "content": item_message(item_data, [])}])
+    header_tokens = count_tokens('\n'.join(['SIMILAR SOLD ITEMS:', '|'.join(COMPARABLE_COLUMNS)]))
+    used = base_tokens + header_tokens
+    kept = 0
+    for row in rows:
+        row_tokens = count_tokens(row) + 1
+        if used + row_tokens > budget:
+            break
+        used += row_tokens
+        kept += 1
+
+    messages = [system, {"role": "user", "content": item_message(item_data, rows[:kept])}]
+    # Tokens can merge across row boundaries, so check the assembled prompt too
+    while kept and message_tokens(messages) > budget:
+        kept -= 1
+        messages[1]['content'] = item_message(item_data, rows[:kept])
+    prompt_stats.record_prompt(kept, len(rows) - kept, base_tokens > budget)
+    return messages
+
+
+def build_packed_messages(pack, budget=PACKED_PROMPT_TOKEN_BUDGET):
+    """Chat messages asking for analyses of every (item_data, comparison_data) in pack
+
+    Items are numbered from 1 in pack order. Comparables shared by several
+    items appear once in the table. Every item is always sent; comparables
+    are added round-robin, each item's most relevant first, while they fit
+    within budget input tokens.
+    """
+    system = {"role": "system", "content": PACKED_SYSTEM_PROMPT}
+    ranked = [
+        [comparable_row(comparable) for comparable in rank_comparables(item_data, comparison_data)]
+        for item_data, comparison_data in pack
+    ]
+    table = {}
+    refs = [[] for _ in pack]
+
+    def messages():
+        return [system, {"role": "user", "content": packed_message(pack, table, refs)}]
+
+    base_tokens = message_tokens(messages())
+    used = base_tokens
+    added = []
+    for depth in range(max(map(len, ranked), default=0)):
+        for position, rows in enumerate(ranked):
+            if depth >= len(rows) or rows[depth] in refs[position]:
+                continue
+            row = rows[depth]
+            # A reference costs about two tokens, a new table row its own length too
+            cost = 2 if row in table else count_tokens(row) + 4
+            if used + cost > budget:
+                continue
+            used += cost
+            if row not in table:
+                table[row] = len(table) + 1
+                added.append((position, row, True))
+            else:
+                added.append((position, row, False))
+            refs[position].append(row)
+
+    # Tokens can merge across cell boundaries, so check the assembled prompt too
+    result = messages()
+    while added and message_tokens(result) > budget:
+        position, row, new_row = added.pop()
+        refs[position].remove(row)
+        if new_row:
+            del table[row]
+        result = messages()
+
+    sent = sum(map(len, refs))
+    prompt_stats.record_prompt(sent, sum(map(len, ranked)) - sent, base_tokens > budget)
+    return result
@@ -0,0 +1,166 @@
+"""
+Latency budgets, circuit breaking and hedged calls for slow upstream services
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+# Consecutive failures (errors or timeouts) that open the circuit
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+
+# Seconds the circuit stays open before letting a probe call through
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call does not finish within its latency budget"""
+
+
+class Deadline:
+    """Point in time by which a request must be answered"""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self):
+        """Seconds left, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+class CircuitBreaker:
+    """Stops calling a failing service until a probe call succeeds again
+
+    Closed: calls go through. After failure_threshold consecutive failures
+    the circuit opens and calls are refused. Once reset_timeout has passed
+    it is half-open: a single probe call goes through, and its outcome
+    closes or re-opens the circuit.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._counters = {
+            'allowed': 0,
+            'rejected': 0,
+            'successes': 0,
+            'failures': 0,
+            'trips': 0,
+        }
+
+    def allow(self):
+        """Whether a call may be made now; a True while half-open claims the probe"""
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+                self._probing = False
+
+            if self._state == CLOSED or (self._state == HALF_OPEN and not self._probing):
+                if self._state == HALF_OPEN:
+                    self._probing = True
+                self._counters['allowed'] += 1
+                return True
+
+            self._counters['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._counters['successes'] += 1
+            self._failures = 0
+            if self._state != CLOSED:
+                print(f"Circuit {self.name} closed")
+            self._state = CLOSED
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._counters['failures'] += 1
+            self._failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+                self._counters['trips'] += 1
+                print(f"Circuit {self.name} opened after {self._failures} consecutive failures")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['state'] = self._state
+            stats['consecutive_failures'] = self._failures
+        return stats
+
+
+def hedge_delay(deadline, hedge_remaining):
+    """Seconds to wait on the primary call before hedging, once hedge_remaining seconds are left"""
+    return max(0.0, deadline.remaining() - hedge_remaining)
+
+
+def hedged_call(executor, primary, deadline, hedge=None, hedge_after=None):
+    """Run primary() on executor within the deadline, racing hedge() once hedge_after seconds pass
+
+    Returns (result, hedged). Raises DeadlineExceeded when nothing succeeds
+    in time, or the primary call's error when every call failed.
+    """
+    primary_future = executor.submit(primary)
+    hedged = {primary_future: False}
+
+    if hedge is not None and hedge_after is not None:
+        done, _ = wait([primary_future], timeout=min(hedge_after, deadline.remaining()))
+        if not done and not deadline.expired():
+            hedged[executor.submit(hedge)] = True
+
+    pending = set(hedged)
+    while pending:
+        done, pending = wait(pending, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceeded(f"no response within {deadline.budget:.1f}s")
+        for future in done:
+            if future.exception() is None:
+                return future.result(), hedged[future]
+
+    raise primary_future.exception()
+
+
+async def hedged_call_async(primary, deadline, hedge=None, hedge_after=None):
+    """hedged_call for coroutine functions; losing calls are cancelled"""
+    primary_task = asyncio.ensure_future(primary())
+    hedged = {primary_task: False}
+
+    try:
+        if hedge is not None and hedge_after is not None:
+            done, _ = await asyncio.wait([primary_task], timeout=min(hedge_after, deadline.remaining()))
+            if not done and not deadline.expired():
+                hedged[asyncio.ensure_future(hedge())] = True
+
+        pending = set(hedged)
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded(f"no response within {deadline.budget:.1f}s")
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), hedged[task]
+
+        raise primary_task.exception()
+    finally:
+        for task in hedged:
+            task.cancel()
@@ -0,0 +1,265 @@
+"""
+Vectorized scoring of sold items against an analysed item
+"""
+
+import os
+import queue
+import threading
+
+import numpy as np
+
+# Relative weight of each similarity signal in the final score
+SCORE_WEIGHTS = {
+    'brand': 4.0,
+    'partial_brand': 2.0,
+    'category': 3.0,
+    'keyword': 1.5,
+    'price': 2.0,
+    'condition': 1.0,
+    'size': 0.5,
+    'title': 3.0,
+}
+
+# Price similarity halves every PRICE_HALF_LIFE euros of difference
+PRICE_HALF_LIFE = 20.0
+
+# Condition grades, checked in order against the lowercased condition text
+CONDITION_GRADES = [
+    ('with tags', 5), ('avec étiquette', 5),
+    ('new', 4), ('neuf', 4), ('excellent', 4),
+    ('very good', 3), ('très bon', 3),
+    ('good', 2), ('bon', 2),
+    ('satisfactory', 1), ('satisfaisant', 1), ('fair', 1),
+]
+MAX_CONDITION_GRADE = 5
+
+# Scoring buffers kept per scorer; also the number of concurrent scorings
+SCORER_WORKSPACES = int(os.getenv('SCORER_WORKSPACES', '4'))
+
+
+def condition_grade(condition):
+    """Map a condition label to a 1-5 grade, or NaN when unknown"""
+    condition = (condition or '').lower()
+    for label, grade in CONDITION_GRADES:
+        if label in condition:
+            return grade
+    return np.nan
+
+
+def normalize_size(size):
+    return ''.join(str(size or '').lower().split())
+
+
+def encode(values):
+    """Dictionary-encode a list of strings into (codes, vocabulary)"""
+    vocabulary = {}
+    codes = np.fromiter((vocabulary.setdefault(value, len(vocabulary)) for value in values),
+                        dtype=np.int32, count=len(values))
+    return codes, list(vocabulary)
+
+
+def encode_more(codes, vocabulary, values):
+    """Append a list of strings to a dictionary-encoded column, as new (codes, vocabulary)"""
+    lookup = {value: code for code, value in enumerate(vocabulary)}
+    added = np.fromiter((lookup.setdefault(value, len(lookup)) for value in values),
+                        dtype=np.int32, count=len(values))
+    return np.concatenate([codes, added]), list(lookup)
+
+
+def weight_table(vocabulary, weigh):
+    """Per-code weights for a dictionary-encoded column"""
+    return np.array([weigh(value) for value in vocabulary], dtype=np.float32)
+
+
+def add_weights(scores, column, workspace, table):
+    """Add each row's code weight to scores in place"""
+    codes = np.flatnonzero(table)
+    if len(codes) == 0:
+        return
+    if len(codes) <= 2:
+        # One or two branch-free equality masks beat a full gather
+        for code in codes.tolist():
+            np.equal(column, code, out=workspace.mask)
+            np.multiply(workspace.mask, table[code], out=workspace.temp)
+            scores += workspace.temp
+    else:
+        np.take(table, column, out=workspace.temp)
+        scores += workspace.temp
+
+
+class Workspace:
+    """Preallocated arrays reused across scorings, so large temporaries are
+    not freshly mapped and page-faulted on every request"""
+
+    def __init__(self, rows):
+        self.scores = np.zeros(rows, dtype=np.float32)
+        self.temp = np.zeros(rows, dtype=np.float32)
+        self.mask = np.zeros(rows, dtype=bool)
+
+
+class ComparableScorer:
+    """Scores every sold item at once from dictionary-encoded column arrays"""
+
+    def __init__(self, brand, brand_vocab, category, category_vocab, condition, condition_vocab,
+                 size, size_vocab, price, category_keywords=None):
+        self.category_keywords = category_keywords or {}
+        self.vocabularies = (brand_vocab, category_vocab, condition_vocab, size_vocab)
+        self.brand = brand
+        self.brand_vocab = brand_vocab
+        self.category = category
+        self.category_vocab = category_vocab
+        self.condition = condition
+        self.size = size
+        self.size_vocab = [normalize_size(value) for value in size_vocab]
+        self.price = price
+        self.condition_grades = np.array([condition_grade(value) for value in condition_vocab], dtype=np.float32)
+        self.brand_lower = [value.lower() for value in brand_vocab]
+        self.category_lower = [value.lower() for value in category_vocab]
+
+        self._workspaces = queue.LifoQueue()
+        self._workspace_count = 0
+        self._workspace_lock = threading.Lock()
+
+    @classmethod
+    def from_items(cls, items, category_keywords=None):
+        """Build column arrays from a list of sold-item dicts"""
+        brand, brand_vocab = encode([item['brand'] for item in items])
+        category, category_vocab = encode([item['category'] for item in items])
+        condition, condition_vocab = encode([item['condition'] for item in items])
+        size, size_vocab = encode([item['size'] for item in items])
+        price = np.array([item['original_price'] for item in items], dtype=np.float32)
+        return cls(brand, brand_vocab, category, category_vocab, condition, condition_vocab,
+                   size, size_vocab, price, category_keywords)
+
+    @classmethod
+    def from_dataset(cls, dataset, category_keywords=None):
+        """Wrap a memory-mapped SoldItemsDataset's columns without copying"""
+        def column(name, dtype):
+            return np.frombuffer(dataset.column(name), dtype=dtype)
+
+        vocab = dataset.dictionaries
+        return cls(column('brand', np.int32), vocab['brand'],
+                   column('category', np.int32), vocab['category'],
+                   column('condition', np.int32), vocab['condition'],
+                   column('size', np.int32), vocab['size'],
+                   column('original_price', np.float32),
+                   category_keywords)
+
+    def extended(self, items):
+        """A new scorer with sold-item dicts appended as rows, leaving this one untouched"""
+        brand_vocab, category_vocab, condition_vocab, size_vocab = self.vocabularies
+        brand, brand_vocab = encode_more(self.brand, brand_vocab, [item['brand'] for item in items])
+        category, category_vocab = encode_more(self.category, category_vocab, [item['category'] for item in items])
+        condition, condition_vocab = encode_more(self.condition, condition_vocab, [item['condition'] for item in items])
+        size, size_vocab = encode_more(self.size, size_vocab, [item['size'] for item in items])
+        price = np.concatenate([self.price, np.array([item['original_price'] for item in items], dtype=np.float32)])
+        return type(self)(brand, brand_vocab, category, category_vocab, condition, condition_vocab,
+                          size, size_vocab, price, self.category_keywords)
+
+    def __len__(self):
+        return len(self.price)
+
+    def _acquire_workspace(self):
+        """Borrow a workspace, creating up to SCORER_WORKSPACES of them"""
+        try:
+            return self._workspaces.get_nowait()
+        except queue.Empty:
+            pass
+        with self._workspace_lock:
+            create = self._workspace_count < SCORER_WORKSPACES
+            if create:
+                self._workspace_count += 1
+        if create:
+            return Workspace(len(self))
+        return self._workspaces.get()
+
+    def score(self, item_data, workspace=None, title_matches=None):
+        """Similarity score of every sold item to the given item
+
+        title_matches are (row, similarity) pairs from a TitleIndex search.
+        """
+        if workspace is None:
+            workspace = Workspace(len(self))
+        scores = workspace.scores
+        scores.fill(0)
+        if len(self) == 0:
+            return scores
+
+        brand = (item_data.get('brand') or '').strip().lower()
+        if brand:
+            add_weights(scores, self.brand, workspace, weight_table(self.brand_lower, lambda value: (
+                SCORE_WEIGHTS['brand'] if value == brand else
+                SCORE_WEIGHTS['partial_brand'] if brand in value or value in brand else 0
+            )))
+
+        category = (item_data.get('category') or '').strip().lower()
+        if category:
+            related_categories = []
+            for keyword, keyword_categories in self.category_keywords.items():
+                if keyword in category or any(cat in category for cat in keyword_categories):
+                    related_categories = keyword_categories
+                    break
+            add_weights(scores, self.category, workspace, weight_table(self.category_lower, lambda value: (
+                SCORE_WEIGHTS['category'] if value == category else
+                SCORE_WEIGHTS['keyword'] if any(cat in value for cat in related_categories) else 0
+            )))
+
+        try:
+            price = float(item_data.get('price'))
+        except (TypeError, ValueError):
+            price = None
+        if price is not None:
+            distance = np.subtract(self.price, price, out=workspace.temp)
+            np.abs(distance, out=distance)
+            np.multiply(distance, -1 / PRICE_HALF_LIFE, out=distance)
+            np.exp2(distance, out=distance)
+            np.multiply(distance, SCORE_WEIGHTS['price'], out=distance)
+            scores += distance
+
+        grade = condition_grade(item_data.get('condition'))
+        if not np.isnan(grade):
+            distance = np.abs(self.condition_grades - grade) / MAX_CONDITION_GRADE
+            # Unknown sold-item conditions count as half a match
+            similarity = np.where(np.isnan(distance), 0.5, 1 - distance)
+            add_weights(scores, self.condition, workspace, (SCORE_WEIGHTS['condition'] * similarity).astype(np.float32))
+
+        size = normalize_size(item_data.get('size'))
+        if size:
+            add_weights(scores, self.size, workspace, weight_table(self.size_vocab, lambda value: (
+                SCORE_WEIGHTS['size'] if value == size else 0
+            )))
+
+        if title_matches:
+            rows = np.fromiter((row for row, _ in title_matches), dtype=np.intp, count=len(title_matches))
+            similarity = np.fromiter((score for _, score in title_matches), dtype=np.float32, count=len(title_matches))
+            scores[rows] += SCORE_WEIGHTS['title'] * similarity
+
+        return scores
+
+    def top_k(self, item_data, k, title_matches=None):
+        """Rows of the k best-scoring sold items, best first"""
+        if len(self) == 0 or k <= 0:
+            return []
+        k = min(k, len(self))
+
+        workspace = self._acquire_workspace()
+        try:
+            scores = self.score(item_data, workspace, title_matches)
+
+            # Partition a negated copy in place to find the k-th best score
+            negated = np.negative(scores, out=workspace.temp)
+            negated.partition(k - 1)
+            threshold = -negated[k - 1]
+
+            # Everything above the threshold, then ties in row order
+            rows = np.flatnonzero(np.greater(scores, threshold, out=workspace.mask))
+            if len(rows) < k:
+                ties = np.flatnonzero(np.equal(scores, threshold, out=workspace.mask))[:k - len(rows)]
+                rows = np.concatenate([rows, ties])
+            row_scores = scores[rows]
+        finally:
+            self._workspaces.put(workspace)
+
+        # Highest score first; ties go to the earliest row
+        order = np.lexsort((rows, -row_scores))
+        return rows[order].tolist()
@@ -0,0 +1,345 @@
+"""
+Single-flight coalescing of duplicate work, within and across worker processes
+
+Concurrent calls with the same key share one execution. Inside a process,
+later callers wait for the first caller's result. Across gunicorn workers,
+the first caller takes a lease row in a shared SQLite table and publishes
+its result there; callers in other workers poll for that result instead of
+repeating the work.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from item_cache import ITEM_CACHE_DB
+from resilience import DeadlineExceeded
+
+# Shared store for leases and published results
+SINGLEFLIGHT_DB = os.getenv('SINGLEFLIGHT_DB', ITEM_CACHE_DB)
+
+# A lease older than this is treated as abandoned by a crashed worker
+SINGLEFLIGHT_LEASE_TTL = float(os.getenv('SINGLEFLIGHT_LEASE_TTL', '120'))
+
+# Published results stay readable this long for callers still waiting
+SINGLEFLIGHT_RESULT_TTL = float(os.getenv('SINGLEFLIGHT_RESULT_TTL', '10'))
+
+# How often callers in other workers check for the result
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv('SINGLEFLIGHT_POLL_INTERVAL', '0.05'))
+
+# Expired rows are purged after this many published results
+PURGE_EVERY = 200
+
+
+class LeaseWaitExceeded(DeadlineExceeded):
+    """Raised when a caller's deadline passes while another worker holds the lease"""
+
+
+class Flight:
+    """One in-process execution that concurrent callers wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.payload = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls by key; results must be JSON-serializable"""
+
+    def __init__(self, db_path=SINGLEFLIGHT_DB, lease_ttl=SINGLEFLIGHT_LEASE_TTL,
+                 result_ttl=SINGLEFLIGHT_RESULT_TTL, poll_interval=SINGLEFLIGHT_POLL_INTERVAL):
+        self.db_path = db_path
+        self.lease_ttl = lease_ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+
+        self._flights = {}
+        self._async_flights = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._published = 0
+        self._counters = {
+            'leaders': 0,
+            'coalesced': 0,
+            'shared': 0,
+            'lease_waits': 0,
+            'store_errors': 0,
+            'deadline_exceeded': 0,
+        }
+
+    def _connection(self):
+        """Per-thread SQLite connection, reopened after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS singleflight_leases ('
+            ' key TEXT PRIMARY KEY,'
+            ' owner TEXT NOT NULL,'
+            ' expires_at REAL NOT NULL)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS singleflight_results ('
+            ' key TEXT PRIMARY KEY,'
+            ' payload TEXT NOT NULL,'
+            ' expires_at REAL NOT NULL)'
+        )
+        conn.commit()
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _published_payload(self, key):
+        """JSON payload another worker published for key, or None"""
+        row = self._connection().execute(
+            'SELECT payload FROM singleflight_results WHERE key = ? AND expires_at > ?',
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _try_lease(self, key, owner):
+        """Take the cross-process lease for key unless a live one exists"""
+        now = time.time()
+        conn = self._connection()
+        try:
+            cursor = conn.execute(
+                'INSERT INTO singleflight_leases (key, owner, expires_at) VALUES (?, ?, ?)'
+                ' ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at'
+                ' WHERE singleflight_leases.expires_at <= ?',
+                (key, owner, now + self.lease_ttl, now)
+            )
+            conn.commit()
+        except sqlite3.Error:
+            # A failed commit must not leave the lease pending on this connection
+            conn.rollback()
+            raise
+        return cursor.rowcount == 1
+
+    def _publish(self, key, owner, payload):
+        """Publish a result and release the lease in one transaction"""
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO singleflight_results (key, payload, expires_at) VALUES (?, ?, ?)',
+            (key, payload, now + self.result_ttl)
+        )
+        conn.execute('DELETE FROM singleflight_leases WHERE key = ? AND owner = ?', (key, owner))
+        with self._lock:
+            self._published += 1
+            purge = self._published % PURGE_EVERY == 0
+        try:
+            if purge:
+                conn.execute('DELETE FROM singleflight_results WHERE expires_at <= ?', (now,))
+                conn.execute('DELETE FROM singleflight_leases WHERE expires_at <= ?', (now,))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+    def _release(self, key, owner):
+        """Give up the lease for key; store errors are counted, not raised"""
+        try:
+            conn = self._connection()
+            try:
+                conn.execute('DELETE FROM singleflight_leases WHERE key = ? AND owner = ?', (key, owner))
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+        except sqlite3.Error as e:
+            # Other workers then wait until the lease expires
+            self._store_error('release', e)
+
+    def _claim(self, key, owner):
+        """One step of the cross-process protocol: a published payload, 'lease' or None to keep waiting"""
+        payload = self._published_payload(key)
+        if payload is not None:
+            return payload
+        if self._try_lease(key, owner):
+            # A result may have been published just before the lease was free
+            try:
+                payload = self._published_payload(key)
+            except sqlite3.Error:
+                self._release(key, owner)
+                raise
+            if payload is not None:
+                self._release(key, owner)
+                return payload
+            return 'lease'
+        return None
+
+    def _store_error(self, action, e):
+        print(f"Single-flight store {action} error: {e}")
+        self._count('store_errors')
+
+    def _deadline_exceeded(self, key):
+        self._count('deadline_exceeded')
+        return DeadlineExceeded(f"no shared result for {key} within the deadline")
+
+    def _wait_interval(self, key, deadline):
+        """Seconds to sleep before the next poll; raises LeaseWaitExceeded once the deadline passed"""
+        if deadline is None:
+            return self.poll_interval
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            self._count('deadline_exceeded')
+            raise LeaseWaitExceeded(f"no shared result for {key} within the deadline")
+        return min(self.poll_interval, remaining)
+
+    def _run_shared(self, key, fn, deadline=None):
+        """Run fn as the cross-process leader for key, or reuse another worker's result"""
+        owner = uuid.uuid4().hex
+        waited = False
+        while True:
+            try:
+                claim = self._claim(key, owner)
+            except sqlite3.Error as e:
+                # Without the shared store, coalesce within this process only
+                self._store_error('lease', e)
+                return json.dumps(fn())
+            if claim == 'lease':
+                break
+            if claim is not None:
+                self._count('shared')
+                return claim
+            if not waited:
+                self._count('lease_waits')
+                waited = True
+            time.sleep(self._wait_interval(key, deadline))
+
+        published = False
+        try:
+            payload = json.dumps(fn())
+            try:
+                self._publish(key, owner, payload)
+                published = True
+            except sqlite3.Error as e:
+                self._store_error('publish', e)
+            return payload
+        finally:
+            # However fn or the store failed, other workers must not wait out the lease
+            if not published:
+                self._release(key, owner)
+
+    def do(self, key, fn, deadline=None):
+        """Return fn(), sharing one execution among concurrent callers with the same key
+
+        Callers that wait on another's execution give up with DeadlineExceeded
+        once the deadline, if any, has passed.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = Flight()
+                    self._counters['leaders'] += 1
+                else:
+                    self._counters['coalesced'] += 1
+
+            if leader:
+                try:
+                    flight.payload = self._run_shared(key, fn, deadline)
+                except Exception as e:
+                    flight.error = e
+                finally:
+                    with self._lock:
+                        del self._flights[key]
+                    flight.done.set()
+            elif not flight.done.wait(deadline.remaining() if deadline is not None else None):
+                raise self._deadline_exceeded(key)
+
+            # The leader only ran out of its own budget; a follower with time left takes over
+            if isinstance(flight.error, LeaseWaitExceeded) and not leader:
+                continue
+            if flight.error is not None:
+                raise flight.error
+            # Every caller gets its own copy to modify
+            return json.loads(flight.payload)
+
+    async def _run_shared_async(self, key, fn, deadline=None):
+        """_run_shared for coroutine functions; store access runs off the event loop"""
+        owner = uuid.uuid4().hex
+        waited = False
+        while True:
+            try:
+                claim = await asyncio.to_thread(self._claim, key, owner)
+            except sqlite3.Error as e:
+                self._store_error('lease', e)
+                return json.dumps(await fn())
+            if claim == 'lease':
+                break
+            if claim is not None:
+                self._count('shared')
+                return claim
+            if not waited:
+                self._count('lease_waits')
+                waited = True
+            await asyncio.sleep(self._wait_interval(key, deadline))
+
+        published = False
+        try:
+            payload = json.dumps(await fn())
+            try:
+                await asyncio.to_thread(self._publish, key, owner, payload)
+                published = True
+            except sqlite3.Error as e:
+                self._store_error('publish', e)
+            return payload
+        finally:
+            if not published:
+                await asyncio.to_thread(self._release, key, owner)
+
+    async def do_async(self, key, fn, deadline=None):
+        """Return await fn(), sharing one execution among concurrent callers with the same key"""
+        while True:
+            flight = self._async_flights.get(key)
+            leader = flight is None or flight.done()
+            if leader:
+                self._count('leaders')
+                flight = self._async_flights[key] = asyncio.ensure_future(self._run_shared_async(key, fn, deadline))
+                flight.add_done_callback(
+                    lambda done: self._async_flights.pop(key) if self._async_flights.get(key) is done else None
+                )
+            else:
+                self._count('coalesced')
+
+            try:
+                if deadline is None:
+                    # Shield the shared execution from any one caller being cancelled
+                    payload = await asyncio.shield(flight)
+                else:
+                    # wait() never cancels the shared execution, on timeout or when this caller is cancelled
+                    done, _ = await asyncio.wait({flight}, timeout=deadline.remaining())
+                    if not done:
+                        raise self._deadline_exceeded(key)
+                    payload = flight.result()
+            except LeaseWaitExceeded:
+                # Raised with the deadline of the caller that started the flight; others with time left retry
+                if leader:
+                    raise
+                continue
+            return json.loads(payload)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = len(self._flights) + len(self._async_flights)
+        return stats
+
+
+# Shared by the scrape and analysis stages of both servers
+single_flight = SingleFlight()
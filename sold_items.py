@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Columnar, memory-mapped sold-item dataset used as comparables reference data
+
+A dataset is a directory built from a CSV file with ``python sold_items.py
+build items.csv data/sold_items``. Rows are stored sorted by original price,
+string columns are dictionary encoded, and brand/category postings lists and
+a title n-gram index are precomputed, so every gunicorn worker can map the
+same files read-only and share them through the page cache.
+"""
+
+import csv
+import json
+import mmap
+import os
+import sys
+from array import array
+
+from comparables import CATEGORY_KEYWORDS
+from title_index import TitleIndex
+
+DATASET_VERSION = 2
+
+# CSV columns, matching the keys of MOCK_SOLD_ITEMS entries
+CSV_COLUMNS = ['title', 'brand', 'category', 'original_price', 'sold_price', 'days_to_sell', 'condition', 'size']
+
+# Dictionary-encoded string columns
+CODED_COLUMNS = ['brand', 'category', 'condition', 'size']
+
+# Binary column files: name -> array typecode
+COLUMN_TYPES = {
+    'original_price': 'f',
+    'sold_price': 'f',
+    'days_to_sell': 'i',
+    'brand': 'i',
+    'category': 'i',
+    'condition': 'i',
+    'size': 'i',
+    'title_offsets': 'q',
+    'brand_postings': 'i',
+    'category_postings': 'i',
+    'keyword_postings': 'i',
+    'title_postings': 'i',
+    'title_counts': 'H',
+    'title_norms': 'f',
+}
+
+
+def number(value):
+    """Return a whole number as int so rows match the hand-written items"""
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def read_sold_items_csv(csv_path):
+    """Yield sold-item dicts from a CSV file"""
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            yield {
+                'title': row['title'],
+                'brand': row['brand'],
+                'category': row['category'],
+                'original_price': number(row['original_price']),
+                'sold_price': number(row['sold_price']),
+                'days_to_sell': int(float(row['days_to_sell'])),
+                'condition': row['condition'],
+                'size': row['size'],
+            }
+
+
+def write_sold_items_csv(items, csv_path):
+    """Write sold-item dicts to a CSV file"""
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for item in items:
+            writer.writerow({column: item[column] for column in CSV_COLUMNS})
+
+
+def build_postings(keys_by_row, key_count):
+    """Group row numbers by key into one flat array plus [start, end) spans"""
+    counts = [0] * key_count
+    for keys in keys_by_row:
+        for key in keys:
+            counts[key] += 1
+
+    spans = []
+    start = 0
+    for count in counts:
+        spans.append([start, start + count])
+        start += count
+
+    postings = array('i', [0]) * start
+    cursor = [span[0] for span in spans]
+    for row, keys in enumerate(keys_by_row):
+        for key in keys:
+            postings[cursor[key]] = row
+            cursor[key] += 1
+    return postings, spans
+
+
+def build_dataset(items, out_dir):
+    """Write sold-item dicts as a columnar dataset directory"""
+    items = sorted(items, key=lambda item: item['original_price'])
+    os.makedirs(out_dir, exist_ok=True)
+
+    columns = {name: array(typecode) for name, typecode in COLUMN_TYPES.items()}
+    dictionaries = {name: {} for name in CODED_COLUMNS}
+    titles = bytearray()
+    columns['title_offsets'].append(0)
+
+    title_index = TitleIndex()
+    for row, item in enumerate(items):
+        title_index.add(row, item['title'])
+        for name in CODED_COLUMNS:
+            codes = dictionaries[name]
+            columns[name].append(codes.setdefault(item[name], len(codes)))
+        columns['original_price'].append(item['original_price'])
+        columns['sold_price'].append(item['sold_price'])
+        columns['days_to_sell'].append(item['days_to_sell'])
+        titles += item['title'].encode('utf-8')
+        columns['title_offsets'].append(len(titles))
+
+    # Postings are keyed case-insensitively, like ComparablesStore indexes
+    brand_keys = sorted({brand.lower() for brand in dictionaries['brand']})
+    category_keys = sorted({category.lower() for category in dictionaries['category']})
+    brand_key_codes = {key: code for code, key in enumerate(brand_keys)}
+    category_key_codes = {key: code for code, key in enumerate(category_keys)}
+    brand_to_key = [brand_key_codes[brand.lower()] for brand in dictionaries['brand']]
+    category_to_key = [category_key_codes[category.lower()] for category in dictionaries['category']]
+
+    keywords = list(CATEGORY_KEYWORDS)
+    category_keywords = [
+        [index for index, keyword in enumerate(keywords)
+         if any(cat in category for cat in CATEGORY_KEYWORDS[keyword])]
+        for category in category_keys
+    ]
+
+    columns['brand_postings'], brand_spans = build_postings(
+        [[brand_to_key[code]] for code in columns['brand']], len(brand_keys))
+    columns['category_postings'], category_spans = build_postings(
+        [[category_to_key[code]] for code in columns['category']], len(category_keys))
+    columns['keyword_postings'], keyword_spans = build_postings(
+        [category_keywords[category_to_key[code]] for code in columns['category']], len(keywords))
+
+    title_spans, columns['title_postings'], columns['title_counts'], columns['title_norms'] = title_index.flattened()
+
+    for name, values in columns.items():
+        with open(os.path.join(out_dir, f'{name}.bin'), 'wb') as f:
+            values.tofile(f)
+    with open(os.path.join(out_dir, 'titles.bin'), 'wb') as f:
+        f.write(titles)
+
+    meta = {
+        'version': DATASET_VERSION,
+        'rows': len(items),
+        'byteorder': sys.byteorder,
+        'columns': COLUMN_TYPES,
+        'dictionaries': {name: list(codes) for name, codes in dictionaries.items()},
+        'postings': {
+            'brand': dict(zip(brand_keys, brand_spans)),
+            'category': dict(zip(category_keys, category_spans)),
+            'keyword': dict(zip(keywords, keyword_spans)),
+            'title': title_spans,
+        },
+    }
+    with open(os.path.join(out_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+    return len(items)
+
+
+class PostingsIndex:
+    """Read-only key -> rows mapping over a memory-mapped postings array"""
+
+    def __init__(self, postings, spans):
+        self._postings = postings
+        self._spans = spans
+
+    def get(self, key, default=None):
+        span = self._spans.get(key)
+        if span is None:
+            return default
+        return self._postings[span[0]:span[1]]
+
+    def items(self):
+        for key, span in self._spans.items():
+            yield key, self._postings[span[0]:span[1]]
+
+    def __contains__(self, key):
+        return key in self._spans
+
+
+class SoldItemsDataset:
+    """Memory-mapped view of a dataset directory, shaped like a list of item dicts"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+
+        if self.meta.get('version') != DATASET_VERSION:
+            raise ValueError(f"Unsupported sold items dataset version {self.meta.get('version')}, please rebuild it")
+        if self.meta.get('byteorder') != sys.byteorder:
+            raise ValueError('Sold items dataset was built on a machine with a different byte order')
+
+        self.rows = self.meta['rows']
+        self.dictionaries = self.meta['dictionaries']
+        self._maps = {}
+        self._columns = {}
+
+    def _map(self, filename):
+        """Map a file read-only; pages are loaded on first access and shared"""
+        if filename not in self._maps:
+            with open(os.path.join(self.path, filename), 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    self._maps[filename] = b''
+                else:
+                    self._maps[filename] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[filename]
+
+    def column(self, name):
+        """Typed memoryview over one binary column"""
+        if name not in self._columns:
+            self._columns[name] = memoryview(self._map(f'{name}.bin')).cast(COLUMN_TYPES[name])
+        return self._columns[name]
+
+    def postings(self, name):
+        """Precomputed brand, category or keyword postings"""
+        return PostingsIndex(self.column(f'{name}_postings'), self.meta['postings'][name])
+
+    def title(self, row):
+        offsets = self.column('title_offsets')
+        return bytes(self._map('titles.bin')[offsets[row]:offsets[row + 1]]).decode('utf-8')
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.rows
+        if not 0 <= row < self.rows:
+            raise IndexError('sold item row out of range')
+        return {
+            'title': self.title(row),
+            'brand': self.dictionaries['brand'][self.column('brand')[row]],
+            'category': self.dictionaries['category'][self.column('category')[row]],
+            'original_price': number(round(self.column('original_price')[row], 2)),
+            'sold_price': number(round(self.column('sold_price')[row], 2)),
+            'days_to_sell': self.column('days_to_sell')[row],
+            'condition': self.dictionaries['condition'][self.column('condition')[row]],
+            'size': self.dictionaries['size'][self.column('size')[row]],
+        }
+
+    def __iter__(self):
+        for row in range(self.rows):
+            yield self[row]
+
+
+def main():
+    """Command line entry point for building datasets"""
+    if len(sys.argv) == 4 and sys.argv[1] == 'build':
+        count = build_dataset(read_sold_items_csv(sys.argv[2]), sys.argv[3])
+        print(f"✅ Built sold items dataset with {count} rows in {sys.argv[3]}")
+    elif len(sys.argv) == 3 and sys.argv[1] == 'export-mock':
+        from app import MOCK_SOLD_ITEMS
+        write_sold_items_csv(MOCK_SOLD_ITEMS, sys.argv[2])
+        print(f"✅ Wrote {len(MOCK_SOLD_ITEMS)} mock sold items to {sys.argv[2]}")
+    else:
+        print("Usage:")
+        print("   python sold_items.py build <items.csv> <dataset_dir>")
+        print("   python sold_items.py export-mock <items.csv>")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
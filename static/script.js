@@ -27,6 +27,7 @@ const errorMessage = document.getElementById('errorMessage');
 
 // State management
 let currentUrl = '';
+let latestRequestId = 0;
 
 // Event Listeners
 analyzeForm.addEventListener('submit', handleFormSubmit);
@@ -58,12 +59,15 @@ async function handleFormSubmit(e) {
 
 // Main analysis function
 async function analyzeItem(url) {
+    // Stages of an older analysis must not overwrite a newer one
+    const requestId = ++latestRequestId;
+    
     try {
         // Show loading state
         showLoading();
         
-        // Make API call
-        const response = await fetch('/analyze', {
+        // Make API call; each stage is rendered as soon as it arrives
+        const response = await fetch('/analyze/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -76,36 +80,89 @@ async function analyzeItem(url) {
             throw new Error(errorData.error || 'Failed to analyze item');
         }
         
-        const data = await response.json();
-        
-        // Display results
-        displayResults(data);
+        await readStages(response, stage => {
+            if (requestId !== latestRequestId) {
+                return;
+            }
+            if (stage.stage === 'error') {
+                throw new Error(stage.error || 'Failed to analyze item');
+            }
+            displayResults(stage);
+        });
         
     } catch (error) {
+        if (requestId !== latestRequestId) {
+            return;
+        }
         console.error('Analysis error:', error);
         showError(error.message || 'An error occurred while analyzing the item');
     }
 }
 
-// Display results
+// Read a newline-delimited JSON response, calling onStage for each line
+async function readStages(response, onStage) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.filter(line => line.trim()).forEach(line => onStage(JSON.parse(line)));
+    }
+    
+    buffer += decoder.decode();
+    if (buffer.trim()) {
+        onStage(JSON.parse(buffer));
+    }
+}
+
+// Display results; sections missing from data are left as they are
 function displayResults(data) {
     // Hide loading and error states
     hideLoading();
     hideError();
     
-    // Populate item details
-    populateItemDetails(data.item_data);
+    // Populate item details, with placeholders until the analysis arrives
+    if (data.item_data) {
+        populateItemDetails(data.item_data);
+        if (!data.analysis) {
+            showPendingAnalysis();
+        }
+    }
     
-    // Populate analysis results
-    populateAnalysisResults(data.analysis);
+    // Populate analysis results; partial ones only fill in the fields written so far
+    if (data.stage === 'analysis_partial') {
+        populatePartialAnalysis(data.analysis);
+    } else if (data.analysis) {
+        populateAnalysisResults(data.analysis);
+    }
     
     // Populate similar items
-    populateSimilarItems(data.similar_items);
+    if (data.similar_items) {
+        populateSimilarItems(data.similar_items);
+    }
     
     // Show results
     showResults();
 }
 
+// Mark the analysis cards as still loading
+function showPendingAnalysis() {
+    [resellableResult, profitResult, timeResult, priceResult].forEach(result => {
+        result.textContent = 'Analyzing...';
+    });
+    riskResult.textContent = 'Analyzing...';
+    updateResellableIndicator(null);
+    similarItemsList.innerHTML = '<p style="color: #64748b; text-align: center;">Finding similar items...</p>';
+}
+
 // Populate item details
 function populateItemDetails(itemData) {
     itemTitle.textContent = itemData.title || 'N/A';
@@ -128,6 +185,26 @@ function populateAnalysisResults(analysis) {
     updateResellableIndicator(analysis.resellable);
 }
 
+// Populate the analysis fields the model has written so far
+function populatePartialAnalysis(analysis) {
+    const fields = {
+        resellable: resellableResult,
+        estimated_profit: profitResult,
+        time_to_sell: timeResult,
+        estimated_resale_price: priceResult,
+        risks: riskResult
+    };
+    Object.entries(fields).forEach(([field, result]) => {
+        if (analysis[field]) {
+            result.textContent = analysis[field];
+        }
+    });
+    
+    if (analysis.resellable) {
+        updateResellableIndicator(analysis.resellable);
+    }
+}
+
 // Update resellable indicator
 function updateResellableIndicator(resellable) {
     const card = resellableResult.closest('.result-card');
@@ -184,8 +261,9 @@ function resetForm() {
     hideError();
     hideResults();
     
-    // Reset current URL
+    // Reset current URL and ignore any analysis still streaming in
     currentUrl = '';
+    latestRequestId++;
     
     // Reset button states
     analyzeBtn.disabled = false;
@@ -295,6 +373,11 @@ vintedUrlInput.addEventListener('input', function() {
 function addCopyFunctionality() {
     const resultValues = document.querySelectorAll('.result-value');
     resultValues.forEach(value => {
+        // Results render in stages, so only bind each element once
+        if (value.dataset.copyBound) {
+            return;
+        }
+        value.dataset.copyBound = 'true';
         value.style.cursor = 'pointer';
         value.title = 'Click to copy';
         value.addEventListener('click', function() {
@@ -0,0 +1,180 @@
+"""
+Character n-gram TF-IDF inverted index over sold-item titles
+"""
+
+import math
+import re
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+
+import numpy as np
+
+NGRAM_SIZE = 3
+
+# Postings read per query; grams more common than what is left of the budget
+# are skipped once rarer grams have produced candidates
+MAX_QUERY_POSTINGS = 20000
+
+NON_ALPHANUMERIC = re.compile(r'[^a-z0-9]+')
+
+
+def normalize_title(title):
+    """Lowercase, strip accents and collapse punctuation to single spaces"""
+    title = unicodedata.normalize('NFKD', str(title or '').lower())
+    title = ''.join(char for char in title if not unicodedata.combining(char))
+    return NON_ALPHANUMERIC.sub(' ', title).strip()
+
+
+def title_ngrams(title, size=NGRAM_SIZE):
+    """Character n-gram counts of each word, padded so word edges count"""
+    grams = Counter()
+    for word in normalize_title(title).split():
+        padded = f' {word} '
+        for start in range(max(1, len(padded) - size + 1)):
+            grams[padded[start:start + size]] += 1
+    return grams
+
+
+class TitleIndex:
+    """Inverted index from title n-grams to rows, updated as rows are added
+
+    Documents are weighted by raw n-gram counts and queries by count times
+    IDF (computed at query time), so adding a title never rewrites the
+    entries of titles indexed before it.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._norms = array('f')
+        self._documents = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_titles(cls, titles):
+        index = cls()
+        for row, title in enumerate(titles):
+            index.add(row, title)
+        return index
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        """Read-only index over the postings precomputed in a SoldItemsDataset"""
+        return DatasetTitleIndex(dataset)
+
+    def __len__(self):
+        return self._documents
+
+    def add(self, row, title):
+        """Index one title under the given row number"""
+        grams = title_ngrams(title)
+        norm = math.sqrt(sum(count * count for count in grams.values()))
+        # Everything is computed before the first write, so a failure cannot
+        # leave postings pointing at a row that has no norm
+        with self._lock:
+            if row >= len(self._norms):
+                self._norms.extend([0.0] * (row + 1 - len(self._norms)))
+            self._norms[row] = norm
+            for gram, count in grams.items():
+                postings = self._postings.get(gram)
+                if postings is None:
+                    postings = self._postings[gram] = (array('i'), array('H'))
+                postings[0].append(row)
+                postings[1].append(min(count, 65535))
+            self._documents += 1
+
+    def flattened(self):
+        """(spans, rows, counts, norms) with every gram's postings laid out contiguously"""
+        with self._lock:
+            spans = {}
+            rows = array('i')
+            counts = array('H')
+            for gram in sorted(self._postings):
+                gram_rows, gram_counts = self._postings[gram]
+                spans[gram] = [len(rows), len(rows) + len(gram_rows)]
+                rows.extend(gram_rows)
+                counts.extend(gram_counts)
+            return spans, rows, counts, array('f', self._norms)
+
+    def _document_frequency(self, gram):
+        postings = self._postings.get(gram)
+        return len(postings[0]) if postings else 0
+
+    def _gram_postings(self, gram):
+        # Copies: a view left alive past the lock would make add() fail to grow the arrays
+        rows, counts = self._postings[gram]
+        return np.array(rows, copy=True), np.array(counts, copy=True)
+
+    def _norm_array(self):
+        # Only ever indexed, which copies, so the view dies before the lock is released
+        return np.asarray(self._norms)
+
+    def search(self, title, limit=20):
+        """Rows of the most similar titles as (row, similarity) pairs, best first"""
+        query = title_ngrams(title)
+        if not query or limit <= 0:
+            return []
+
+        with self._lock:
+            documents = len(self)
+            candidates = []
+            query_norm = 0.0
+            for gram, count in query.items():
+                frequency = self._document_frequency(gram)
+                if frequency:
+                    weight = count * (math.log((documents + 1) / (frequency + 1)) + 1)
+                    query_norm += weight * weight
+                    candidates.append((frequency, gram, weight))
+            if not candidates:
+                return []
+
+            # Rarest grams first: they are the most selective and the cheapest
+            candidates.sort()
+            row_parts = []
+            score_parts = []
+            budget = MAX_QUERY_POSTINGS
+            for frequency, gram, weight in candidates:
+                if frequency > budget and row_parts:
+                    continue
+                rows, counts = self._gram_postings(gram)
+                row_parts.append(rows)
+                score_parts.append(counts * np.float32(weight))
+                budget -= frequency
+
+            rows, inverse = np.unique(np.concatenate(row_parts), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+            norms = self._norm_array()[rows]
+
+        similarity = scores / (np.maximum(norms, 1e-9) * math.sqrt(query_norm))
+        if len(rows) > limit:
+            best = np.argpartition(-similarity, limit - 1)[:limit]
+            rows, similarity = rows[best], similarity[best]
+        order = np.lexsort((rows, -similarity))
+        return [(int(row), float(score)) for row, score in zip(rows[order], similarity[order])]
+
+
+class DatasetTitleIndex(TitleIndex):
+    """TitleIndex backed by memory-mapped postings from a dataset directory"""
+
+    def __init__(self, dataset):
+        super().__init__()
+        self._spans = dataset.meta['postings']['title']
+        self._rows = np.frombuffer(dataset.column('title_postings'), dtype=np.int32)
+        self._counts = np.frombuffer(dataset.column('title_counts'), dtype=np.uint16)
+        self._dataset_norms = np.frombuffer(dataset.column('title_norms'), dtype=np.float32)
+        self._documents = len(dataset)
+
+    def add(self, row, title):
+        raise TypeError('Cannot add titles to a dataset-backed title index')
+
+    def _document_frequency(self, gram):
+        span = self._spans.get(gram)
+        return span[1] - span[0] if span else 0
+
+    def _gram_postings(self, gram):
+        start, end = self._spans[gram]
+        return self._rows[start:end], self._counts[start:end]
+
+    def _norm_array(self):
+        return self._dataset_norms
@@ -0,0 +1,418 @@
+"""
+Catalog watcher: polls saved Vinted searches and alerts on underpriced new listings
+
+Each search page is read as a stream and item IDs are pulled out of it as
+they arrive. IDs already scored are skipped with a rotating Bloom filter,
+and since searches are ordered newest first, reading stops after a run of
+known IDs. Only new listings are queued for the handler, which scrapes,
+matches and scores them locally. Listings worth buying become alerts,
+stored in SQLite and served best first.
+
+    WATCH_SEARCHES="https://www.vinted.fr/catalog?search_text=nike&order=newest_first" python watcher.py
+"""
+
+import hashlib
+import json
+import math
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urljoin
+
+from fetcher import shared_fetcher
+from item_cache import ITEM_CACHE_DB
+from metrics import metrics
+
+# Search or catalog URLs to watch, separated by commas or newlines
+WATCH_SEARCHES = os.getenv('WATCH_SEARCHES', '')
+
+# Seconds between two polls of the same search
+WATCH_INTERVAL = float(os.getenv('WATCH_INTERVAL', '30'))
+
+# Threads scraping and scoring new listings
+WATCH_WORKERS = int(os.getenv('WATCH_WORKERS', '16'))
+
+# New listings waiting for a worker; polling pauses while this many are queued
+WATCH_QUEUE_SIZE = int(os.getenv('WATCH_QUEUE_SIZE', '2000'))
+
+# Known listings in a row after which the rest of a newest-first page is skipped
+WATCH_STOP_AFTER_SEEN = int(os.getenv('WATCH_STOP_AFTER_SEEN', '20'))
+
+# Listings remembered per Bloom filter generation, and its false positive rate
+WATCH_SEEN_CAPACITY = int(os.getenv('WATCH_SEEN_CAPACITY', '1000000'))
+WATCH_SEEN_ERROR_RATE = float(os.getenv('WATCH_SEEN_ERROR_RATE', '0.001'))
+
+# Smallest expected profit in euros that raises an alert
+WATCH_MIN_PROFIT = float(os.getenv('WATCH_MIN_PROFIT', '10'))
+
+# Shared store for alerts, and how long they are kept in seconds
+WATCH_DB = os.getenv('WATCH_DB', ITEM_CACHE_DB)
+WATCH_ALERT_TTL = float(os.getenv('WATCH_ALERT_TTL', '86400'))
+
+# Old alerts are purged after this many new ones
+PURGE_EVERY = 200
+
+# Item links in search pages; the slug is optional
+LISTING_PATTERN = re.compile(rb'/items/(\d+)[\w-]*')
+
+# Longest item link kept across two chunks of a page
+MAX_LINK_BYTES = 256
+
+# Bytes read from a search page at a time
+CHUNK_SIZE = 16384
+
+
+def parse_searches(value):
+    return [url.strip() for url in re.split(r'[,\n]', value or '') if url.strip()]
+
+
+def listing_ids(chunks, base_url):
+    """Yield (item ID, absolute item URL) for every item link in a page read as chunks"""
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        consumed = 0
+        for match in LISTING_PATTERN.finditer(buffer):
+            if match.end() == len(buffer):
+                # The link may go on in the next chunk
+                break
+            yield match.group(1).decode(), urljoin(base_url, match.group(0).decode())
+            consumed = match.end()
+        buffer = buffer[max(consumed, len(buffer) - MAX_LINK_BYTES):]
+    for match in LISTING_PATTERN.finditer(buffer):
+        yield match.group(1).decode(), urljoin(base_url, match.group(0).decode())
+
+
+class BloomFilter:
+    """Fixed-size set of strings with no false negatives and a bounded false positive rate"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+class SeenListings:
+    """Listings already scored, in two Bloom filter generations
+
+    When the current generation holds its capacity it becomes the previous
+    one and the oldest listings are forgotten, so memory stays fixed and the
+    false positive rate never exceeds about twice the configured one.
+    """
+
+    def __init__(self, capacity=WATCH_SEEN_CAPACITY, error_rate=WATCH_SEEN_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = None
+        self._rotations = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, item_id):
+        with self._lock:
+            return item_id in self._current or (self._previous is not None and item_id in self._previous)
+
+    def add(self, item_id):
+        with self._lock:
+            if item_id in self._current:
+                return
+            if self._current.count >= self.capacity:
+                self._previous = self._current
+                self._current = BloomFilter(self.capacity, self.error_rate)
+                self._rotations += 1
+            self._current.add(item_id)
+
+    def stats(self):
+        with self._lock:
+            filters = [self._current] + ([self._previous] if self._previous is not None else [])
+            return {
+                'remembered': sum(bloom.count for bloom in filters),
+                'rotations': self._rotations,
+                'hashes': self._current.hashes,
+                'memory_kb': round(sum(len(bloom.bits) for bloom in filters) / 1024, 1),
+            }
+
+
+def listing_score(item_data, similar_items, prediction, total_cost):
+    """Expected and worst-case profit of buying a listing, or None when it cannot be priced
+
+    The local model's prediction is used when there is one, else the sold
+    prices of the comparables. Alerts are ranked by the worst-case profit,
+    at the low end of the 80% price interval or of the comparables, so
+    uncertain estimates rank below safe ones.
+    """
+    if prediction is not None:
+        resale_price = prediction['resale_price']
+        resale_low = prediction['price_interval'][0]
+        basis = 'local_model'
+    else:
+        sold_prices = sorted(float(item['sold_price']) for item in similar_items if item.get('sold_price'))
+        if not sold_prices:
+            return None
+        resale_price = sold_prices[len(sold_prices) // 2]
+        resale_low = sold_prices[0]
+        basis = 'comparables'
+    return {
+        'resale_price': round(resale_price, 2),
+        'expected_profit': round(resale_price - total_cost, 2),
+        'score': round(resale_low - total_cost, 2),
+        'basis': basis,
+    }
+
+
+class AlertStore:
+    """Alerts on underpriced listings, shared by the watcher and the web workers"""
+
+    def __init__(self, db_path=WATCH_DB, ttl=WATCH_ALERT_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connection(self):
+        """Per-thread SQLite connection, reopened after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS watch_alerts ('
+            ' item_id TEXT PRIMARY KEY,'
+            ' score REAL NOT NULL,'
+            ' alert TEXT NOT NULL,'
+            ' created_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS watch_alerts_score ON watch_alerts (score DESC)')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def add(self, alert):
+        """Store an alert; a listing alerts once, so repeats are ignored"""
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            'INSERT INTO watch_alerts (item_id, score, alert, created_at) VALUES (?, ?, ?, ?)'
+            ' ON CONFLICT (item_id) DO NOTHING',
+            (alert['item_id'], alert['score'], json.dumps(alert), now)
+        )
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % PURGE_EVERY == 0
+        if purge:
+            conn.execute('DELETE FROM watch_alerts WHERE created_at < ?', (now - self.ttl,))
+
+    def top(self, limit=50, max_age=None):
+        """Best alerts first, optionally only those raised in the last max_age seconds"""
+        oldest = time.time() - min(max_age if max_age is not None else self.ttl, self.ttl)
+        rows = self._connection().execute(
+            'SELECT alert, created_at FROM watch_alerts WHERE created_at >= ?'
+            ' ORDER BY score DESC, created_at DESC LIMIT ?',
+            (oldest, int(limit))
+        ).fetchall()
+        return [dict(json.loads(alert), created_at=created_at) for alert, created_at in rows]
+
+
+class CatalogWatcher:
+    """Polls searches and feeds the listings they show for the first time to a handler
+
+    handler(url) returns an alert dict for a listing worth buying, or None.
+    A listing whose handler raises is not remembered, so the next poll that
+    still shows it retries it.
+    """
+
+    def __init__(self, searches, handler, alerts=None, fetcher=shared_fetcher, interval=WATCH_INTERVAL,
+                 workers=WATCH_WORKERS, queue_size=WATCH_QUEUE_SIZE, stop_after_seen=WATCH_STOP_AFTER_SEEN,
+                 min_profit=WATCH_MIN_PROFIT, seen=None):
+        self.searches = list(searches)
+        self.handler = handler
+        self.alerts = alerts if alerts is not None else AlertStore()
+        self.fetcher = fetcher
+        self.interval = interval
+        self.workers = workers
+        self.stop_after_seen = stop_after_seen
+        self.min_profit = min_profit
+        self.seen = seen if seen is not None else SeenListings()
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        # Listings queued or being scored; never queued twice
+        self._pending = set()
+        self._started = False
+        self._counters = {
+            'polls': 0,
+            'poll_errors': 0,
+            'new': 0,
+            'known': 0,
+            'scored': 0,
+            'alerts': 0,
+            'failed': 0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def start(self):
+        """Start the poller and the worker threads"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for index in range(self.workers):
+            threading.Thread(target=self._run_worker, name=f'watch-worker-{index}', daemon=True).start()
+        threading.Thread(target=self._run_poller, name='watch-poller', daemon=True).start()
+        print(f"Watching {len(self.searches)} searches with {self.workers} workers")
+
+    def poll(self, search_url):
+        """Read one search page and queue its new listings; returns how many were queued"""
+        self._count('polls')
+        try:
+            response = self.fetcher.get(search_url, stream=True)
+        except Exception as e:
+            print(f"Error polling {search_url}: {e}")
+            self._count('poll_errors')
+            metrics.inc('vintelli_watch_polls_total', outcome='error')
+            return 0
+
+        queued = 0
+        known_run = 0
+        on_page = set()
+        try:
+            response.raise_for_status()
+            for item_id, url in listing_ids(response.iter_content(CHUNK_SIZE), search_url):
+                # Pages link each listing several times
+                if item_id in on_page:
+                    continue
+                on_page.add(item_id)
+                with self._lock:
+                    known = item_id in self._pending
+                    if not known:
+                        self._pending.add(item_id)
+                if not known and item_id in self.seen:
+                    known = True
+                    with self._lock:
+                        self._pending.discard(item_id)
+                if known:
+                    known_run += 1
+                    if known_run >= self.stop_after_seen:
+                        # Newest first: everything further down is older still
+                        break
+                    continue
+                known_run = 0
+                # Blocks while the workers are behind, which slows polling down
+                self.queue.put((item_id, url, search_url))
+                queued += 1
+        except Exception as e:
+            print(f"Error reading {search_url}: {e}")
+            self._count('poll_errors')
+            metrics.inc('vintelli_watch_polls_total', outcome='error')
+        else:
+            metrics.inc('vintelli_watch_polls_total', outcome='ok')
+        finally:
+            # Closing early drops the rest of the page unread
+            response.close()
+
+        known = len(on_page) - queued
+        self._count('new', queued)
+        self._count('known', known)
+        metrics.inc('vintelli_watch_listings_total', queued, outcome='new')
+        metrics.inc('vintelli_watch_listings_total', known, outcome='known')
+        return queued
+
+    def _run_poller(self):
+        while True:
+            started = time.monotonic()
+            for search_url in self.searches:
+                self.poll(search_url)
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def process(self, item_id, url, search_url):
+        """Score one new listing and store its alert if it is worth buying"""
+        try:
+            alert = self.handler(url)
+        except Exception as e:
+            print(f"Error scoring listing {url}: {e}")
+            self._count('failed')
+            metrics.inc('vintelli_watch_listings_total', outcome='failed')
+            return None
+        finally:
+            with self._lock:
+                self._pending.discard(item_id)
+
+        self.seen.add(item_id)
+        self._count('scored')
+        if alert is None or alert['expected_profit'] < self.min_profit:
+            metrics.inc('vintelli_watch_listings_total', outcome='scored')
+            return None
+
+        alert = dict(alert, item_id=item_id, search=search_url)
+        try:
+            self.alerts.add(alert)
+        except sqlite3.Error as e:
+            print(f"Error storing alert for {url}: {e}")
+        self._count('alerts')
+        metrics.inc('vintelli_watch_listings_total', outcome='alerted')
+        print(f"Alert: {alert.get('title')} at €{alert.get('price')}, "
+              f"expected profit €{alert['expected_profit']:.2f} ({url})")
+        return alert
+
+    def _run_worker(self):
+        while True:
+            item_id, url, search_url = self.queue.get()
+            try:
+                self.process(item_id, url, search_url)
+            finally:
+                self.queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['pending'] = len(self._pending)
+        stats['queued'] = self.queue.qsize()
+        stats['seen'] = self.seen.stats()
+        return stats
+
+
+def main():
+    """Watch WATCH_SEARCHES in the foreground, scoring listings with the app's pipeline"""
+    from app import watch_alerts, watch_listing
+
+    searches = parse_searches(WATCH_SEARCHES)
+    if not searches:
+        print('WATCH_SEARCHES is empty, nothing to watch')
+        return
+    watcher = CatalogWatcher(searches, watch_listing, alerts=watch_alerts)
+    watcher.start()
+    while True:
+        time.sleep(60)
+        print(f"Watcher stats: {json.dumps(watcher.stats())}")
+
+
+if __name__ == '__main__':
+    main()